@@ -0,0 +1,278 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
+import symbol_detector_pb2_grpc
+
+try:
+    from server.cancellation import CancelToken, bind, check as check_cancelled
+except ImportError:
+    from cancellation import CancelToken, bind, check as check_cancelled
+
+# How often a lane thread waiting for the next upload chunk checks for cancellation
+_POLL_SECONDS = 0.5
+_DONE = object()
+
+
+def _init_lane_thread(priority):
+    # Imported here: inference_scheduler pulls in torch, which the server only
+    # loads after the port is open
+    try:
+        from server.inference_scheduler import set_thread_priority
+    except ImportError:
+        from inference_scheduler import set_thread_priority
+    set_thread_priority(priority)
+
+
+class Lane:
+    """A class of RPCs with its own threads and admission limit.
+
+    Up to concurrency handlers run at once, on the lane's own thread pool, so
+    a busy lane never holds up another. Up to max_queue more wait for a slot;
+    beyond that requests are rejected with RESOURCE_EXHAUSTED instead of
+    queueing without bound. A queued request whose deadline passes (or whose
+    client cancels) leaves the queue without running. priority orders the
+    lane's embedding jobs in the batching scheduler (lower runs first).
+    """
+
+    def __init__(self, name, concurrency, max_queue, priority=0):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.priority = priority
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"{name}-lane",
+                                           initializer=_init_lane_thread, initargs=(priority,))
+        self._slots = None  # asyncio.Semaphore, created on the server's loop
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, context):
+        """Holds one of the lane's slots; aborts with RESOURCE_EXHAUSTED when the queue is full
+        and with DEADLINE_EXCEEDED when the deadline passes while queued."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                f"Server busy: {self.running} {self.name} requests running and "
+                                f"{self.waiting} queued, retry later")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), context.time_remaining())
+        except asyncio.TimeoutError:
+            self.expired += 1
+            await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED,
+                                f"Deadline passed while queued for the {self.name} lane")
+        except asyncio.CancelledError:
+            self.expired += 1
+            raise
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _ThreadContext:
+    """The part of a ServicerContext the synchronous handlers use, for a
+    handler running on a lane thread. The status it sets is copied to the
+    asyncio context (which belongs to the event loop) when it returns."""
+
+    def __init__(self, context, token):
+        self._context = context
+        self._token = token
+        self._code = None
+        self._details = None
+
+    def set_code(self, code):
+        self._code = code
+
+    def set_details(self, details):
+        self._details = details
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._details
+
+    def is_active(self):
+        return not self._token.cancelled
+
+    def time_remaining(self):
+        return self._context.time_remaining()
+
+    def apply(self):
+        if self._code is not None:
+            self._context.set_code(self._code)
+        if self._details is not None:
+            self._context.set_details(self._details)
+
+
+def _call_bound(token, handler, *args):
+    with bind(token):
+        return handler(*args)
+
+
+def _blocking_requests(request_iterator, loop):
+    """Synchronous view of an asyncio request stream, for a handler on a lane thread."""
+    while True:
+        future = asyncio.run_coroutine_threadsafe(request_iterator.__anext__(), loop)
+        while True:
+            try:
+                chunk = future.result(timeout=_POLL_SECONDS)
+                break
+            except StopAsyncIteration:
+                return
+            except concurrent.futures.TimeoutError:  # not the builtin before Python 3.11
+                try:
+                    check_cancelled()
+                except Exception:
+                    future.cancel()
+                    raise
+        yield chunk
+
+
+class AsyncSymbolDetectorServicer(symbol_detector_pb2_grpc.SymbolDetectorServicer):
+    """grpc.aio front end of a SymbolDetectorServicer.
+
+    The event loop only admits requests and moves messages. Each handler
+    still runs synchronously, on a thread of its RPC's lane: "predict"
+    (Predict, PredictBatch, RegisterReference, SearchLibrary) or "scan" (the
+    scans and AddLibraryPage), so cheap calls never wait behind long scans.
+    Health and GetStats answer from the loop. When the client cancels or its
+    deadline passes, the request's cancel token is set and the scan stops at
+    its next batch.
+    """
+
+    def __init__(self, servicer, lanes):
+        self.servicer = servicer
+        self.lanes = lanes  # "predict" / "scan" -> Lane
+
+    async def _unary(self, lane_name, handler, argument, context):
+        lane = self.lanes[lane_name]
+        async with lane.slot(context):
+            token = CancelToken.for_context(context)
+            thread_context = _ThreadContext(context, token)
+            future = asyncio.get_running_loop().run_in_executor(
+                lane.executor, functools.partial(_call_bound, token, handler, argument, thread_context))
+            try:
+                response = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Keep the slot until the handler has actually stopped
+                token.cancel()
+                await asyncio.wait([future])
+                raise
+            thread_context.apply()
+            return response
+
+    async def _streaming(self, lane_name, handler, request, context):
+        lane = self.lanes[lane_name]
+        async with lane.slot(context):
+            loop = asyncio.get_running_loop()
+            token = CancelToken.for_context(context)
+            thread_context = _ThreadContext(context, token)
+            items = asyncio.Queue()
+
+            # The whole generator runs on one lane thread (its metrics trace
+            # and cancel token are thread-local)
+            def produce():
+                with bind(token):
+                    try:
+                        for item in handler(request, thread_context):
+                            loop.call_soon_threadsafe(items.put_nowait, item)
+                    finally:
+                        loop.call_soon_threadsafe(items.put_nowait, _DONE)
+
+            future = loop.run_in_executor(lane.executor, produce)
+            try:
+                while (item := await items.get()) is not _DONE:
+                    yield item
+                await future
+                thread_context.apply()
+            finally:
+                if not future.done():
+                    token.cancel()
+                    await asyncio.wait([future])
+
+    async def Predict(self, request, context):
+        return await self._unary("predict", self.servicer.Predict, request, context)
+
+    async def PredictBatch(self, request, context):
+        return await self._unary("predict", self.servicer.PredictBatch, request, context)
+
+    async def RegisterReference(self, request, context):
+        return await self._unary("predict", self.servicer.RegisterReference, request, context)
+
+    async def SearchLibrary(self, request, context):
+        return await self._unary("predict", self.servicer.SearchLibrary, request, context)
+
+    async def ScanBlueprint(self, request, context):
+        return await self._unary("scan", self.servicer.ScanBlueprint, request, context)
+
+    async def ScanBlueprintMulti(self, request, context):
+        return await self._unary("scan", self.servicer.ScanBlueprintMulti, request, context)
+
+    async def AddLibraryPage(self, request, context):
+        return await self._unary("scan", self.servicer.AddLibraryPage, request, context)
+
+    async def ScanBlueprintUpload(self, request_iterator, context):
+        requests = _blocking_requests(request_iterator, asyncio.get_running_loop())
+        return await self._unary("scan", self.servicer.ScanBlueprintUpload, requests, context)
+
+    async def ScanBlueprintStream(self, request, context):
+        async for progress in self._streaming("scan", self.servicer.ScanBlueprintStream, request, context):
+            yield progress
+
+    async def ScanDocument(self, request, context):
+        async for page in self._streaming("scan", self.servicer.ScanDocument, request, context):
+            yield page
+
+    async def Health(self, request, context):
+        return self.servicer.Health(request, context)
+
+    async def GetStats(self, request, context):
+        return self.servicer.GetStats(request, context)
+
+
+async def serve_aio(servicer, port, lanes):
+    """Serves servicer with grpc.aio until terminated."""
+    server = grpc.aio.server()
+    symbol_detector_pb2_grpc.add_SymbolDetectorServicer_to_server(
+        AsyncSymbolDetectorServicer(servicer, lanes), server)
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    limits = ", ".join(f"{name} {lane.concurrency} running + {lane.max_queue} queued"
+                       for name, lane in lanes.items())
+    print(f"One Shot Detector Server (asyncio) started on port {port} ({limits})...")
+    try:
+        await server.wait_for_termination()
+    finally:
+        for lane in lanes.values():
+            lane.close()
@@ -1,130 +1,187 @@
-import streamlit as st
-import os
-import tempfile
-from PIL import Image, ImageDraw
-import io
-import numpy as np
-from streamlit_drawable_canvas import st_canvas # New Library
-from grpc_client import run_prediction, scan_blueprint
-
-st.set_page_config(page_title="Bobyard AI Detector", layout="wide")
-st.title("One-Shot Blueprint Scanner 🏗️")
-
-tab1, tab2 = st.tabs(["🔍 Simple Comparator", "🗺️ Smart Scanner (The Hook)"])
-
-# ==========================================
-# TAB 1: KEEP AS IS (Good for debugging)
-# ==========================================
-with tab1:
-    st.info("Upload two separate images to compare them.")
-    c1, c2 = st.columns(2)
-    ref_file = c1.file_uploader("Reference Symbol", type=["png", "jpg"], key="ref1")
-    query_file = c2.file_uploader("Query Image", type=["png", "jpg"], key="query1")
-    
-    if ref_file and query_file and st.button("Compare", key="btn1"):
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tf1:
-            tf1.write(ref_file.getvalue()); path1 = tf1.name
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tf2:
-            tf2.write(query_file.getvalue()); path2 = tf2.name
-        res = run_prediction(path1, path2)
-        if res and res.is_match: st.success(f"Match! Score: {res.similarity_score:.2f}")
-        else: st.error(f"No Match. Score: {res.similarity_score:.2f}")
-        os.remove(path1); os.remove(path2)
-
-# ==========================================
-# TAB 2: THE BOBYARD WORKFLOW
-# ==========================================
-with tab2:
-    st.markdown("### 1. Upload Blueprint & Select Target")
-    
-    blueprint_file = st.file_uploader("Upload Blueprint PDF/Image", type=["png", "jpg", "jpeg"], key="blue_canvas")
-    
-    if blueprint_file:
-        # Load and Resize Image for Display (otherwise canvas is too big)
-        original_image = Image.open(blueprint_file).convert("RGB")
-        w, h = original_image.size
-        aspect_ratio = w / h
-        
-        # Display width (responsive)
-        display_width = 700 
-        display_height = int(display_width / aspect_ratio)
-        
-        # Calculate Scale Factor (To translate canvas coords back to real pixels)
-        scale_factor = w / display_width
-        
-        st.write("👉 **Draw a box around the symbol you want to find:**")
-        
-        # DRAWING CANVAS
-        canvas_result = st_canvas(
-            fill_color="rgba(255, 165, 0, 0.3)",  # Transparent Orange
-            stroke_width=2,
-            stroke_color="#FF0000",
-            background_image=original_image.resize((display_width, display_height)),
-            update_streamlit=True,
-            height=display_height,
-            width=display_width,
-            drawing_mode="rect",
-            key="canvas",
-        )
-
-        # CHECK IF USER DREW A BOX
-        if canvas_result.json_data is not None:
-            objects = canvas_result.json_data["objects"]
-            
-            if len(objects) > 0:
-                # Get the last drawn box
-                box = objects[-1] 
-                
-                # Scale coords back to original image size
-                real_x = int(box["left"] * scale_factor)
-                real_y = int(box["top"] * scale_factor)
-                real_w = int(box["width"] * scale_factor)
-                real_h = int(box["height"] * scale_factor)
-                
-                # Crop the "One Shot" symbol
-                cropped_symbol = original_image.crop((real_x, real_y, real_x + real_w, real_y + real_h))
-                
-                # Preview the selection
-                st.sidebar.markdown("---")
-                st.sidebar.image(cropped_symbol, caption="Target Symbol (One-Shot)", width=150)
-                
-                if st.sidebar.button("🚀 Scan Entire Blueprint"):
-                    with st.spinner("Analyzing Blueprint..."):
-                        
-                        # Save Symbol and Blueprint to temp files for the gRPC client
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tf_sym:
-                            cropped_symbol.save(tf_sym, format="PNG")
-                            path_sym = tf_sym.name
-                        
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tf_blue:
-                            # We can just save the original bytes we already have
-                            blueprint_file.seek(0)
-                            tf_blue.write(blueprint_file.read())
-                            path_blue = tf_blue.name
-
-                        # CALL SERVER
-                        result = scan_blueprint(path_sym, path_blue)
-
-                        # CLEANUP
-                        os.remove(path_sym)
-                        os.remove(path_blue)
-
-                        # DRAW RESULTS
-                        if result:
-                            draw_img = original_image.copy()
-                            draw = ImageDraw.Draw(draw_img)
-                            
-                            # Draw boxes on full resolution image
-                            for match in result.matches:
-                                draw.rectangle(
-                                    [match.x, match.y, match.x + match.width, match.y + match.height],
-                                    outline="lime",
-                                    width=5
-                                )
-                            
-                            st.success(f"Found {len(result.matches)} matches!")
-                            st.image(draw_img, caption="Detection Results", use_column_width=True)
-                        else:
-                            st.error("Scan failed.")
-            else:
+import streamlit as st
+import os
+import tempfile
+from PIL import Image, ImageDraw
+import io
+import numpy as np
+from streamlit_drawable_canvas import st_canvas # New Library
+from grpc_client import run_prediction, scan_blueprint, scan_blueprint_stream, scan_document
+from documents import DEFAULT_DPI, Document
+
+st.set_page_config(page_title="Bobyard AI Detector", layout="wide")
+st.title("One-Shot Blueprint Scanner 🏗️")
+
+tab1, tab2 = st.tabs(["🔍 Simple Comparator", "🗺️ Smart Scanner (The Hook)"])
+
+# ==========================================
+# TAB 1: KEEP AS IS (Good for debugging)
+# ==========================================
+with tab1:
+    st.info("Upload two separate images to compare them.")
+    c1, c2 = st.columns(2)
+    ref_file = c1.file_uploader("Reference Symbol", type=["png", "jpg"], key="ref1")
+    query_file = c2.file_uploader("Query Image", type=["png", "jpg"], key="query1")
+    
+    if ref_file and query_file and st.button("Compare", key="btn1"):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tf1:
+            tf1.write(ref_file.getvalue()); path1 = tf1.name
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tf2:
+            tf2.write(query_file.getvalue()); path2 = tf2.name
+        res = run_prediction(path1, path2)
+        if res and res.is_match: st.success(f"Match! Score: {res.similarity_score:.2f}")
+        else: st.error(f"No Match. Score: {res.similarity_score:.2f}")
+        os.remove(path1); os.remove(path2)
+
+# ==========================================
+# TAB 2: THE BOBYARD WORKFLOW
+# ==========================================
+with tab2:
+    st.markdown("### 1. Upload Blueprint & Select Target")
+    
+    blueprint_file = st.file_uploader("Upload Blueprint PDF/Image", type=["png", "jpg", "jpeg", "pdf", "tif", "tiff"],
+                                      key="blue_canvas")
+    
+    if blueprint_file:
+        # PDFs and multi-page TIFFs: draw on one page, the scan covers them all.
+        # PDF pages are rendered at the DPI the server scans them at, so the
+        # symbol and the boxes are in the same pixels
+        document = Document(blueprint_file.getvalue(), dpi=DEFAULT_DPI)
+        is_document = document.is_pdf or document.page_count > 1
+        page_number = 1
+        if document.page_count > 1:
+            page_number = int(st.number_input("Page", min_value=1, max_value=document.page_count, value=1))
+
+        # Load and Resize Image for Display (otherwise canvas is too big)
+        original_image = document.page(page_number).convert("RGB")
+        w, h = original_image.size
+        aspect_ratio = w / h
+        
+        # Display width (responsive)
+        display_width = 700 
+        display_height = int(display_width / aspect_ratio)
+        
+        # Calculate Scale Factor (To translate canvas coords back to real pixels)
+        scale_factor = w / display_width
+        
+        st.write("👉 **Draw a box around the symbol you want to find:**")
+        
+        # DRAWING CANVAS
+        canvas_result = st_canvas(
+            fill_color="rgba(255, 165, 0, 0.3)",  # Transparent Orange
+            stroke_width=2,
+            stroke_color="#FF0000",
+            background_image=original_image.resize((display_width, display_height)),
+            update_streamlit=True,
+            height=display_height,
+            width=display_width,
+            drawing_mode="rect",
+            key="canvas",
+        )
+
+        # CHECK IF USER DREW A BOX
+        if canvas_result.json_data is not None:
+            objects = canvas_result.json_data["objects"]
+            
+            if len(objects) > 0:
+                # Get the last drawn box
+                box = objects[-1] 
+                
+                # Scale coords back to original image size
+                real_x = int(box["left"] * scale_factor)
+                real_y = int(box["top"] * scale_factor)
+                real_w = int(box["width"] * scale_factor)
+                real_h = int(box["height"] * scale_factor)
+                
+                # Crop the "One Shot" symbol
+                cropped_symbol = original_image.crop((real_x, real_y, real_x + real_w, real_y + real_h))
+                
+                # Preview the selection
+                st.sidebar.markdown("---")
+                st.sidebar.image(cropped_symbol, caption="Target Symbol (One-Shot)", width=150)
+                any_orientation = st.sidebar.checkbox("Also find rotated / mirrored copies")
+                
+                if st.sidebar.button("🚀 Scan Entire Blueprint"):
+                    with st.spinner("Analyzing Blueprint..."):
+                        
+                        # Save Symbol and Blueprint to temp files for the gRPC client
+                        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tf_sym:
+                            cropped_symbol.save(tf_sym, format="PNG")
+                            path_sym = tf_sym.name
+                        
+                        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tf_blue:
+                            # We can just save the original bytes we already have
+                            blueprint_file.seek(0)
+                            tf_blue.write(blueprint_file.read())
+                            path_blue = tf_blue.name
+
+                        # CALL SERVER (streamed: boxes show up as each band of the page finishes)
+                        progress_bar = st.progress(0.0, text="Scanning...")
+                        result_view = st.empty()
+                        draw_img = original_image.copy()
+                        draw = ImageDraw.Draw(draw_img)
+                        found, completed = 0, False
+
+                        if is_document:
+                            # One result per page; boxes are drawn for the page on screen
+                            per_page = {}
+                            for result in scan_document(path_sym, path_blue, dpi=DEFAULT_DPI,
+                                                        any_orientation=any_orientation):
+                                per_page[result.page] = len(result.matches)
+                                if result.page == page_number:
+                                    for match in result.matches:
+                                        draw.rectangle(
+                                            [match.x, match.y, match.x + match.width, match.y + match.height],
+                                            outline="lime",
+                                            width=5
+                                        )
+                                    result_view.image(draw_img, caption=f"Page {page_number}",
+                                                      use_column_width=True)
+                                progress_bar.progress(result.pages_done / result.pages_total,
+                                                      text=result.message)
+                                found += len(result.matches)
+                                completed = result.pages_done == result.pages_total
+                            if per_page:
+                                st.table({"Page": list(per_page), "Matches": list(per_page.values())})
+                        elif any_orientation:
+                            # Every orientation in one pass; only the one-shot RPC supports it
+                            response = scan_blueprint(path_sym, path_blue, any_orientation=True)
+                            if response is not None:
+                                for match in response.matches:
+                                    draw.rectangle(
+                                        [match.x, match.y, match.x + match.width, match.y + match.height],
+                                        outline="lime",
+                                        width=5
+                                    )
+                                found, completed = len(response.matches), True
+                                progress_bar.progress(1.0, text=response.message)
+                        else:
+                            for progress in scan_blueprint_stream(path_sym, path_blue):
+                                # Draw boxes on full resolution image
+                                for match in progress.matches:
+                                    draw.rectangle(
+                                        [match.x, match.y, match.x + match.width, match.y + match.height],
+                                        outline="lime",
+                                        width=5
+                                    )
+                                found += len(progress.matches)
+
+                                if progress.tiles_total:
+                                    progress_bar.progress(progress.tiles_done / progress.tiles_total,
+                                                          text=progress.message)
+                                if progress.matches:
+                                    result_view.image(draw_img, caption=f"{found} matches so far...",
+                                                      use_column_width=True)
+                                completed = progress.tiles_done == progress.tiles_total
+
+                        # CLEANUP
+                        os.remove(path_sym)
+                        os.remove(path_blue)
+
+                        # DRAW RESULTS
+                        if completed:
+                            st.success(f"Found {found} matches!")
+                            result_view.image(draw_img, caption="Detection Results", use_column_width=True)
+                        else:
+                            st.error("Scan failed.")
+            else:
                 st.info("Draw a rectangle on the image to select a symbol.")
\ No newline at end of file
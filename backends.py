@@ -0,0 +1,190 @@
+import argparse
+import copy
+import inspect
+import os
+import random
+import tempfile
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from PIL import Image
+
+# eager:       the plain fp32 torchvision module (default, reference for accuracy)
+# torchscript: traced + frozen graph, channels_last, optimized for inference
+# int8:        FX static int8 quantization calibrated on blueprint crops (CPU only)
+# onnx:        exported graph run by ONNX Runtime (needs the onnxruntime package)
+BACKENDS = ("eager", "torchscript", "int8", "onnx")
+
+
+class _ChannelsLast(nn.Module):
+    """Feeds inputs to a channels_last module in the matching memory format."""
+
+    def __init__(self, module):
+        super().__init__()
+        self.module = module
+
+    def forward(self, batch):
+        return self.module(batch.contiguous(memory_format=torch.channels_last))
+
+
+class _OnnxRuntimeModule:
+    """Callable wrapper so an ONNX Runtime session looks like a torch module."""
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        out = self.session.run(None, {self.input_name: batch.detach().cpu().contiguous().numpy()})[0]
+        return torch.from_numpy(out).to(batch.device)
+
+
+def calibration_crops(image_paths, transform, count=64, seed=0):
+    """Random symbol-sized windows from blueprint pages, as a [count,3,224,224] batch.
+
+    Used both to calibrate int8 activations and as the sample set for the
+    accuracy check, so both see the same kind of input the scanner does.
+    """
+    rng = random.Random(seed)
+    pages = [Image.open(p).convert("RGB") for p in image_paths]
+    crops = []
+    for k in range(count):
+        page = pages[k % len(pages)]
+        w, h = page.size
+        side = rng.randint(24, max(24, min(256, w, h)))
+        x, y = rng.randint(0, max(0, w - side)), rng.randint(0, max(0, h - side))
+        crops.append(transform(page.crop((x, y, x + side, y + side))))
+    return torch.stack(crops)
+
+
+def example_batch(calibration):
+    if calibration is not None:
+        return calibration[:8]
+    return torch.randn(8, 3, 224, 224, generator=torch.Generator().manual_seed(0))
+
+
+def build_backend(name, feature_extractor, device, calibration=None):
+    """Returns a callable mapping a [N,3,224,224] batch to [N,512,1,1] features.
+
+    feature_extractor is the eager fp32 module; it is left untouched so the
+    dense engine and the accuracy check can keep using it.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', expected one of {BACKENDS}")
+
+    if name == "eager":
+        return feature_extractor
+
+    example = example_batch(calibration).to(device)
+
+    if name == "torchscript":
+        module = _ChannelsLast(
+            _clone(feature_extractor).to(device).to(memory_format=torch.channels_last).eval()
+        )
+        with torch.inference_mode():
+            traced = torch.jit.trace(module, example)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+    if name == "int8":
+        if str(device) != "cpu":
+            raise ValueError("The int8 backend only runs on CPU")
+        if calibration is None:
+            raise ValueError("The int8 backend needs calibration crops (blueprint images)")
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+        torch.backends.quantized.engine = engine
+        prepared = prepare_fx(_clone(feature_extractor).cpu().eval(),
+                              get_default_qconfig_mapping(engine), example_inputs=(example,))
+        with torch.inference_mode():
+            for chunk in calibration.split(16):
+                prepared(chunk)
+        return convert_fx(prepared)
+
+    # onnx
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("The onnx backend needs the 'onnxruntime' package") from e
+
+    # The session reads the whole model when it is created, so the file can go right after
+    # Newer torch exports through dynamo by default; keep the TorchScript
+    # exporter, whose dynamic_axes older versions (without the keyword) use too
+    export_options = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_options["dynamo"] = False
+    with tempfile.TemporaryDirectory(prefix="symbol_detector_") as directory:
+        path = os.path.join(directory, "feature_extractor.onnx")
+        torch.onnx.export(_clone(feature_extractor).cpu().eval(), example.cpu(), path,
+                          input_names=["images"], output_names=["features"],
+                          dynamic_axes={"images": {0: "batch"}, "features": {0: "batch"}}, **export_options)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    return _OnnxRuntimeModule(session)
+
+
+def _clone(module):
+    return copy.deepcopy(module)
+
+
+def check_accuracy(eager, backend, samples, tolerance=0.02):
+    """Compares backend embeddings with the eager fp32 ones on the same samples.
+
+    Returns a report dict. "max_score_error" is the largest change of any
+    pairwise cosine score between samples (what the scanner thresholds on);
+    "min_embedding_cosine" is the worst per-sample cos(eager, backend).
+    """
+    with torch.inference_mode():
+        ref = F.normalize(eager(samples).flatten(1).float().cpu(), dim=1)
+        got = F.normalize(backend(samples).flatten(1).float().cpu(), dim=1)
+    score_error = (ref @ ref.T - got @ got.T).abs().max().item()
+    return {
+        "max_score_error": score_error,
+        "min_embedding_cosine": (ref * got).sum(1).min().item(),
+        "tolerance": tolerance,
+        "ok": score_error <= tolerance,
+    }
+
+
+def measure_latency(backend, batch, iterations=10):
+    """Median seconds per forward pass of batch (after one warm-up run)."""
+    timings = []
+    with torch.inference_mode():
+        backend(batch)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            backend(batch)
+            timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+if __name__ == "__main__":
+    # Pick a backend per deployment: latency and accuracy of each on real pages
+    try:
+        from server.model import SiameseNetwork
+    except ImportError:
+        from model import SiameseNetwork
+
+    parser = argparse.ArgumentParser(description="Compare SiameseNetwork inference backends")
+    parser.add_argument("blueprints", nargs="+", help="Blueprint images to draw sample crops from")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--tolerance", type=float, default=0.02)
+    args = parser.parse_args()
+
+    for name in args.backends:
+        try:
+            model = SiameseNetwork(backend=name, calibration_images=args.blueprints,
+                                   accuracy_tolerance=args.tolerance, strict_accuracy=False)
+        except (ImportError, ValueError) as e:
+            print(f"{name:12s} unavailable: {e}")
+            continue
+        batch = calibration_crops(args.blueprints, model.transform, count=args.batch_size, seed=1)
+        latency = measure_latency(model.backend, batch.to(model.device))
+        report = model.accuracy_report or {"max_score_error": 0.0, "ok": True}
+        print(f"{name:12s} {latency * 1000:8.1f} ms/batch  "
+              f"max score error {report['max_score_error']:.4f}  {'OK' if report['ok'] else 'OUT OF TOLERANCE'}")
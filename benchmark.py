@@ -0,0 +1,374 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+import torch
+from PIL import Image, ImageDraw
+
+try:
+    from server.metrics import STAGES, Metrics
+except ImportError:
+    from metrics import STAGES, Metrics
+
+
+# --- Synthetic blueprints -------------------------------------------------
+
+def _valve(d, s, w):
+    d.ellipse([w, w, s - w - 1, s - w - 1], outline=0, width=w)
+    d.line([w, s // 2, s - w - 1, s // 2], fill=0, width=w)
+
+
+def _outlet(d, s, w):
+    d.ellipse([w, w, s - w - 1, s - w - 1], outline=0, width=w)
+    d.line([s // 3, s // 4, s // 3, 3 * s // 4], fill=0, width=w)
+    d.line([2 * s // 3, s // 4, 2 * s // 3, 3 * s // 4], fill=0, width=w)
+
+
+def _switch(d, s, w):
+    d.rectangle([w, w, s - w - 1, s - w - 1], outline=0, width=w)
+    d.line([w, s - w - 1, s - w - 1, w], fill=0, width=w)
+
+
+def _door(d, s, w):
+    d.arc([-s + w, w, s - w - 1, 2 * s - w], 270, 360, fill=0, width=w)
+    d.line([w, w, w, s - w - 1], fill=0, width=w)
+
+
+def _fixture(d, s, w):
+    d.polygon([(s // 2, w), (s - w - 1, s - w - 1), (w, s - w - 1)], outline=0, width=w)
+    d.ellipse([s // 2 - s // 8, 2 * s // 3 - s // 8, s // 2 + s // 8, 2 * s // 3 + s // 8], fill=0)
+
+
+SYMBOLS = {"valve": _valve, "outlet": _outlet, "switch": _switch, "door": _door, "fixture": _fixture}
+
+
+def make_symbol(kind, size=48):
+    """A size x size drawing of one of SYMBOLS, black on white, in L."""
+    image = Image.new("L", (size, size), 255)
+    SYMBOLS[kind](ImageDraw.Draw(image), size, max(2, size // 16))
+    return image
+
+
+def _overlaps(box, boxes, margin):
+    x, y, w, h = box
+    return any(x < bx + bw + margin and bx < x + w + margin and
+               y < by + bh + margin and by < y + h + margin for bx, by, bw, bh in boxes)
+
+
+def make_blueprint(width, height, symbol, count, symbol_scales=(1.0,), distractors=None,
+                   seed=0, clutter=1.0, orientations=None):
+    """Draws a page with count copies of symbol at known places; returns (page, ground truth).
+
+    The page is line work like a floor plan (walls, dimension lines, text-like
+    marks, distractors: other symbols). Copies of symbol are pasted on top,
+    each scaled by one of symbol_scales and turned into one of orientations
+    ((rotation, mirrored) pairs, see scanner.ORIENTATIONS; default upright)
+    in turn, and never touch each other or a distractor. Ground truth is a
+    list of (x, y, w, h) boxes.
+    """
+    rng = random.Random(seed)
+    page = Image.new("L", (width, height), 255)
+    d = ImageDraw.Draw(page)
+    area = width * height / 1e6 * clutter
+
+    # Walls: axis-aligned rectangles and partitions
+    for _ in range(int(12 * area)):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1 = min(width - 1, x0 + rng.randrange(80, 600))
+        y1 = min(height - 1, y0 + rng.randrange(80, 600))
+        d.rectangle([x0, y0, x1, y1], outline=0, width=rng.choice((2, 3, 4)))
+    # Dimension lines with end ticks
+    for _ in range(int(20 * area)):
+        x, y, length = rng.randrange(width), rng.randrange(height), rng.randrange(40, 300)
+        if rng.random() < 0.5:
+            d.line([x, y, x + length, y], fill=0, width=1)
+            d.line([x, y - 4, x, y + 4], fill=0, width=1)
+            d.line([x + length, y - 4, x + length, y + 4], fill=0, width=1)
+        else:
+            d.line([x, y, x, y + length], fill=0, width=1)
+            d.line([x - 4, y, x + 4, y], fill=0, width=1)
+            d.line([x - 4, y + length, x + 4, y + length], fill=0, width=1)
+    # Text-like marks: rows of small glyph boxes
+    for _ in range(int(40 * area)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        for k in range(rng.randrange(3, 10)):
+            gx = x + k * 7
+            d.line([gx, y, gx + rng.randrange(2, 6), y + rng.randrange(4, 9)], fill=0, width=1)
+
+    placed, truth = [], []
+
+    def paste(image):
+        w, h = image.size
+        if w >= width or h >= height:
+            return None
+        for _ in range(200):
+            box = (rng.randrange(width - w), rng.randrange(height - h), w, h)
+            if not _overlaps(box, placed, margin=max(w, h) // 2):
+                page.paste(image, box[:2])
+                placed.append(box)
+                return box
+        return None
+
+    if orientations:
+        try:
+            from server.scanner import orient
+        except ImportError:
+            from scanner import orient
+    for k in range(count):
+        scale = symbol_scales[k % len(symbol_scales)]
+        w, h = symbol.size
+        copy = symbol.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.BILINEAR)
+        if orientations:
+            copy = orient(copy, *orientations[k % len(orientations)])
+        box = paste(copy)
+        if box:
+            truth.append(box)
+    for image in distractors or []:
+        paste(image)
+    return page, truth
+
+
+# --- Measurement ----------------------------------------------------------
+
+def reset_peak_rss():
+    """Restarts the process's peak RSS count (Linux); False where that is not possible."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (since reset_peak_rss, where supported)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def match_detections(matches, truth, iou_threshold=0.5):
+    """Precision/recall of scanner matches against ground-truth (x, y, w, h) boxes.
+
+    Matches are taken best score first; each takes the unclaimed ground-truth
+    box it overlaps most, if that IoU reaches iou_threshold.
+    """
+    claimed = set()
+    tp = 0
+    for m in sorted(matches, key=lambda m: m["score"], reverse=True):
+        box = (m["x"], m["y"], m["width"], m["height"])
+        best, best_iou = None, iou_threshold
+        for i, t in enumerate(truth):
+            if i not in claimed:
+                overlap = _iou(box, t)
+                if overlap >= best_iou:
+                    best, best_iou = i, overlap
+        if best is not None:
+            claimed.add(best)
+            tp += 1
+    fp, fn = len(matches) - tp, len(truth) - tp
+    precision = tp / len(matches) if matches else 1.0
+    recall = tp / len(truth) if truth else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"tp": tp, "fp": fp, "fn": fn, "precision": precision, "recall": recall, "f1": f1}
+
+
+def _summary(values):
+    values = sorted(values)
+    return {"median": values[len(values) // 2], "min": values[0], "max": values[-1]}
+
+
+def run_case(scanner, ref_bytes, page_bytes, page_size, truth, engine, scales,
+             threshold=0.85, repeats=3, iou_threshold=0.5, any_orientation=False):
+    """Scans one page repeats times; returns latency, stage split, throughput, memory and accuracy."""
+    totals, stages, windows, matches = [], [], 0, []
+    peak_ok = reset_peak_rss()
+    tracing = Metrics(enabled=False)
+    for _ in range(repeats):
+        # The stages the server reports for include_timings (metrics spans);
+        # what no span covers is reported as "other"
+        with tracing.request("benchmark", trace=True) as trace:
+            # The scanner's progress prints would end up in the JSON on stdout
+            with redirect_stdout(sys.stderr):
+                start = time.perf_counter()
+                matches = scanner.scan(ref_bytes, page_bytes, threshold=threshold, engine=engine,
+                                       scales=scales, any_orientation=any_orientation)
+                total = time.perf_counter() - start
+        totals.append(total)
+        split = dict.fromkeys(STAGES, 0.0)
+        split.update(trace.seconds)
+        split["other"] = max(0.0, total - sum(trace.seconds.values()))
+        stages.append(split)
+        windows = trace.counts.get("windows", 0)
+
+    median = _summary(totals)["median"]
+    megapixels = page_size[0] * page_size[1] / 1e6
+    return {
+        "latency_s": _summary(totals),
+        "stages_s": {k: _summary([s[k] for s in stages])["median"] for k in stages[0]},
+        "throughput": {"pages_per_s": 1.0 / median, "megapixels_per_s": megapixels / median,
+                       "windows_per_s": windows / median},
+        "windows": windows,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_scope": "case" if peak_ok else "process",
+        "accuracy": match_detections(matches, truth, iou_threshold),
+    }
+
+
+def case_key(case):
+    key = f"{case['page']} {case['engine']} scales={case['scales']} symbol_scales={case['symbol_scales']}"
+    if case.get("rotated"):
+        key += " rotated"
+    return key + (" any_orientation" if case.get("any_orientation") else "")
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {"commit": commit or None, "python": platform.python_version(), "torch": torch.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(), "threads": torch.get_num_threads(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Prints latency and recall changes of results against a baseline run; returns the regressed cases."""
+    before = {case_key(c): c for c in baseline["cases"]}
+    regressed = []
+    for case in results["cases"]:
+        key = case_key(case)
+        if key not in before:
+            print(f"{key}: not in baseline", file=sys.stderr)
+            continue
+        old, new = before[key], case
+        ratio = new["latency_s"]["median"] / old["latency_s"]["median"]
+        recall = new["accuracy"]["recall"] - old["accuracy"]["recall"]
+        precision = new["accuracy"]["precision"] - old["accuracy"]["precision"]
+        flag = ""
+        if ratio > 1 + tolerance or recall < 0 or precision < -tolerance:
+            regressed.append(key)
+            flag = "  REGRESSION"
+        print(f"{key}: latency x{ratio:.2f}  recall {recall:+.3f}  precision {precision:+.3f}{flag}",
+              file=sys.stderr)
+    return regressed
+
+
+if __name__ == "__main__":
+    # Offline, reproducible scan benchmark: synthetic pages with known symbols
+    try:
+        from server.model import SiameseNetwork
+        from server.scanner import ORIENTATIONS, BlueprintScanner
+        from server.backends import BACKENDS
+        from server.page_index import parse_window
+    except ImportError:
+        from model import SiameseNetwork
+        from scanner import ORIENTATIONS, BlueprintScanner
+        from backends import BACKENDS
+        from page_index import parse_window
+
+    parser = argparse.ArgumentParser(description="Benchmark BlueprintScanner on synthetic blueprints")
+    parser.add_argument("--output", default=None, help="Write the results as JSON here (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="Earlier --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Slowdown (fraction) or precision drop flagged as a regression")
+    parser.add_argument("--pages", type=parse_window, nargs="+", default=[(1600, 1200)],
+                        help="Page sizes WxH")
+    parser.add_argument("--engines", nargs="+", default=list(BlueprintScanner.ENGINES),
+                        choices=BlueprintScanner.ENGINES)
+    parser.add_argument("--symbol", default="valve", choices=sorted(SYMBOLS))
+    parser.add_argument("--symbol-size", type=int, default=48)
+    parser.add_argument("--symbols", type=int, default=12, help="Copies of the symbol per page")
+    parser.add_argument("--symbol-scales", type=float, nargs="+", default=[1.0],
+                        help="Sizes of the copies relative to the reference")
+    parser.add_argument("--rotated", action="store_true",
+                        help="Copies take all 8 orientations (rotated / mirrored) in turn")
+    parser.add_argument("--scales", type=float, nargs="+", default=None, help="Scan pyramid scales")
+    parser.add_argument("--any-orientation", action="store_true",
+                        help="Scan for the symbol in every orientation (scan_oriented)")
+    parser.add_argument("--clutter", type=float, default=1.0, help="Line work density")
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU for a match to count as a hit")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--tiled", action="store_true", help="Scan with tiled page decoding")
+    parser.add_argument("--backend", default="eager", choices=BACKENDS)
+    parser.add_argument("--weights", default=None)
+    parser.add_argument("--save-pages", default=None, help="Directory to write the generated pages to")
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    with redirect_stdout(sys.stderr):
+        model = SiameseNetwork(backend=args.backend, weights_path=args.weights)
+        model.warm_up(args.batch_size)
+    scanner = BlueprintScanner(model, batch_size=args.batch_size, tiled=args.tiled)
+
+    reference = make_symbol(args.symbol, args.symbol_size)
+    ref_bytes = io.BytesIO()
+    reference.save(ref_bytes, format="PNG")
+    ref_bytes = ref_bytes.getvalue()
+    distractors = [make_symbol(kind, args.symbol_size) for kind in sorted(SYMBOLS) if kind != args.symbol]
+
+    settings = {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "save_pages")}
+    settings["model"] = model.fingerprint
+    results = {"environment": environment(), "settings": settings, "cases": []}
+    for width, height in args.pages:
+        page, truth = make_blueprint(width, height, reference, args.symbols, args.symbol_scales,
+                                     distractors * max(1, args.symbols // len(distractors)),
+                                     seed=args.seed, clutter=args.clutter,
+                                     orientations=ORIENTATIONS if args.rotated else None)
+        encoded = io.BytesIO()
+        page.save(encoded, format="PNG")
+        page_bytes = encoded.getvalue()
+        if args.save_pages:
+            os.makedirs(args.save_pages, exist_ok=True)
+            page.save(os.path.join(args.save_pages, f"page-{width}x{height}-{args.seed}.png"))
+
+        for engine in args.engines:
+            case = {"page": f"{width}x{height}", "engine": engine, "scales": args.scales,
+                    "symbol_scales": args.symbol_scales, "symbols": len(truth),
+                    "rotated": args.rotated, "any_orientation": args.any_orientation}
+            case.update(run_case(scanner, ref_bytes, page_bytes, (width, height), truth,
+                                 engine, args.scales, args.threshold, args.repeats, args.iou,
+                                 args.any_orientation))
+            results["cases"].append(case)
+            print(f"{case_key(case)}: {case['latency_s']['median']:.2f}s  "
+                  f"recall {case['accuracy']['recall']:.2f}  precision {case['accuracy']['precision']:.2f}  "
+                  f"peak {case['peak_rss_mb']:.0f} MB", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(results, json.load(f), args.tolerance)
+        sys.exit(1 if regressed else 0)
@@ -0,0 +1,90 @@
+import threading
+import time
+
+_local = threading.local()
+
+
+class ScanCancelled(Exception):
+    """Raised inside a request whose client went away or whose deadline passed."""
+
+
+class CancelToken:
+    """Cancellation state of one request, polled by the long scan loops.
+
+    Set explicitly (the client cancelled) or, lazily, once the deadline
+    (a time.monotonic() value) has passed. reason stays None until the
+    token is found cancelled.
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.reason = None
+        self._event = threading.Event()
+
+    @classmethod
+    def for_context(cls, context):
+        """Follows the deadline of a gRPC context (None when it has none)."""
+        remaining = context.time_remaining() if hasattr(context, "time_remaining") else None
+        return cls(None if remaining is None else time.monotonic() + remaining)
+
+    def cancel(self, reason=None):
+        if not self._event.is_set():
+            if reason is None:
+                expired = self.deadline is not None and time.monotonic() >= self.deadline
+                reason = "deadline exceeded" if expired else "cancelled by the client"
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel()
+        return self._event.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise ScanCancelled(f"Scan stopped: {self.reason}")
+
+
+class _Bound:
+    def __init__(self, token):
+        self.token = token
+
+    def __enter__(self):
+        self.previous = getattr(_local, "token", None)
+        _local.token = self.token
+        return self.token
+
+    def __exit__(self, *exc):
+        _local.token = self.previous
+        return False
+
+
+def current():
+    """The cancel token of the request running on this thread, or None."""
+    return getattr(_local, "token", None)
+
+
+def bind(token):
+    """Context manager making token the current one on this thread."""
+    return _Bound(token)
+
+
+def for_rpc(context):
+    """Token of an RPC: the one already bound on this thread (the asyncio
+    server binds its own), else a new one that follows context's deadline
+    and is cancelled when the RPC terminates."""
+    token = getattr(_local, "token", None)
+    if token is None:
+        token = CancelToken.for_context(context)
+        add_callback = getattr(context, "add_callback", None)
+        if add_callback is not None:
+            add_callback(token.cancel)
+    return token
+
+
+def check():
+    """Raises ScanCancelled if the request running on this thread was cancelled."""
+    token = getattr(_local, "token", None)
+    if token is not None:
+        token.check()
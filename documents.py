@@ -0,0 +1,184 @@
+import io
+import queue
+import threading
+
+from PIL import Image
+
+try:
+    from server.metrics import span
+    from server.page_reader import load_page
+except ImportError:
+    from metrics import span
+    from page_reader import load_page
+
+# Rasterization resolution of PDF pages when the caller doesn't pick one
+DEFAULT_DPI = 150
+# PDF coordinates are in points
+_POINTS_PER_INCH = 72
+_PDF_MAGIC = b"%PDF-"
+
+# pdfium keeps global state and must not be entered from two threads at once
+_pdfium_lock = threading.Lock()
+_END = object()
+
+
+def _pdfium():
+    try:
+        import pypdfium2
+    except ImportError as e:
+        raise ImportError("PDF documents need the 'pypdfium2' package") from e
+    return pypdfium2
+
+
+def _head(source, n):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:n])
+    if hasattr(source, "read"):
+        position = source.tell()
+        head = source.read(n)
+        source.seek(position)
+        return head
+    with open(source, "rb") as f:
+        return f.read(n)
+
+
+def is_pdf(source):
+    """Whether source (bytes, a path or a seekable binary file) is a PDF."""
+    return _head(source, 1024).lstrip().startswith(_PDF_MAGIC)
+
+
+class Document:
+    """The pages of a drawing set: a PDF, a multi-page image (TIFF) or one image.
+
+    PDF pages are rasterized at dpi with pypdfium2 (greyscale, white paper);
+    raster pages are used at their own resolution. pages() renders one page
+    at a time, so the document never holds more than the page it is on.
+    numbers picks 1-based pages (default: all).
+    """
+
+    def __init__(self, source, dpi=DEFAULT_DPI, numbers=None):
+        if isinstance(source, (bytearray, memoryview)):
+            source = bytes(source)
+        self.source = source
+        self.dpi = dpi or DEFAULT_DPI
+        self.is_pdf = is_pdf(source)
+        if self.is_pdf:
+            pdfium = _pdfium()
+            with _pdfium_lock:
+                pdf = pdfium.PdfDocument(source)
+                try:
+                    self.page_count = len(pdf)
+                finally:
+                    pdf.close()
+        else:
+            with self._open_image() as image:
+                self.page_count = getattr(image, "n_frames", 1)
+        self.numbers = list(numbers) if numbers else list(range(1, self.page_count + 1))
+        bad = [n for n in self.numbers if not 1 <= n <= self.page_count]
+        if bad:
+            raise ValueError(f"Pages {bad} are not in the document (it has {self.page_count})")
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def _open_image(self):
+        source = self.source
+        if isinstance(source, bytes):
+            return Image.open(io.BytesIO(source))
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return Image.open(source)
+
+    def pages(self, numbers=None):
+        """Yields (page number, page image in L or RGB), rendering each on demand.
+
+        numbers, if given, replaces the document's own page selection.
+        """
+        numbers = self.numbers if numbers is None else numbers
+        if self.is_pdf:
+            yield from self._pdf_pages(numbers)
+            return
+        with self._open_image() as image:
+            for number in numbers:
+                image.seek(number - 1)
+                # A copy: the frame object is reused by the next seek
+                yield number, load_page(image.copy())
+
+    def page(self, number):
+        """Renders the one 1-based page number (any page, selected or not)."""
+        if not 1 <= number <= self.page_count:
+            raise ValueError(f"Page {number} is not in the document (it has {self.page_count})")
+        pages = self.pages([number])
+        try:
+            return next(pages)[1]
+        finally:
+            pages.close()
+
+    def _pdf_pages(self, numbers):
+        pdfium = _pdfium()
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(self.source)
+        try:
+            for number in numbers:
+                with _pdfium_lock:
+                    page = pdf[number - 1]
+                    try:
+                        bitmap = page.render(scale=self.dpi / _POINTS_PER_INCH, grayscale=True)
+                        image = bitmap.to_pil()
+                    finally:
+                        page.close()
+                yield number, load_page(image)
+        finally:
+            with _pdfium_lock:
+                pdf.close()
+
+
+def prefetch(iterable):
+    """Iterates iterable on a producer thread, one item ahead of the consumer.
+
+    The producer starts on item n+1 as soon as the consumer takes item n,
+    so producing (e.g. rasterizing a page) overlaps with consuming (scanning
+    the previous one), and at most two items exist at a time. Exceptions are
+    re-raised in the consumer; closing the generator stops the producer after
+    the item it is on, and the producer then closes iterable's iterator (so
+    e.g. a document's file is released when the consumer stops early).
+    """
+    items = queue.Queue()
+    ready = threading.Semaphore(1)  # taken while the producer works on an item
+    stop = threading.Event()
+
+    def produce():
+        iterator = None
+        try:
+            iterator = iter(iterable)
+            while True:
+                ready.acquire()
+                if stop.is_set():
+                    return
+                item = next(iterator, _END)
+                items.put((item, None))
+                if item is _END:
+                    return
+        except BaseException as e:
+            items.put((_END, e))
+        finally:
+            # Closed here: from the consumer it could catch the generator mid-item
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+    try:
+        while True:
+            # Only the part of producing that didn't overlap the consumer
+            with span("decode"):
+                item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            ready.release()
+            yield item
+            item = None
+    finally:
+        stop.set()
+        ready.release()
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class EmbeddingCache:
+    """Bounded LRU cache of image embeddings, keyed by a hash of the image bytes.
+
+    Entries are evicted least-recently-used first whenever either the entry
+    count or the total embedding size goes over its limit.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(image_bytes):
+        return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+    @staticmethod
+    def _nbytes(value):
+        # Values are (embedding tensor, extra...) tuples, or tuples of those (a
+        # reference in every orientation); tensors and numpy arrays (e.g. the
+        # cascade template) are counted
+        nbytes = 0
+        for part in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(part, tuple):
+                nbytes += EmbeddingCache._nbytes(part)
+            elif hasattr(part, "element_size"):
+                nbytes += part.element_size() * part.nelement()
+            elif hasattr(part, "nbytes"):
+                nbytes += part.nbytes
+        return nbytes
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = self._nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if self.max_entries == 0 or nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def get_or_compute(self, image_bytes, compute):
+        """Returns the cached value for image_bytes, calling compute(image_bytes) on a miss."""
+        key = self.key(image_bytes)
+        value = self.get(key)
+        if value is None:
+            # Computed outside the lock so a slow forward pass doesn't block hits
+            value = compute(image_bytes)
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -1,130 +1,435 @@
-# client/grpc_client.py
-import grpc
-import sys
-import os
-import argparse
-
-# -----------------------------------------------------------------------------
-# 1. Setup Path to find Generated Files
-# -----------------------------------------------------------------------------
-# Finds the folder relative to where this script is located
-current_dir = os.path.dirname(os.path.abspath(__file__))
-generated_dir = os.path.join(current_dir, '../generated')
-
-# Add 'generated' to Python's search path BEFORE importing protobufs
-sys.path.append(generated_dir)
-
-import symbol_detector_pb2
-import symbol_detector_pb2_grpc
-
-# -----------------------------------------------------------------------------
-# 2. Client Logic
-# -----------------------------------------------------------------------------
-def run_prediction(ref_path, query_path):
-    """
-    Sends two images to the gRPC server and returns the response object.
-    """
-    # Check if files exist
-    if not os.path.exists(ref_path):
-        print(f"Error: Reference file not found at: {ref_path}")
-        return None
-    if not os.path.exists(query_path):
-        print(f"Error: Query file not found at: {query_path}")
-        return None
-
-    # Read images as raw bytes
-    try:
-        with open(ref_path, "rb") as f:
-            ref_bytes = f.read()
-        with open(query_path, "rb") as f:
-            query_bytes = f.read()
-    except Exception as e:
-        print(f"Error reading files: {e}")
-        return None
-
-    print(f"Connecting to server at localhost:50051...")
-    
-    # Open gRPC Channel
-    # (Increase max message size if sending high-res images, e.g., 10MB)
-    options = [('grpc.max_send_message_length', 10 * 1024 * 1024),
-               ('grpc.max_receive_message_length', 10 * 1024 * 1024)]
-               
-    with grpc.insecure_channel('localhost:50051', options=options) as channel:
-        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
-        
-        # Create Request Object
-        request = symbol_detector_pb2.PredictRequest(
-            reference_image=ref_bytes,
-            query_image=query_bytes
-        )
-
-        try:
-            print(f"Sending request... (Ref: {len(ref_bytes)} bytes, Query: {len(query_bytes)} bytes)")
-            response = stub.Predict(request)
-            return response
-        except grpc.RpcError as e:
-            print(f"❌ gRPC Failed: {e.code()}")
-            print(f"   Details: {e.details()}")
-            return None
-# client/grpc_client.py
-
-# ... (Previous imports and run_prediction function remain the same) ...
-
-def scan_blueprint(ref_path, blueprint_path):
-    """
-    Sends a reference symbol and a full blueprint to the server.
-    Returns the ScanResponse object containing bounding boxes.
-    """
-    if not os.path.exists(ref_path) or not os.path.exists(blueprint_path):
-        return None
-
-    # Read images
-    with open(ref_path, "rb") as f:
-        ref_bytes = f.read()
-    with open(blueprint_path, "rb") as f:
-        blue_bytes = f.read()
-
-    # Increase message size limit (Blueprints can be large!)
-    options = [('grpc.max_send_message_length', 50 * 1024 * 1024),
-               ('grpc.max_receive_message_length', 50 * 1024 * 1024)]
-
-    with grpc.insecure_channel('localhost:50051', options=options) as channel:
-        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
-        
-        request = symbol_detector_pb2.ScanRequest(
-            reference_image=ref_bytes,
-            blueprint_image=blue_bytes
-        )
-
-        try:
-            print("Sending Scan Request...")
-            response = stub.ScanBlueprint(request)
-            return response
-        except grpc.RpcError as e:
-            print(f"Scan Failed: {e.code()} - {e.details()}")
-            return None
-# -----------------------------------------------------------------------------
-# 3. Main Execution (CLI)
-# -----------------------------------------------------------------------------
-# -----------------------------------------------------------------------------
-# 3. Main Execution
-# -----------------------------------------------------------------------------
-if __name__ == "__main__":
-    #  vvv  PASTE YOUR PATHS HERE  vvv
-    
-    # Windows Example: r"C:\Users\Name\Desktop\symbol.png" (Use 'r' for Windows paths)
-    # Mac/Linux Example: "/Users/name/Desktop/symbol.png"
-    
-    my_ref_path = r"C:\Users\dhari\Downloads\logo.jpg" 
-    my_query_path = r"C:\Users\dhari\Downloads\bg.jpg"
-
-    print(f"Testing with:\nRef: {my_ref_path}\nQuery: {my_query_path}\n")
-
-    # Run the function
-    result = run_prediction(my_ref_path, my_query_path)
-    
-    if result:
-        print(f"\n--- ✅ Server Response ---")
-        print(f"Similarity Score: {result.similarity_score:.4f}")
-        print(f"Match Found:      {result.is_match}")
+# client/grpc_client.py
+import grpc
+import sys
+import os
+import argparse
+
+# -----------------------------------------------------------------------------
+# 1. Setup Path to find Generated Files
+# -----------------------------------------------------------------------------
+# Finds the folder relative to where this script is located
+current_dir = os.path.dirname(os.path.abspath(__file__))
+generated_dir = os.path.join(current_dir, '../generated')
+
+# Add 'generated' to Python's search path BEFORE importing protobufs
+sys.path.append(generated_dir)
+
+import symbol_detector_pb2
+import symbol_detector_pb2_grpc
+
+# -----------------------------------------------------------------------------
+# 2. Client Logic
+# -----------------------------------------------------------------------------
+def run_prediction(ref_path, query_path):
+    """
+    Sends two images to the gRPC server and returns the response object.
+    """
+    # Check if files exist
+    if not os.path.exists(ref_path):
+        print(f"Error: Reference file not found at: {ref_path}")
+        return None
+    if not os.path.exists(query_path):
+        print(f"Error: Query file not found at: {query_path}")
+        return None
+
+    # Read images as raw bytes
+    try:
+        with open(ref_path, "rb") as f:
+            ref_bytes = f.read()
+        with open(query_path, "rb") as f:
+            query_bytes = f.read()
+    except Exception as e:
+        print(f"Error reading files: {e}")
+        return None
+
+    print(f"Connecting to server at localhost:50051...")
+    
+    # Open gRPC Channel
+    # (Increase max message size if sending high-res images, e.g., 10MB)
+    options = [('grpc.max_send_message_length', 10 * 1024 * 1024),
+               ('grpc.max_receive_message_length', 10 * 1024 * 1024)]
+               
+    with grpc.insecure_channel('localhost:50051', options=options) as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+        
+        # Create Request Object
+        request = symbol_detector_pb2.PredictRequest(
+            reference_image=ref_bytes,
+            query_image=query_bytes
+        )
+
+        try:
+            print(f"Sending request... (Ref: {len(ref_bytes)} bytes, Query: {len(query_bytes)} bytes)")
+            response = stub.Predict(request)
+            return response
+        except grpc.RpcError as e:
+            print(f"❌ gRPC Failed: {e.code()}")
+            print(f"   Details: {e.details()}")
+            return None
+# client/grpc_client.py
+
+# ... (Previous imports and run_prediction function remain the same) ...
+
+def predict_batch(ref_paths, query_paths, top_k=0, reference_ids=None):
+    """
+    Scores every reference against every query in one call.
+    Returns the PredictBatchResponse or None. Scores are packed row-major:
+    response.scores[r * response.num_queries + q]; with top_k > 0,
+    response.top_indices / top_scores hold the k best queries per reference.
+    """
+    request = symbol_detector_pb2.PredictBatchRequest(reference_ids=reference_ids or [], top_k=top_k)
+    for path in list(ref_paths or []) + list(query_paths):
+        if not os.path.exists(path):
+            print(f"Error: Image file not found at: {path}")
+            return None
+    for path in ref_paths or []:
+        with open(path, "rb") as f:
+            request.reference_images.append(f.read())
+    for path in query_paths:
+        with open(path, "rb") as f:
+            request.query_images.append(f.read())
+
+    options = [('grpc.max_send_message_length', 50 * 1024 * 1024),
+               ('grpc.max_receive_message_length', 50 * 1024 * 1024)]
+
+    with grpc.insecure_channel('localhost:50051', options=options) as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+        try:
+            return stub.PredictBatch(request)
+        except grpc.RpcError as e:
+            print(f"Predict Batch Failed: {e.code()} - {e.details()}")
+            return None
+
+def register_reference(ref_path, ttl_seconds=0):
+    """
+    Registers a reference symbol with the server.
+    Returns the RegisterReferenceResponse (reference_id, size, ttl) or None.
+    """
+    if not os.path.exists(ref_path):
+        return None
+
+    with open(ref_path, "rb") as f:
+        ref_bytes = f.read()
+
+    with grpc.insecure_channel('localhost:50051') as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+        request = symbol_detector_pb2.RegisterReferenceRequest(
+            reference_image=ref_bytes,
+            ttl_seconds=ttl_seconds
+        )
+        try:
+            return stub.RegisterReference(request)
+        except grpc.RpcError as e:
+            print(f"Register Failed: {e.code()} - {e.details()}")
+            return None
+
+def check_health():
+    """
+    Asks the server whether its model is loaded.
+    Returns the HealthResponse (status, message, backend) or None if unreachable.
+    """
+    with grpc.insecure_channel('localhost:50051') as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+        try:
+            return stub.Health(symbol_detector_pb2.HealthRequest(), timeout=5)
+        except grpc.RpcError as e:
+            print(f"Health Check Failed: {e.code()} - {e.details()}")
+            return None
+
+_ENGINES = {
+    "crop": symbol_detector_pb2.ENGINE_CROP,
+    "dense": symbol_detector_pb2.ENGINE_DENSE,
+    "cascade": symbol_detector_pb2.ENGINE_CASCADE,
+}
+
+def get_stats():
+    """
+    Request counts, latencies and per-stage scan time recorded by the server
+    (started with --metrics). Returns the StatsResponse or None.
+    """
+    with grpc.insecure_channel('localhost:50051') as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+        try:
+            return stub.GetStats(symbol_detector_pb2.StatsRequest(), timeout=5)
+        except grpc.RpcError as e:
+            print(f"Get Stats Failed: {e.code()} - {e.details()}")
+            return None
+
+def _scan_request(ref_path, blueprint_path, engine="crop", scales=None, reference_id=None,
+                  include_blueprint=True, include_timings=False, threshold=0.0, max_results=0,
+                  exists=False, any_orientation=False):
+    """Reads the inputs and builds a ScanRequest (None if a file is missing)."""
+    if not os.path.exists(blueprint_path):
+        return None
+    if reference_id is None and (ref_path is None or not os.path.exists(ref_path)):
+        return None
+
+    # Read images
+    ref_bytes = b""
+    if reference_id is None:
+        with open(ref_path, "rb") as f:
+            ref_bytes = f.read()
+    blue_bytes = b""
+    if include_blueprint:
+        with open(blueprint_path, "rb") as f:
+            blue_bytes = f.read()
+
+    return symbol_detector_pb2.ScanRequest(
+        reference_image=ref_bytes,
+        blueprint_image=blue_bytes,
+        engine=_ENGINES.get(engine, symbol_detector_pb2.ENGINE_CROP),
+        scales=scales or [],
+        reference_id=reference_id or "",
+        include_timings=include_timings,
+        threshold=threshold,
+        max_results=max_results,
+        exists=exists,
+        any_orientation=any_orientation
+    )
+
+def scan_blueprint(ref_path, blueprint_path, engine="crop", scales=None, reference_id=None,
+                   include_timings=False, threshold=0.0, max_results=0, exists=False,
+                   any_orientation=False):
+    """
+    Sends a reference symbol and a full blueprint to the server.
+    Returns the ScanResponse object containing bounding boxes.
+    engine: "crop" (per-window embedding), "dense" (shared feature map) or
+            "cascade" (crop behind cheap pruning stages; see response.cascade).
+    scales: optional symbol sizes relative to the reference, searched in one call.
+    reference_id: id from register_reference(); the reference file is then not sent
+    (ref_path may be None).
+    include_timings: also return where the scan's time went (response.timings).
+    threshold: minimum match score (0 = the server's default).
+    max_results: only the best this many matches, found by visiting the most
+    promising windows first (0 = all).
+    exists: only ask whether the symbol is there; the scan stops at the first match.
+    any_orientation: also find the symbol rotated and/or mirrored; each box
+    says how (match.rotation, match.mirrored).
+    """
+    request = _scan_request(ref_path, blueprint_path, engine, scales, reference_id,
+                            include_timings=include_timings, threshold=threshold,
+                            max_results=max_results, exists=exists, any_orientation=any_orientation)
+    if request is None:
+        return None
+
+    # Increase message size limit (Blueprints can be large!)
+    options = [('grpc.max_send_message_length', 50 * 1024 * 1024),
+               ('grpc.max_receive_message_length', 50 * 1024 * 1024)]
+
+    with grpc.insecure_channel('localhost:50051', options=options) as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+
+        try:
+            print("Sending Scan Request...")
+            response = stub.ScanBlueprint(request)
+            return response
+        except grpc.RpcError as e:
+            print(f"Scan Failed: {e.code()} - {e.details()}")
+            return None
+
+def scan_blueprint_upload(ref_path, blueprint_path, engine="crop", scales=None, reference_id=None,
+                          chunk_size=1024 * 1024, include_timings=False, threshold=0.0, max_results=0,
+                          exists=False, any_orientation=False):
+    """
+    Same as scan_blueprint, but uploads the blueprint in chunk_size pieces.
+    The file is never held in memory as a whole and there is no message-size limit,
+    so very large scans (E-size sheets) go through.
+    """
+    header = _scan_request(ref_path, blueprint_path, engine, scales, reference_id,
+                           include_blueprint=False, include_timings=include_timings,
+                           threshold=threshold, max_results=max_results, exists=exists,
+                           any_orientation=any_orientation)
+    if header is None:
+        return None
+
+    def chunks():
+        yield symbol_detector_pb2.ScanUploadChunk(header=header)
+        with open(blueprint_path, "rb") as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                yield symbol_detector_pb2.ScanUploadChunk(blueprint_chunk=data)
+
+    with grpc.insecure_channel('localhost:50051') as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+
+        try:
+            print(f"Uploading blueprint ({os.path.getsize(blueprint_path)} bytes) for scanning...")
+            return stub.ScanBlueprintUpload(chunks())
+        except grpc.RpcError as e:
+            print(f"Upload Scan Failed: {e.code()} - {e.details()}")
+            return None
+
+def scan_blueprint_multi(ref_paths, blueprint_path, engine="crop", scales=None, labels=None,
+                         reference_ids=None):
+    """
+    Scans one blueprint for several reference symbols in one request.
+    ref_paths: reference image files; reference_ids: already registered ids (either may be empty).
+    labels: optional names for ref_paths + reference_ids, echoed back per symbol.
+    Returns the MultiScanResponse (one SymbolMatches per reference, in order) or None.
+    """
+    if not os.path.exists(blueprint_path):
+        return None
+
+    references = []
+    for path in ref_paths or []:
+        if not os.path.exists(path):
+            print(f"Error: Reference file not found at: {path}")
+            return None
+        with open(path, "rb") as f:
+            references.append(symbol_detector_pb2.SymbolReference(reference_image=f.read()))
+    for reference_id in reference_ids or []:
+        references.append(symbol_detector_pb2.SymbolReference(reference_id=reference_id))
+    for reference, label in zip(references, labels or []):
+        reference.label = label
+
+    with open(blueprint_path, "rb") as f:
+        blue_bytes = f.read()
+    request = symbol_detector_pb2.MultiScanRequest(
+        references=references,
+        blueprint_image=blue_bytes,
+        engine=_ENGINES.get(engine, symbol_detector_pb2.ENGINE_CROP),
+        scales=scales or []
+    )
+
+    options = [('grpc.max_send_message_length', 50 * 1024 * 1024),
+               ('grpc.max_receive_message_length', 50 * 1024 * 1024)]
+
+    with grpc.insecure_channel('localhost:50051', options=options) as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+        try:
+            return stub.ScanBlueprintMulti(request)
+        except grpc.RpcError as e:
+            print(f"Multi Scan Failed: {e.code()} - {e.details()}")
+            return None
+
+def search_library(ref_path=None, top_k=10, reference_id=None, nprobe=0, min_score=0.0):
+    """
+    Finds the top_k places a symbol appears across the server's symbol library.
+    Returns the LibrarySearchResponse (hits with page name and box) or None.
+    """
+    request = symbol_detector_pb2.LibrarySearchRequest(top_k=top_k, nprobe=nprobe,
+                                                       min_score=min_score)
+    if reference_id:
+        request.reference_id = reference_id
+    else:
+        if not ref_path or not os.path.exists(ref_path):
+            print(f"Error: Reference file not found at: {ref_path}")
+            return None
+        with open(ref_path, "rb") as f:
+            request.reference_image = f.read()
+
+    with grpc.insecure_channel('localhost:50051') as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+        try:
+            return stub.SearchLibrary(request)
+        except grpc.RpcError as e:
+            print(f"Library Search Failed: {e.code()} - {e.details()}")
+            return None
+
+def add_library_page(blueprint_path, name=None):
+    """
+    Adds one sheet to the server's symbol library.
+    Returns the LibraryPageResponse or None.
+    """
+    if not os.path.exists(blueprint_path):
+        return None
+    with open(blueprint_path, "rb") as f:
+        request = symbol_detector_pb2.LibraryPageRequest(
+            name=name or os.path.basename(blueprint_path),
+            blueprint_image=f.read()
+        )
+
+    options = [('grpc.max_send_message_length', 50 * 1024 * 1024),
+               ('grpc.max_receive_message_length', 50 * 1024 * 1024)]
+
+    with grpc.insecure_channel('localhost:50051', options=options) as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+        try:
+            return stub.AddLibraryPage(request)
+        except grpc.RpcError as e:
+            print(f"Add Library Page Failed: {e.code()} - {e.details()}")
+            return None
+
+def scan_blueprint_stream(ref_path, blueprint_path, engine="crop", scales=None, reference_id=None,
+                          include_timings=False, threshold=0.0, max_results=0, exists=False):
+    """
+    Same as scan_blueprint, but yields ScanProgress messages as row bands finish.
+    Each message carries only the matches found since the previous one.
+    Bands go in page order, so max_results / exists end the stream at the first matches.
+    """
+    request = _scan_request(ref_path, blueprint_path, engine, scales, reference_id,
+                            include_timings=include_timings, threshold=threshold,
+                            max_results=max_results, exists=exists)
+    if request is None:
+        return
+
+    options = [('grpc.max_send_message_length', 50 * 1024 * 1024),
+               ('grpc.max_receive_message_length', 50 * 1024 * 1024)]
+
+    with grpc.insecure_channel('localhost:50051', options=options) as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+
+        try:
+            print("Sending Streaming Scan Request...")
+            for progress in stub.ScanBlueprintStream(request):
+                yield progress
+        except grpc.RpcError as e:
+            print(f"Streaming Scan Failed: {e.code()} - {e.details()}")
+
+def scan_document(ref_path, document_path, dpi=0, pages=None, engine="crop", scales=None,
+                  reference_id=None, threshold=0.0, max_results=0, exists=False,
+                  include_timings=False, any_orientation=False):
+    """
+    Scans every page of a drawing set (PDF or multi-page TIFF) for one reference.
+    Yields one DocumentPageResult per page as soon as that page is done.
+    dpi: PDF rasterization resolution (0 = the server's 150); boxes are in
+    pixels of the page at that resolution (result.width x result.height).
+    pages: 1-based page numbers to scan (default: all).
+    max_results applies per page; exists stops at the first page with a match.
+    """
+    scan = _scan_request(ref_path, document_path, engine, scales, reference_id,
+                         include_timings=include_timings, threshold=threshold,
+                         max_results=max_results, exists=exists, any_orientation=any_orientation)
+    if scan is None:
+        return
+    request = symbol_detector_pb2.DocumentScanRequest(scan=scan, dpi=dpi, pages=pages or [])
+
+    options = [('grpc.max_send_message_length', 50 * 1024 * 1024),
+               ('grpc.max_receive_message_length', 50 * 1024 * 1024)]
+
+    with grpc.insecure_channel('localhost:50051', options=options) as channel:
+        stub = symbol_detector_pb2_grpc.SymbolDetectorStub(channel)
+
+        try:
+            print("Sending Document Scan Request...")
+            for page in stub.ScanDocument(request):
+                yield page
+        except grpc.RpcError as e:
+            print(f"Document Scan Failed: {e.code()} - {e.details()}")
+# -----------------------------------------------------------------------------
+# 3. Main Execution (CLI)
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# 3. Main Execution
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    #  vvv  PASTE YOUR PATHS HERE  vvv
+    
+    # Windows Example: r"C:\Users\Name\Desktop\symbol.png" (Use 'r' for Windows paths)
+    # Mac/Linux Example: "/Users/name/Desktop/symbol.png"
+    
+    my_ref_path = r"C:\Users\dhari\Downloads\logo.jpg" 
+    my_query_path = r"C:\Users\dhari\Downloads\bg.jpg"
+
+    print(f"Testing with:\nRef: {my_ref_path}\nQuery: {my_query_path}\n")
+
+    # Run the function
+    result = run_prediction(my_ref_path, my_query_path)
+    
+    if result:
+        print(f"\n--- ✅ Server Response ---")
+        print(f"Similarity Score: {result.similarity_score:.4f}")
+        print(f"Match Found:      {result.is_match}")
         print(f"Server Message:   {result.message}")
\ No newline at end of file
@@ -0,0 +1,152 @@
+import itertools
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import torch
+
+_local = threading.local()
+# Priority of close(): after every job already queued
+_LAST = float("inf")
+
+
+def set_thread_priority(priority):
+    """Default priority of the jobs this thread submits (lower runs first).
+
+    Meant as a ThreadPoolExecutor initializer, e.g. so the threads serving
+    Predict get their embeddings ahead of queued scan batches.
+    """
+    _local.priority = priority
+
+
+class _Job:
+    __slots__ = ("batch", "future")
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.future = Future()
+
+
+class BatchingScheduler:
+    """Coalesces embedding jobs from concurrent RPCs into shared forward passes.
+
+    Every RPC thread submits its [n,3,224,224] tensor and blocks on a future.
+    One worker thread owns the model: it takes the oldest job, keeps collecting
+    queued jobs until max_batch images are gathered or max_wait_ms has passed,
+    runs a single forward pass and hands each caller its own rows back.
+
+    Jobs are taken by priority, then in submission order (see
+    set_thread_priority); everything is priority 0 by default.
+
+    Exposes the same get_embeddings() as SiameseNetwork, so it can stand in
+    for the model wherever embeddings are computed.
+    """
+
+    def __init__(self, model, max_batch=32, max_wait_ms=5):
+        self.model = model
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._queue = queue.PriorityQueue()  # (priority, seq, job)
+        self._seq = itertools.count()
+        self._carry = None  # job that didn't fit in the previous batch
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._jobs = 0
+        self._images = 0
+        self._max_queue_depth = 0
+        self._batch_sizes = Counter()
+        self._worker = threading.Thread(target=self._run, name="batching-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, batch, priority=None):
+        """Queues a [n,3,224,224] tensor; the future resolves to its [n,D] embeddings.
+
+        priority defaults to the submitting thread's (set_thread_priority), else 0.
+        """
+        job = _Job(batch)
+        self._put(job, getattr(_local, "priority", 0) if priority is None else priority)
+        depth = self._queue.qsize()
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return job.future
+
+    def get_embeddings(self, batch):
+        return self.submit(batch).result()
+
+    def close(self):
+        self._put(None, _LAST)
+        self._worker.join()
+
+    def _put(self, job, priority):
+        self._queue.put((priority, next(self._seq), job))
+
+    def _get(self, timeout=None, block=True):
+        return self._queue.get(block=block, timeout=timeout)[2]
+
+    def _next_job(self, timeout=None):
+        if self._carry is not None:
+            job, self._carry = self._carry, None
+            return job
+        return self._get(timeout=timeout)
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            jobs, size = [job], len(job.batch)
+
+            # Keep filling the batch until it is full or the wait budget is spent
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    job = self._next_job(timeout=max(0.0, remaining)) if remaining > 0 \
+                        else self._get(block=False)
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._put(None, _LAST)
+                    break
+                if size + len(job.batch) > self.max_batch:
+                    self._carry = job
+                    break
+                jobs.append(job)
+                size += len(job.batch)
+
+            self._execute(jobs, size)
+
+    def _execute(self, jobs, size):
+        try:
+            batch = torch.cat([j.batch for j in jobs]).to(self.model.device)
+            embeddings = self.model.get_embeddings(batch)
+        except Exception as e:
+            for j in jobs:
+                j.future.set_exception(e)
+            return
+
+        start = 0
+        for j in jobs:
+            end = start + len(j.batch)
+            j.future.set_result(embeddings[start:end])
+            start = end
+
+        with self._lock:
+            self._batches += 1
+            self._jobs += len(jobs)
+            self._images += size
+            # Power-of-two buckets: 1, 2, 4, 8, ...
+            self._batch_sizes[1 << (size - 1).bit_length()] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": self._batches,
+                "jobs": self._jobs,
+                "images": self._images,
+                "batch_size_histogram": {f"<={k}": v for k, v in sorted(self._batch_sizes.items())},
+            }
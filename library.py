@@ -0,0 +1,398 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import torch.nn.functional as F
+
+try:
+    from server.page_index import PageIndex, parse_window
+    from server.page_reader import load_page
+    from server.scanner import CASCADE_BLANK_STD, _cascade_factor, _ink, _window_stats, nms_array
+except ImportError:
+    from page_index import PageIndex, parse_window
+    from page_reader import load_page
+    from scanner import CASCADE_BLANK_STD, _cascade_factor, _ink, _window_stats, nms_array
+
+
+# The IVF index is trained once the library holds this many vectors per list,
+# and retrained (new centroids, every vector reassigned) whenever it has grown
+# RETRAIN_GROWTH-fold since
+TRAIN_ROWS_PER_LIST = 16
+RETRAIN_GROWTH = 4
+# k-means runs on a random sample of at most this many vectors per list
+KMEANS_SAMPLE_PER_LIST = 64
+# Every save() writes one segment, merged with the saved segments before it
+# while they are at most MERGE_RATIO x its rows: segment sizes stay
+# geometric, so there are O(log n) of them and a row is rewritten O(log n) times
+MERGE_RATIO = 1
+
+
+def _nearest(vectors, centroids, chunk=65536):
+    """Index of the most similar centroid for every (unit-norm) row."""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        out[start:start + chunk] = (block @ centroids.T).argmax(1)
+    return out
+
+
+def _kmeans(vectors, k, iterations=10, seed=0):
+    """Spherical k-means: [k,D] unit-norm centroids of unit-norm vectors."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)]
+    for _ in range(iterations):
+        assign = _nearest(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        lists, starts = np.unique(assign[order], return_index=True)
+        sums = vectors[rng.choice(len(vectors), k)]  # empty lists restart from a random vector
+        sums[lists] = np.add.reduceat(vectors[order], starts)
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+class SymbolLibrary:
+    """Window embeddings of a whole drawing set, searchable for the top-k places a symbol appears.
+
+    Every page is cut into the crop engine's sliding windows at each of
+    window_sizes; blank windows (ink std below min_ink_std) are skipped and
+    the rest are embedded and stored as unit-norm float16 rows with their
+    (page, x, y, w, h).
+
+    Search is an inverted-file (IVF) index in numpy: the vectors are
+    clustered into nlist lists by spherical k-means, and a query only scores
+    the vectors of its nprobe most similar lists. Until the library is big
+    enough to train (TRAIN_ROWS_PER_LIST x nlist vectors) every vector is
+    scored. recall() measures what nprobe costs against that brute force.
+
+    Pages can be added at any time. Rows are kept in segments (one .npy per
+    save), so saving after an insert writes the new rows plus the small
+    segments they are merged with (MERGE_RATIO); saved segments are
+    memory-mapped when the library is opened.
+    """
+
+    def __init__(self, directory, window_sizes=((48, 48),), nlist=256, nprobe=8,
+                 min_ink_std=CASCADE_BLANK_STD, namespace="default"):
+        self.directory = directory
+        self.window_sizes = [tuple(ws) for ws in window_sizes]
+        self.nlist = max(1, int(nlist))
+        self.nprobe = max(1, int(nprobe))
+        self.min_ink_std = min_ink_std
+        self.namespace = namespace
+        self.pages = []         # {"name", "key", "width", "height"}, indexed by page id
+        self._keys = {}         # page hash -> page id
+        self.segments = []      # {"name", "vectors" [n,D] f16, "boxes" [n,5] i32, "lists" [n] i32}
+        self.centroids = None   # [nlist,D] once trained
+        self.trained_rows = 0
+        self._saved = 0         # segments[:_saved] are on disk
+        self._next_segment = 0
+        self._lists_dirty = False
+        self._lock = threading.RLock()
+
+        path = os.path.join(directory, "library.json")
+        if os.path.exists(path):
+            self._load(path)
+
+    def _load(self, path):
+        with open(path) as f:
+            meta = json.load(f)
+        if meta["namespace"] != self.namespace:
+            raise ValueError(f"Library {self.directory} was built with another model "
+                             f"({meta['namespace']}, this one is {self.namespace})")
+        self.window_sizes = [tuple(ws) for ws in meta["window_sizes"]]
+        self.nlist, self.min_ink_std = meta["nlist"], meta["min_ink_std"]
+        self.pages = meta["pages"]
+        self._keys = {page["key"]: i for i, page in enumerate(self.pages)}
+        self.trained_rows = meta["trained_rows"]
+        self._next_segment = meta["next_segment"]
+        for name in meta["segments"]:
+            base = os.path.join(self.directory, name)
+            self.segments.append({
+                "name": name,
+                "vectors": np.load(base + ".npy", mmap_mode="r"),
+                "boxes": np.load(base + ".boxes.npy"),
+                "lists": np.load(base + ".lists.npy"),
+            })
+        if self.trained_rows:
+            self.centroids = np.load(os.path.join(self.directory, "centroids.npy"))
+        self._saved = len(self.segments)
+        print(f"Loaded symbol library {self.directory}: {self.stats()}")
+
+    def __len__(self):
+        return sum(len(s["boxes"]) for s in self.segments)
+
+    def stats(self):
+        with self._lock:
+            return {"pages": len(self.pages), "vectors": len(self), "segments": len(self.segments),
+                    "lists": 0 if self.centroids is None else len(self.centroids)}
+
+    # --- Inserts -------------------------------------------------------------
+
+    def _candidate_positions(self, image, window_size):
+        """Crop-engine grid rows [(y, xs)] without the blank windows."""
+        w, h = window_size
+        xs = np.arange(0, image.size[0] - w, int(w * 0.7))
+        ys = np.arange(0, image.size[1] - h, int(h * 0.7))
+        if not len(xs) or not len(ys):
+            return []
+        # Ink std at low resolution, as in the cascade engine's first stage
+        f = _cascade_factor(window_size)
+        _, std = _window_stats(_ink(image, f), -(-h // f), -(-w // f))
+        std = std.numpy()
+        keep = std[np.minimum(ys // f, len(std) - 1)][:, np.minimum(xs // f, std.shape[1] - 1)]
+        keep = keep >= self.min_ink_std
+        return [(int(y), xs[row].tolist()) for y, row in zip(ys, keep) if row.any()]
+
+    def add_page(self, scanner, name, blueprint_bytes):
+        """Embeds a page's inked windows and adds them; returns the rows added (0 if already in)."""
+        key = PageIndex.page_key(blueprint_bytes)
+        with self._lock:
+            if key in self._keys:
+                return 0
+        image = load_page(blueprint_bytes)
+
+        vectors, boxes = [], []
+        for window_size in self.window_sizes:
+            positions = self._candidate_positions(image, window_size)
+            for coords, embeddings in scanner.embed_positions(image, window_size, positions):
+                vectors.append(F.normalize(embeddings.float(), dim=1).cpu().numpy().astype(np.float16))
+                boxes.extend((0, x, y, window_size[0], window_size[1]) for x, y in coords)
+
+        with self._lock:
+            if key in self._keys:  # added concurrently
+                return 0
+            page_id = len(self.pages)
+            self.pages.append({"name": name, "key": key, "width": image.size[0],
+                               "height": image.size[1]})
+            self._keys[key] = page_id
+            if not vectors:
+                return 0
+            vectors = np.concatenate(vectors)
+            boxes = np.array(boxes, dtype=np.int32)
+            boxes[:, 0] = page_id
+            lists = (np.full(len(vectors), -1, dtype=np.int32) if self.centroids is None
+                     else _nearest(vectors, self.centroids))
+            self.segments.append({"name": None, "vectors": vectors, "boxes": boxes, "lists": lists})
+            self._maybe_train()
+        return len(vectors)
+
+    def _maybe_train(self):
+        rows = len(self)
+        if self.trained_rows == 0 and rows < TRAIN_ROWS_PER_LIST * self.nlist:
+            return
+        if self.trained_rows and rows < RETRAIN_GROWTH * self.trained_rows:
+            return
+        self.train()
+
+    def train(self, seed=0):
+        """(Re)clusters the library into nlist lists and reassigns every vector."""
+        with self._lock:
+            rows = len(self)
+            if rows == 0:
+                return
+            start = time.perf_counter()
+            k = min(self.nlist, rows)
+            rng = np.random.default_rng(seed)
+            picks = np.sort(rng.choice(rows, min(rows, KMEANS_SAMPLE_PER_LIST * k), replace=False))
+            sample, offset = [], 0
+            for segment in self.segments:
+                n = len(segment["boxes"])
+                mine = picks[(picks >= offset) & (picks < offset + n)] - offset
+                sample.append(np.asarray(segment["vectors"][mine], dtype=np.float32))
+                offset += n
+            self.centroids = _kmeans(np.concatenate(sample), k, seed=seed)
+            for segment in self.segments:
+                segment["lists"] = _nearest(segment["vectors"], self.centroids)
+            self.trained_rows = rows
+            self._lists_dirty = True
+            print(f"Trained symbol library: {k} lists over {rows} vectors "
+                  f"in {time.perf_counter() - start:.1f}s")
+
+    def save(self):
+        """Writes new rows as one segment, plus the metadata (and lists after a retrain)."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            # Take in the saved segments that are not much bigger than what is
+            # being written (new name: the old files may still be mapped)
+            start = self._saved
+            rows = sum(len(s["boxes"]) for s in self.segments[start:])
+            while rows and start > 0 and len(self.segments[start - 1]["boxes"]) <= MERGE_RATIO * rows:
+                start -= 1
+                rows += len(self.segments[start]["boxes"])
+            merged_away = [s["name"] for s in self.segments[start:self._saved]]
+            self._saved = start
+            new = self.segments[self._saved:]
+            if new:
+                name = f"segment-{self._next_segment:05d}"
+                self._next_segment += 1
+                merged = {
+                    "name": name,
+                    "vectors": np.concatenate([s["vectors"] for s in new]),
+                    "boxes": np.concatenate([s["boxes"] for s in new]),
+                    "lists": np.concatenate([s["lists"] for s in new]),
+                }
+                base = os.path.join(self.directory, name)
+                for suffix, key in ((".npy", "vectors"), (".boxes.npy", "boxes"), (".lists.npy", "lists")):
+                    np.save(base + suffix, merged[key])
+                merged["vectors"] = np.load(base + ".npy", mmap_mode="r")
+                self.segments[self._saved:] = [merged]
+            if self._lists_dirty:
+                for segment in self.segments[:self._saved]:
+                    np.save(os.path.join(self.directory, segment["name"] + ".lists.npy"), segment["lists"])
+                np.save(os.path.join(self.directory, "centroids.npy"), self.centroids)
+                self._lists_dirty = False
+            self._saved = len(self.segments)
+
+            meta = {"namespace": self.namespace, "window_sizes": self.window_sizes,
+                    "nlist": self.nlist, "min_ink_std": self.min_ink_std,
+                    "trained_rows": self.trained_rows, "pages": self.pages,
+                    "next_segment": self._next_segment,
+                    "segments": [s["name"] for s in self.segments]}
+            tmp = os.path.join(self.directory, "library.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp, os.path.join(self.directory, "library.json"))
+            for name in merged_away:
+                for suffix in (".npy", ".boxes.npy", ".lists.npy"):
+                    os.remove(os.path.join(self.directory, name + suffix))
+
+    # --- Search --------------------------------------------------------------
+
+    def _top(self, query, k, nprobe=None):
+        """(scores [n], boxes [n,5]) of the k best windows, probing nprobe lists (None = all)."""
+        q = np.asarray(query, dtype=np.float32).ravel()
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        with self._lock:
+            segments, centroids = list(self.segments), self.centroids
+        probes = None
+        if centroids is not None and nprobe is not None and nprobe < len(centroids):
+            probes = np.argpartition(-(centroids @ q), nprobe)[:nprobe]
+
+        scores, boxes = [np.zeros(0, dtype=np.float32)], [np.zeros((0, 5), dtype=np.int32)]
+        for segment in segments:
+            rows = (np.arange(len(segment["boxes"])) if probes is None
+                    else np.flatnonzero(np.isin(segment["lists"], probes)))
+            if not len(rows):
+                continue
+            s = np.asarray(segment["vectors"][rows], dtype=np.float32) @ q
+            if len(s) > k:
+                top = np.argpartition(-s, k)[:k]
+                s, rows = s[top], rows[top]
+            scores.append(s)
+            boxes.append(segment["boxes"][rows])
+        scores, boxes = np.concatenate(scores), np.concatenate(boxes)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return scores[order], boxes[order]
+
+    def search(self, query, top_k=10, nprobe=None, threshold=None):
+        """Top-k matches of a query embedding across the library, one box per symbol.
+
+        Returns dicts with page (name), page_id, x, y, width, height, score,
+        best first. Overlapping windows of the same page are merged by NMS.
+        """
+        nprobe = self.nprobe if nprobe is None else nprobe
+        # Neighbouring windows of one symbol all score high: over-fetch, then NMS per page
+        scores, boxes = self._top(query, max(top_k, 1) * 8, nprobe)
+        if threshold is not None:
+            keep = scores > threshold
+            scores, boxes = scores[keep], boxes[keep]
+
+        hits = []
+        for page_id in np.unique(boxes[:, 0]):
+            mine = np.flatnonzero(boxes[:, 0] == page_id)
+            arr = np.column_stack([boxes[mine, 1:].astype(np.float64), scores[mine]])
+            for i in nms_array(arr, iou_threshold=0.1):
+                hits.append((float(arr[i, 4]), int(page_id), arr[i]))
+        hits.sort(key=lambda h: -h[0])
+        return [{"page": self.pages[page_id]["name"], "page_id": page_id,
+                 "x": int(a[0]), "y": int(a[1]), "width": int(a[2]), "height": int(a[3]), "score": score}
+                for score, page_id, a in hits[:top_k]]
+
+    def recall(self, queries, top_k=10, nprobe=None):
+        """Mean fraction of the exact top-k windows the IVF search also returns."""
+        nprobe = self.nprobe if nprobe is None else nprobe
+        found = []
+        for query in queries:
+            _, exact = self._top(query, top_k, None)
+            _, approx = self._top(query, top_k, nprobe)
+            exact = {tuple(b) for b in exact.tolist()}
+            found.append(len(exact & {tuple(b) for b in approx.tolist()}) / max(1, len(exact)))
+        return float(np.mean(found)) if found else 1.0
+
+    def sample_queries(self, count, seed=0):
+        """Stored vectors to use as recall() queries (library windows are what users search for)."""
+        rng = np.random.default_rng(seed)
+        queries = []
+        for segment in self.segments:
+            n = len(segment["boxes"])
+            picks = rng.choice(n, min(n, max(1, count // max(1, len(self.segments)))), replace=False)
+            queries.extend(np.asarray(segment["vectors"][np.sort(picks)], dtype=np.float32))
+        return queries[:count]
+
+
+if __name__ == "__main__":
+    # Offline indexing of a drawing set, and recall / latency checks
+    try:
+        from server.model import SiameseNetwork
+        from server.scanner import BlueprintScanner
+        from server.backends import BACKENDS
+    except ImportError:
+        from model import SiameseNetwork
+        from scanner import BlueprintScanner
+        from backends import BACKENDS
+
+    parser = argparse.ArgumentParser(description="Build and query a symbol library over a drawing set")
+    parser.add_argument("library", help="Library directory (server --library)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="Embed pages into the library (already added pages are skipped)")
+    add.add_argument("blueprints", nargs="+")
+    add.add_argument("--window", action="append", type=parse_window, default=[],
+                     help="Window size WxH of candidate regions (repeatable; new libraries only)")
+    add.add_argument("--nlist", type=int, default=256)
+    search = sub.add_parser("search", help="Top-k matches of a reference symbol")
+    search.add_argument("reference")
+    search.add_argument("--top-k", type=int, default=10)
+    search.add_argument("--nprobe", type=int, default=8)
+    recall = sub.add_parser("recall", help="IVF recall versus brute force, per nprobe")
+    recall.add_argument("--queries", type=int, default=100)
+    recall.add_argument("--top-k", type=int, default=10)
+    recall.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    for p in (add, search, recall):
+        p.add_argument("--backend", default="eager", choices=BACKENDS)
+        p.add_argument("--weights", default=None)
+    args = parser.parse_args()
+
+    model = SiameseNetwork(backend=args.backend, weights_path=args.weights)
+    options = {"namespace": model.fingerprint}
+    if args.command == "add":
+        options.update(window_sizes=args.window or [(48, 48)], nlist=args.nlist)
+    library = SymbolLibrary(args.library, **options)
+
+    if args.command == "add":
+        scanner = BlueprintScanner(model)
+        for path in args.blueprints:
+            start = time.perf_counter()
+            with open(path, "rb") as f:
+                rows = library.add_page(scanner, os.path.basename(path), f.read())
+            library.save()
+            print(f"{path}: {rows} windows in {time.perf_counter() - start:.1f}s")
+        print(f"Library: {library.stats()}")
+
+    elif args.command == "search":
+        with open(args.reference, "rb") as f:
+            embedding, _ = model.embed_image(f.read())
+        start = time.perf_counter()
+        hits = library.search(embedding.cpu().numpy(), top_k=args.top_k, nprobe=args.nprobe)
+        print(f"Searched {len(library)} windows in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for hit in hits:
+            print(f"{hit['score']:.4f}  {hit['page']}  ({hit['x']}, {hit['y']}, {hit['width']}x{hit['height']})")
+
+    else:
+        queries = library.sample_queries(args.queries)
+        for nprobe in args.nprobe:
+            start = time.perf_counter()
+            value = library.recall(queries, top_k=args.top_k, nprobe=nprobe)
+            elapsed = (time.perf_counter() - start) / max(1, len(queries))
+            print(f"nprobe={nprobe:4d}  recall@{args.top_k} {value:.3f}  ({elapsed * 1000:.1f} ms/query incl. brute force)")
@@ -0,0 +1,263 @@
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stages a scan's time is split into (spans of the same name add up)
+STAGES = ("reference", "decode", "windows", "preprocess", "embed", "score", "nms")
+# Upper bounds (seconds) of the RPC latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_local = threading.local()
+_NULL = nullcontext()
+
+
+class Trace:
+    """Timings and counts of one request: seconds per stage, plus counters.
+
+    Spans are exclusive: time spent in a span opened inside another one is
+    counted for the inner stage only, so the stages add up to at most the
+    request time. Only the thread that opened the trace writes to it.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = {}
+        self.counts = {}
+        self._nested = []
+
+    def span(self, stage):
+        return _Span(self, stage)
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+class _Span:
+    __slots__ = ("trace", "stage", "start")
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.trace._nested.append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        trace = self.trace
+        nested = trace._nested.pop()
+        trace.seconds[self.stage] = trace.seconds.get(self.stage, 0.0) + elapsed - nested
+        if trace._nested:
+            trace._nested[-1] += elapsed
+        return False
+
+
+def current():
+    """The trace of the request running on this thread, or None."""
+    return getattr(_local, "trace", None)
+
+
+def span(stage):
+    """Times a block as stage of the current request; a no-op when it isn't traced."""
+    trace = getattr(_local, "trace", None)
+    return _NULL if trace is None else _Span(trace, stage)
+
+
+def count(name, n=1):
+    """Adds n to a counter of the current request, if it is traced."""
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.counts[name] = trace.counts.get(name, 0) + n
+
+
+def begin_trace():
+    """Starts tracing the current request if it isn't already (e.g. once a
+    streamed request asks for timings); returns its trace."""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        trace = _local.trace = Trace()
+    return trace
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one: above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimated from the buckets (upper bound of the bucket the quantile falls in)."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _Request:
+    """Context of one RPC: installs its trace on the thread and records it on exit."""
+
+    def __init__(self, metrics, rpc, context, trace):
+        self.metrics = metrics
+        self.rpc = rpc
+        self.context = context
+        self.trace = trace
+
+    def __enter__(self):
+        self.previous = getattr(_local, "trace", None)
+        _local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        # The handler may have started the trace itself (begin_trace)
+        trace = _local.trace
+        _local.trace = self.previous
+        if self.metrics.enabled:
+            code = self.context.code() if hasattr(self.context, "code") else None
+            failed = exc_type is not None or (code is not None and code.name != "OK")
+            self.metrics.record(self.rpc, trace, failed)
+        return False
+
+
+class Metrics:
+    """Process-wide request metrics, rendered in the Prometheus text format.
+
+    Per RPC: a request counter, an error counter and a latency histogram.
+    Per scan stage: total seconds; plus the totals of the scan counters
+    (windows, candidates, matches). Collectors add gauges read at render
+    time from components that keep their own stats() (caches, scheduler).
+
+    When disabled, requests are only traced if they ask for their timings,
+    and nothing is recorded.
+    """
+
+    def __init__(self, enabled=True, namespace="symbol_detector"):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._latency = {}    # rpc -> _Histogram
+        self._errors = {}     # rpc -> count
+        self._stages = {}     # stage -> seconds
+        self._counts = {}     # counter -> total
+        self._collectors = {}  # prefix -> callable returning a stats dict
+
+    def request(self, rpc, context=None, trace=False):
+        """Context manager around one RPC; yields its Trace (or None when not traced)."""
+        return _Request(self, rpc, context, Trace() if self.enabled or trace else None)
+
+    def record(self, rpc, trace, failed=False):
+        with self._lock:
+            if rpc not in self._latency:
+                self._latency[rpc] = _Histogram(LATENCY_BUCKETS)
+                self._errors[rpc] = 0
+            self._latency[rpc].observe(trace.elapsed() if trace else 0.0)
+            if failed:
+                self._errors[rpc] += 1
+            if trace is not None:
+                for stage, seconds in trace.seconds.items():
+                    self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+                for name, n in trace.counts.items():
+                    self._counts[name] = self._counts.get(name, 0) + n
+
+    def add_collector(self, prefix, stats):
+        """Exposes the numeric values of stats() as gauges named <namespace>_<prefix>_<key>."""
+        with self._lock:
+            self._collectors[prefix] = stats
+
+    def snapshot(self):
+        """Plain-dict copy of everything recorded (for GetStats)."""
+        with self._lock:
+            rpcs = {rpc: {"requests": h.count, "errors": self._errors[rpc], "seconds_total": h.sum,
+                          "p50": h.quantile(0.5), "p95": h.quantile(0.95), "p99": h.quantile(0.99)}
+                    for rpc, h in self._latency.items()}
+            stages = dict(sorted(self._stages.items(), key=lambda kv: _stage_order(kv[0])))
+            counts = dict(self._counts)
+            collectors = dict(self._collectors)
+        gauges = {}
+        for prefix, stats in collectors.items():
+            try:
+                values = stats()
+            except Exception:
+                continue
+            for key, value in (values or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{prefix}_{key}"] = value
+        return {"rpcs": rpcs, "stages": stages, "counts": counts, "gauges": gauges}
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        ns = self.namespace
+        snap = self.snapshot()
+        with self._lock:
+            histograms = {rpc: (list(h.counts), h.sum, h.count) for rpc, h in self._latency.items()}
+        lines = [f"# HELP {ns}_rpc_duration_seconds RPC latency",
+                 f"# TYPE {ns}_rpc_duration_seconds histogram"]
+        for rpc, (counts, total, n) in sorted(histograms.items()):
+            seen = 0
+            for bound, c in zip(LATENCY_BUCKETS, counts):
+                seen += c
+                lines.append(f'{ns}_rpc_duration_seconds_bucket{{rpc="{rpc}",le="{bound}"}} {seen}')
+            lines.append(f'{ns}_rpc_duration_seconds_bucket{{rpc="{rpc}",le="+Inf"}} {n}')
+            lines.append(f'{ns}_rpc_duration_seconds_sum{{rpc="{rpc}"}} {total}')
+            lines.append(f'{ns}_rpc_duration_seconds_count{{rpc="{rpc}"}} {n}')
+        lines += [f"# HELP {ns}_rpc_errors_total RPCs that ended with a non-OK status",
+                  f"# TYPE {ns}_rpc_errors_total counter"]
+        lines += [f'{ns}_rpc_errors_total{{rpc="{rpc}"}} {s["errors"]}' for rpc, s in sorted(snap["rpcs"].items())]
+        lines += [f"# HELP {ns}_stage_seconds_total Time spent per scan stage",
+                  f"# TYPE {ns}_stage_seconds_total counter"]
+        lines += [f'{ns}_stage_seconds_total{{stage="{stage}"}} {seconds}'
+                  for stage, seconds in snap["stages"].items()]
+        for name, n in sorted(snap["counts"].items()):
+            lines += [f"# TYPE {ns}_{name}_total counter", f"{ns}_{name}_total {n}"]
+        for name, value in sorted(snap["gauges"].items()):
+            lines += [f"# TYPE {ns}_{name} gauge", f"{ns}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def serve_http(self, port, host="127.0.0.1"):
+        """Serves render() at http://host:port/metrics from a daemon thread; returns the server."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # scrapes every few seconds would flood the log
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+def _stage_order(stage):
+    return (STAGES.index(stage) if stage in STAGES else len(STAGES), stage)
+
+
+def stage_seconds(trace):
+    """[(stage, seconds)] of a trace in pipeline order, with the untimed rest as "other"."""
+    stages = sorted(trace.seconds.items(), key=lambda kv: _stage_order(kv[0]))
+    return stages + [("other", max(0.0, trace.elapsed() - sum(trace.seconds.values())))]
@@ -1,48 +1,275 @@
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
-from PIL import Image
-import io
-
-class SiameseNetwork:
-    def __init__(self):
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        print(f"Model initializing on {self.device}...")
-        
-        weights = models.ResNet18_Weights.DEFAULT
-        self.base_model = models.resnet18(weights=weights)
-        self.feature_extractor = torch.nn.Sequential(*list(self.base_model.children())[:-1])
-        self.feature_extractor.to(self.device)
-        self.feature_extractor.eval()
-
-        self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-
-    def _load_image(self, image_bytes):
-        return Image.open(io.BytesIO(image_bytes)).convert("RGB")
-
-    def preprocess(self, image_bytes):
-        image = self._load_image(image_bytes)
-        tensor = self.transform(image).unsqueeze(0)
-        return tensor.to(self.device)
-
-    def get_embedding(self, tensor):
-        """Returns the embedding vector for a tensor."""
-        with torch.no_grad():
-            emb = self.feature_extractor(tensor).flatten()
-        return emb
-
-    def compute_similarity(self, emb1, emb2):
-        """Calculates cosine similarity between two embeddings."""
-        cos = nn.CosineSimilarity(dim=0)
-        return cos(emb1, emb2).item()
-
-    # Keep the old predict method for backward compatibility
-    def predict(self, ref_bytes, query_bytes, threshold=0.75):
-        emb_ref = self.get_embedding(self.preprocess(ref_bytes))
-        emb_query = self.get_embedding(self.preprocess(query_bytes))
-        score = self.compute_similarity(emb_ref, emb_query)
-        return {"score": score, "is_match": score > threshold}
\ No newline at end of file
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchvision import models, transforms
+from PIL import Image
+import numpy as np
+import argparse
+import hashlib
+import io
+import time
+
+try:
+    from server.backends import build_backend, calibration_crops, check_accuracy, example_batch
+    from server.cancellation import check as check_cancelled
+    from server.metrics import span
+except ImportError:
+    from backends import build_backend, calibration_crops, check_accuracy, example_batch
+    from cancellation import check as check_cancelled
+    from metrics import span
+
+
+# ImageNet normalisation the ResNet weights expect
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+
+def load_image(source):
+    """Decodes raw bytes, a binary file object (e.g. a spooled upload) or a PIL image to RGB."""
+    if isinstance(source, Image.Image):
+        return source.convert("RGB")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source).convert("RGB")
+
+
+def _truncated_resnet18(weights=None):
+    """ResNet18 without its classifier: [N,3,H,W] -> [N,512,1,1]."""
+    base_model = models.resnet18(weights=weights)
+    return torch.nn.Sequential(*list(base_model.children())[:-1])
+
+
+def load_feature_extractor(path):
+    """Builds the truncated ResNet18 from a local file written by save_weights.
+
+    Nothing is downloaded. Where torch supports it the file is mmap'd, so the
+    weights are paged in on first use and shared by processes loading the
+    same file, instead of being read and copied up front.
+    """
+    try:
+        state_dict = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        assign = True
+    except (TypeError, RuntimeError):
+        # Older torch (no mmap) or a legacy, non-zip checkpoint
+        state_dict = torch.load(path, map_location="cpu")
+        assign = False
+    feature_extractor = _truncated_resnet18()
+    if assign:
+        feature_extractor.load_state_dict(state_dict, assign=True)
+    else:
+        feature_extractor.load_state_dict(state_dict)
+    return feature_extractor
+
+
+class SiameseNetwork:
+    def __init__(self, backend="eager", calibration_images=None, accuracy_tolerance=0.02,
+                 strict_accuracy=True, weights_path=None):
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        print(f"Model initializing on {self.device}...")
+        
+        if weights_path:
+            # Pre-truncated local weights (see save_weights): no torchvision download
+            self.feature_extractor = load_feature_extractor(weights_path)
+        else:
+            self.feature_extractor = _truncated_resnet18(models.ResNet18_Weights.DEFAULT)
+        self.feature_extractor.to(self.device)
+        self.feature_extractor.eval()
+
+        self.transform = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=MEAN, std=STD)
+        ])
+        # Same normalisation without the resize (used for whole-page feature maps)
+        self.to_tensor = transforms.Compose([
+            transforms.ToTensor(),
+            transforms.Normalize(mean=MEAN, std=STD)
+        ])
+        self.mean = torch.tensor(MEAN, device=self.device).view(3, 1, 1)
+        self.std = torch.tensor(STD, device=self.device).view(3, 1, 1)
+
+        # Inference backend for window/reference embeddings (see backends.py).
+        # The eager fp32 feature_extractor stays around for the dense engine and
+        # as the accuracy reference.
+        if backend == "int8":
+            self.device = 'cpu'
+            self.feature_extractor.to(self.device)
+        calibration = None
+        if calibration_images:
+            calibration = calibration_crops(calibration_images, self.transform)
+        self.backend_name = backend
+        self.backend = build_backend(backend, self.feature_extractor, self.device, calibration)
+
+        # Identifies what the embeddings come from (weights + backend), e.g. to
+        # keep persisted page indexes of different models apart
+        digest = hashlib.blake2b(backend.encode(), digest_size=8)
+        for tensor in self.feature_extractor.state_dict().values():
+            digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+        if backend == "int8":
+            # int8 activation ranges depend on the calibration crops as well
+            digest.update(calibration.cpu().contiguous().numpy().tobytes())
+        self.fingerprint = digest.hexdigest()
+
+        self.accuracy_report = None
+        if backend != "eager":
+            samples = (calibration if calibration is not None else example_batch(None)).to(self.device)
+            self.accuracy_report = check_accuracy(self.feature_extractor, self.backend, samples,
+                                                  tolerance=accuracy_tolerance)
+            print(f"Backend '{backend}' vs eager fp32: {self.accuracy_report}")
+            if strict_accuracy and not self.accuracy_report["ok"]:
+                raise ValueError(f"Backend '{backend}' changes cosine scores by up to "
+                                 f"{self.accuracy_report['max_score_error']:.4f} "
+                                 f"(tolerance {accuracy_tolerance})")
+
+    def save_weights(self, path):
+        """Writes the truncated fp32 feature extractor for weights_path= / server --weights."""
+        torch.save(self.feature_extractor.state_dict(), path)
+
+    def warm_up(self, batch_size=32):
+        """Runs dummy batches through every inference path the scanner uses.
+
+        The first forward passes pay for lazy initialisation (kernel selection,
+        TorchScript profiling runs, allocator growth); doing it here keeps that
+        off the first real request. Returns the seconds it took.
+        """
+        start = time.perf_counter()
+        batch = torch.zeros(batch_size, 3, 224, 224, device=self.device)
+        for _ in range(2):
+            self.get_embeddings(batch)
+        self.get_embedding(batch[:1])
+        self.get_feature_map(torch.zeros(1, 3, 224, 224, device=self.device))
+        return time.perf_counter() - start
+
+    def _load_image(self, image_bytes):
+        return load_image(image_bytes)
+
+    def image_to_tensor(self, image):
+        """PIL image (e.g. a page strip) -> normalised [3,H,W] float tensor on the model device.
+
+        Only the uint8 pixels are copied to the device; the float conversion
+        happens there.
+        """
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        pixels = torch.from_numpy(np.array(image)).to(self.device)
+        return (pixels.permute(2, 0, 1).float().div_(255) - self.mean) / self.std
+
+    def windows_to_batch(self, windows):
+        """[N,3,h,w] normalised windows (views are fine) -> [N,3,224,224] network input.
+
+        Tensor version of transform. Normalising before the resize is the same
+        as after it (the resize is linear), and antialiased bilinear follows
+        PIL's resize, so scores differ from transform only by PIL's uint8
+        rounding of the resized patch (see BlueprintScanner.embed_windows).
+        """
+        return F.interpolate(windows, size=(224, 224), mode="bilinear",
+                             align_corners=False, antialias=True)
+
+    def preprocess(self, image_bytes):
+        image = self._load_image(image_bytes)
+        tensor = self.transform(image).unsqueeze(0)
+        return tensor.to(self.device)
+
+    def embed_image(self, image_bytes, embedder=None):
+        """Decodes image_bytes once and returns (embedding, (width, height)).
+
+        embedder: anything with get_embeddings() (e.g. the batching scheduler); defaults to self.
+        """
+        image = self._load_image(image_bytes)
+        tensor = self.transform(image).unsqueeze(0)
+        if embedder is None:
+            return self.get_embedding(tensor.to(self.device)), image.size
+        return embedder.get_embeddings(tensor)[0], image.size
+
+    def embed_images(self, images, embedder=None, batch_size=32):
+        """Embeds many images (bytes or PIL images) in batched forward passes: [N,D].
+
+        Images are decoded and transformed one batch at a time, so memory
+        follows batch_size. With the batching scheduler as embedder, the next
+        batch is prepared while the previous one runs.
+        """
+        embeddings, pending = [], None
+        submit = getattr(embedder, "submit", None)
+        for start in range(0, len(images), batch_size):
+            check_cancelled()
+            with span("decode"):
+                decoded = [self._load_image(image) for image in images[start:start + batch_size]]
+            with span("preprocess"):
+                batch = torch.stack([self.transform(image) for image in decoded])
+            with span("embed"):
+                if submit is None:
+                    embeddings.append((embedder or self).get_embeddings(batch.to(self.device)))
+                    continue
+                future = submit(batch)
+                if pending is not None:
+                    embeddings.append(pending.result())
+                pending = future
+        with span("embed"):
+            if pending is not None:
+                embeddings.append(pending.result())
+        return torch.cat(embeddings)
+
+    def get_embedding(self, tensor):
+        """Returns the embedding vector for a tensor."""
+        with torch.inference_mode():
+            emb = self.backend(tensor).flatten()
+        return emb
+
+    def get_embeddings(self, batch):
+        """Returns one embedding row per image for a [N,3,224,224] batch."""
+        with torch.inference_mode():
+            embs = self.backend(batch).flatten(1)
+        return embs
+
+    def get_feature_map(self, batch):
+        """Runs the ResNet trunk without the final avgpool: [N,3,H,W] -> [N,512,H/32,W/32]."""
+        with torch.inference_mode():
+            fmap = self.feature_extractor[:-1](batch)
+        return fmap
+
+    def compute_similarity(self, emb1, emb2):
+        """Calculates cosine similarity between two embeddings."""
+        cos = nn.CosineSimilarity(dim=0)
+        return cos(emb1, emb2).item()
+
+    def compute_similarities(self, emb, embs):
+        """Cosine similarity of one embedding against every row of embs (one mat-vec).
+
+        emb may also be a [K,D] matrix of references; the result is then [N,K]
+        (one matrix multiply).
+        """
+        ref = F.normalize(emb, dim=-1)
+        return F.normalize(embs, dim=1) @ (ref if ref.dim() == 1 else ref.T)
+
+    def predict_batch(self, references, queries, embedder=None, batch_size=32, top_k=0):
+        """Scores every reference embedding against every query image.
+
+        references: [D] embeddings (or a [K,D] matrix); queries: images (bytes or
+        PIL), embedded with embed_images. Returns the [K,N] cosine score matrix,
+        or with top_k > 0 the (scores, indices) of the best min(top_k, N)
+        queries per reference, both [K,k].
+        """
+        refs = references if torch.is_tensor(references) else torch.stack([r.flatten() for r in references])
+        embeddings = self.embed_images(queries, embedder, batch_size)
+        with span("score"):
+            scores = self.compute_similarities(refs.to(embeddings.device), embeddings).T.float().cpu()
+            if top_k > 0:
+                return scores.topk(min(top_k, scores.shape[1]), dim=1)
+        return scores
+
+    # Keep the old predict method for backward compatibility
+    def predict(self, ref_bytes, query_bytes, threshold=0.75, ref_embedding=None, query_embedding=None):
+        # Precomputed embeddings (cache, batching scheduler) skip the forward pass
+        emb_ref = ref_embedding if ref_embedding is not None else self.get_embedding(self.preprocess(ref_bytes))
+        emb_query = query_embedding if query_embedding is not None else self.get_embedding(self.preprocess(query_bytes))
+        score = self.compute_similarity(emb_ref, emb_query)
+        return {"score": score, "is_match": score > threshold}
+
+
+if __name__ == "__main__":
+    # Export the truncated weights once, then start servers with --weights (offline, fast)
+    parser = argparse.ArgumentParser(description="Export the SiameseNetwork feature extractor")
+    parser.add_argument("output", help="Where to write the weights (e.g. feature_extractor.pt)")
+    args = parser.parse_args()
+    SiameseNetwork().save_weights(args.output)
+    print(f"Saved feature extractor weights to {args.output}")
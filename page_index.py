@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PageIndex:
+    """Persistent per-page window embeddings, as memory-mapped .npy files on local disk.
+
+    One file per (page, window size, pyramid scale): a float32 [N, 2+D]
+    matrix whose rows are the x, y of a crop-engine window followed by its
+    embedding. Once a page is indexed at a geometry, scanning it for any
+    reference of that size is one matrix-vector product.
+
+    Files live under <root>/<namespace>/<page hash>/, the namespace being the
+    model fingerprint so embeddings from other weights or backends are never
+    reused. The total file size is kept under max_bytes by deleting the least
+    recently used files (file mtime, refreshed on every hit, so the order
+    survives restarts).
+    """
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, namespace="default"):
+        self.root = root
+        self.directory = os.path.join(root, namespace)
+        self.max_bytes = max(0, int(max_bytes))
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Existing files, least recently used first
+        self._files = OrderedDict()  # path -> nbytes
+        self._bytes = 0
+        found = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if not name.endswith(".npy"):
+                    continue
+                st = os.stat(path)
+                found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._files[path] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def page_key(source):
+        """Hash of the page's encoded bytes (bytes or a seekable binary file), or None for a decoded image."""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return hashlib.blake2b(source, digest_size=16).hexdigest()
+        if not hasattr(source, "read"):
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        position = source.tell()
+        source.seek(0)
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+        source.seek(position)
+        return digest.hexdigest()
+
+    def _path(self, page_key, window_size, scale):
+        return os.path.join(self.directory, page_key,
+                            f"{window_size[0]}x{window_size[1]}@{float(scale):g}.npy")
+
+    def has(self, page_key, window_size, scale=1.0):
+        with self._lock:
+            return self._path(page_key, window_size, scale) in self._files
+
+    def get(self, page_key, window_size, scale=1.0):
+        """The [N, 2+D] matrix (copy-on-write mmap) or None if not indexed."""
+        path = self._path(page_key, window_size, scale)
+        with self._lock:
+            if path not in self._files:
+                self.misses += 1
+                return None
+            self._files.move_to_end(path)
+            self.hits += 1
+        try:
+            entry = np.load(path, mmap_mode="c")
+            os.utime(path)
+        except (OSError, ValueError):
+            # Deleted or truncated behind our back: forget it and rebuild
+            with self._lock:
+                self._bytes -= self._files.pop(path, 0)
+            return None
+        return entry
+
+    def put(self, page_key, window_size, scale, coords, embeddings):
+        """Stores windows (coords [N,2], embeddings [N,D]) and returns the mmap'd matrix."""
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        embeddings = embeddings.reshape(len(coords), embeddings.size // max(1, len(coords)))
+        entry = np.concatenate([coords, embeddings], axis=1)
+        path = self._path(page_key, window_size, scale)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write next to the final name and rename, so readers never see half a file
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, entry)
+        os.replace(tmp, path)
+
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - self._files.pop(path, 0)
+            self._files[path] = size
+            self._evict()
+        return np.load(path, mmap_mode="c") if os.path.exists(path) else entry
+
+    def _evict(self):
+        while self._files and self._bytes > self.max_bytes:
+            path, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))  # only succeeds once the page has no files left
+            except OSError:
+                pass
+
+    def __len__(self):
+        with self._lock:
+            return len(self._files)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._files), "bytes": self._bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+def parse_window(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+if __name__ == "__main__":
+    # Index a drawing set ahead of time: every page at every window size/scale
+    # that will be searched, with the same model settings as the server
+    try:
+        from server.model import SiameseNetwork, load_image
+        from server.scanner import BlueprintScanner
+        from server.backends import BACKENDS
+    except ImportError:
+        from model import SiameseNetwork, load_image
+        from scanner import BlueprintScanner
+        from backends import BACKENDS
+
+    parser = argparse.ArgumentParser(description="Warm a page index for a set of blueprints")
+    parser.add_argument("root", help="Page index directory (server --page-index)")
+    parser.add_argument("blueprints", nargs="+", help="Blueprint images to index")
+    parser.add_argument("--window", action="append", type=parse_window, default=[],
+                        help="Window size WxH to index (repeatable)")
+    parser.add_argument("--reference", action="append", default=[],
+                        help="Reference symbol image whose size to index (repeatable)")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--max-mb", type=float, default=2048)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--backend", default="eager", choices=BACKENDS)
+    parser.add_argument("--calibration", nargs="+", default=None)
+    parser.add_argument("--weights", default=None)
+    args = parser.parse_args()
+
+    window_sizes = sorted(set(args.window) | {load_image(open(p, "rb").read()).size
+                                              for p in args.reference})
+    if not window_sizes:
+        parser.error("give at least one --window or --reference")
+
+    model = SiameseNetwork(backend=args.backend, calibration_images=args.calibration,
+                           weights_path=args.weights)
+    index = PageIndex(args.root, int(args.max_mb * 1024 * 1024), namespace=model.fingerprint)
+    scanner = BlueprintScanner(model, batch_size=args.batch_size, page_index=index)
+
+    for path in args.blueprints:
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            built = scanner.index_page(f.read(), window_sizes, args.scales)
+        print(f"{path}: {built} new entries in {time.perf_counter() - start:.1f}s")
+    print(f"Page index: {index.stats()}")
@@ -0,0 +1,192 @@
+import io
+import math
+
+from PIL import Image, ImageFile
+
+# Bits per pixel of the raw layouts whose rows can be addressed directly
+# (single-strip TIFF, PBM/PGM/PPM, uncompressed BMP)
+_RAW_BITS = {"1": 1, "1;I": 1, "1;R": 1, "1;IR": 1, "L": 8, "L;I": 8, "P": 8,
+             "RGB": 24, "BGR": 24, "RGBX": 32, "RGBA": 32, "BGRX": 32, "BGRA": 32}
+# Band decoding rewrites PIL's private tile list and size; on a PIL where
+# those look different, pages fall back to being decoded whole
+_BAND_ERRORS = (AttributeError, TypeError, ValueError, IndexError, KeyError)
+
+
+def _tile(codec, extents, offset, args):
+    # Pillow 11 has a named tuple for tile entries; older versions take plain tuples
+    make = getattr(ImageFile, "_Tile", None)
+    return make(codec, extents, offset, args) if make is not None else (codec, extents, offset, args)
+
+
+def page_mode(mode):
+    """Working mode of a decoded page: L (1 byte/px) for grey and 1-bit drawings, RGB otherwise."""
+    return "L" if mode in ("1", "L", "LA") else "RGB"
+
+
+def load_page(source):
+    """Decodes a blueprint like model.load_image, but keeps grey and 1-bit drawings in L.
+
+    The scanner converts to RGB one window strip at a time (image_to_tensor),
+    so the page itself never takes 3 bytes per pixel unless it is in colour.
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source)
+    mode = page_mode(image.mode)
+    if image.mode != mode:
+        return image.convert(mode)
+    # Decode now rather than on the first crop, so decoding is done (and timed) here
+    image.load()
+    return image
+
+
+class PageBand:
+    """Rows [top, top + image.height) of a page level, posing as the whole level.
+
+    Has what the scan engines use of a page (size, mode, crop and resize with
+    a box), in the level's coordinates, so they scan a band of a page that
+    is never decoded whole. Only the decoded rows may be touched.
+    """
+
+    def __init__(self, image, top, size):
+        self.image = image
+        self.top = top
+        self.size = size
+        self.mode = image.mode
+
+    def crop(self, box):
+        x0, y0, x1, y1 = box
+        return self.image.crop((x0, y0 - self.top, x1, y1 - self.top))
+
+    def resize(self, size, resample=None, box=None):
+        x0, y0, x1, y1 = box if box is not None else (0, 0) + self.size
+        return self.image.resize(size, resample, box=(x0, y0 - self.top, x1, y1 - self.top))
+
+
+class PageReader:
+    """Reads a blueprint band by band instead of decoding it whole.
+
+    Layouts PIL decodes with its "raw" codec (uncompressed TIFF, in strips or
+    tiles, PBM/PGM/PPM and uncompressed BMP) are band-decoded: only the
+    strips or rows of a band are read, so memory follows the band, not the
+    page. Compressed formats (PNG, JPEG, LZW/G4 TIFF through libtiff, ...)
+    can only be decoded in one go; they are decoded once, in their compact
+    mode (see page_mode; 1-bit kept as is), and bands are cut from that.
+    Band decoding goes through PIL internals (the tile list); if they are
+    not what it expects, the page is decoded whole instead.
+
+    Pages are kept in L or RGB (page_mode); 1-bit drawings are read as L.
+    source is the encoded page: bytes, a path or a seekable binary file (or
+    an already decoded image, e.g. a rasterized PDF page).
+    """
+
+    def __init__(self, source):
+        self.source = source
+        image = self._open()
+        self.size = image.size
+        self.mode = page_mode(image.mode)
+        self.banded = self._can_band(image)
+        self._page = None
+        if not self.banded:
+            self._decode_whole(image)
+
+    def _decode_whole(self, image=None):
+        # 1-bit pages stay 1-bit (one byte per pixel either way); bands are converted
+        image = image if image is not None else self._open()
+        self._page = image if image.mode in ("1", self.mode) else load_page(image)
+        self._page.load()
+        self.banded = False
+
+    def _open(self):
+        if isinstance(self.source, Image.Image):
+            return self.source
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            return Image.open(io.BytesIO(self.source))
+        if hasattr(self.source, "seek"):
+            self.source.seek(0)
+        return Image.open(self.source)
+
+    @staticmethod
+    def _can_band(image):
+        if not hasattr(image, "_size"):
+            return False
+        try:
+            tiles = image.tile
+            if not tiles or any(len(t) != 4 or len(t[1]) != 4 or t[0] != "raw" for t in tiles):
+                return False
+            # TIFF applies the EXIF orientation after decoding; bands would come out unrotated
+            if image.getexif().get(0x0112, 1) != 1:
+                return False
+            if len(tiles) > 1:
+                return True
+            args = tiles[0][3] if isinstance(tiles[0][3], tuple) else (tiles[0][3],)
+            return tiles[0][1] == (0, 0) + image.size and args[0] in _RAW_BITS
+        except _BAND_ERRORS:
+            return False
+
+    def level_size(self, scale):
+        """Size of the pyramid level at scale (as BlueprintScanner.build_pyramid)."""
+        if scale == 1.0:
+            return self.size
+        w, h = self.size
+        return max(1, int(round(w / scale))), max(1, int(round(h / scale)))
+
+    def read(self, top, bottom):
+        """Page rows [top, bottom) as an L or RGB image."""
+        w, h = self.size
+        top, bottom = max(0, top), min(h, bottom)
+        if self.banded:
+            try:
+                return self._read_band(top, bottom)
+            except _BAND_ERRORS as e:
+                print(f"Band decoding failed ({e!r}); decoding the whole page")
+                self._decode_whole()
+        band = self._page.crop((0, top, w, bottom))
+        return band if band.mode == self.mode else band.convert(self.mode)
+
+    def _read_band(self, top, bottom):
+        w, h = self.size
+        image = self._open()
+        tiles = image.tile
+        if len(tiles) == 1:
+            # One strip: address the band's rows inside it
+            codec, _, offset, args = tiles[0]
+            args = (args,) if isinstance(args, str) else tuple(args)
+            rawmode = args[0]
+            stride = (args[1] if len(args) > 1 else 0) or -(-w * _RAW_BITS[rawmode] // 8)
+            orientation = args[2] if len(args) > 2 else 1
+            first = top if orientation >= 0 else h - bottom
+            start, end = top, bottom
+            tiles = [_tile(codec, (0, 0, w, bottom - top), offset + first * stride,
+                           (rawmode, stride, orientation))]
+        else:
+            # Strips / tiles: keep those overlapping the band, shifted to its top
+            tiles = [t for t in tiles if t[1][1] < bottom and t[1][3] > top]
+            start, end = min(t[1][1] for t in tiles), max(t[1][3] for t in tiles)
+            tiles = [_tile(c, (e[0], e[1] - start, e[2], e[3] - start), o, a)
+                     for c, e, o, a in tiles]
+
+        image._size = (w, end - start)
+        if hasattr(image, "_tile_size"):  # TIFF allocates its buffer from this
+            image._tile_size = image._size
+        image.tile = tiles
+        image.load()
+        band = image.crop((0, top - start, w, bottom - start)) if (start, end) != (top, bottom) else image
+        return band if band.mode == self.mode else band.convert(self.mode)
+
+    def read_level(self, top, bottom, scale=1.0):
+        """Rows [top, bottom) of the pyramid level at scale, resized from just the page rows they need."""
+        if scale == 1.0:
+            return self.read(top, bottom)
+        w, h = self.size
+        level_w, level_h = self.level_size(scale)
+        top, bottom = max(0, top), min(level_h, bottom)
+        sy = h / level_h
+        # The bilinear filter reaches about one source step past each edge
+        margin = int(math.ceil(max(sy, 1.0))) + 2
+        src_top = max(0, int(top * sy) - margin)
+        src_bottom = min(h, int(math.ceil(bottom * sy)) + margin)
+        band = self.read(src_top, src_bottom)
+        return band.resize((level_w, bottom - top), Image.BILINEAR,
+                           box=(0, top * sy - src_top, w, bottom * sy - src_top))
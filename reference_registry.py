@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ReferenceRegistry:
+    """Registered reference symbols (embedding, decoded size, template) with TTL eviction.
+
+    A reference is registered once and then scanned by id across many pages,
+    so scan requests don't have to resend or re-decode the image. Every lookup
+    pushes the expiry back by the entry's TTL, so a long drawing-set run keeps
+    its reference alive. max_entries bounds memory; when it is reached, the
+    least recently used entry is dropped first (not necessarily the one
+    closest to expiry, as TTLs can differ).
+
+    Registered image bytes count against max_image_bytes. Past it, the least
+    recently used references lose their image (they can still be scanned,
+    but not in other orientations) until the rest fits.
+    """
+
+    def __init__(self, default_ttl=3600, max_entries=1024, max_image_bytes=64 * 1024 * 1024):
+        self.default_ttl = default_ttl
+        self.max_entries = max(1, int(max_entries))
+        self.max_image_bytes = max(0, int(max_image_bytes))
+        self._entries = OrderedDict()  # reference_id -> [embedding, size, ttl, expires_at, template, image]
+        self._image_bytes = 0
+        self._lock = threading.Lock()
+
+    def register(self, reference_id, embedding, size, ttl=None, template=None, image=None):
+        """Stores a reference under reference_id and returns the TTL it got (seconds).
+
+        template is the reference's cascade template (scanner.reference_template);
+        image its encoded bytes, kept for scans that need the reference in
+        other orientations.
+        """
+        ttl = ttl if ttl and ttl > 0 else self.default_ttl
+        now = time.monotonic()
+        if image is not None and len(image) > self.max_image_bytes:
+            image = None
+        with self._lock:
+            self._evict_expired(now)
+            self._drop(reference_id)
+            self._entries[reference_id] = [embedding, tuple(size), ttl, now + ttl, template, image]
+            self._image_bytes += len(image) if image is not None else 0
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+            # Least recently used first; the new entry is last and fits on its own
+            for entry in self._entries.values():
+                if self._image_bytes <= self.max_image_bytes:
+                    break
+                if entry[5] is not None:
+                    self._image_bytes -= len(entry[5])
+                    entry[5] = None
+        return ttl
+
+    def get(self, reference_id):
+        """Returns (embedding, (w, h), template) for a live reference, or None if unknown/expired."""
+        entry = self._touch(reference_id)
+        return None if entry is None else (entry[0], entry[1], entry[4])
+
+    def image(self, reference_id):
+        """The image bytes a live reference was registered with, or None (unknown/expired or not kept,
+        see max_image_bytes)."""
+        entry = self._touch(reference_id)
+        return None if entry is None else entry[5]
+
+    def _touch(self, reference_id):
+        # A lookup counts as use: it pushes the expiry back
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(reference_id)
+            if entry is None:
+                return None
+            entry[3] = now + entry[2]
+            self._entries.move_to_end(reference_id)
+            return entry
+
+    def remove(self, reference_id):
+        with self._lock:
+            return self._drop(reference_id)
+
+    def __len__(self):
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return len(self._entries)
+
+    def _evict_expired(self, now):
+        # Entries are ordered by last use, and expiry only moves forward on use
+        # (TTLs can differ, so scan rather than stopping at the first live one)
+        expired = [rid for rid, entry in self._entries.items() if entry[3] <= now]
+        for rid in expired:
+            self._drop(rid)
+
+    def _drop(self, reference_id):
+        entry = self._entries.pop(reference_id, None)
+        if entry is not None and entry[5] is not None:
+            self._image_bytes -= len(entry[5])
+        return entry is not None
@@ -1,96 +1,1193 @@
-import numpy as np
-from PIL import Image
-
-class BlueprintScanner:
-    def __init__(self, model):
-        self.model = model
-
-    def sliding_window(self, image, step_size, window_size):
-        w, h = image.size
-        # Use a larger step size (70% of window) to reduce total checks
-        # This makes it faster and produces fewer duplicate boxes
-        step_x = int(window_size[0] * 0.7)
-        step_y = int(window_size[1] * 0.7)
-        
-        for y in range(0, h - window_size[1], step_y):
-            for x in range(0, w - window_size[0], step_x):
-                yield (x, y, image.crop((x, y, x + window_size[0], y + window_size[1])))
-
-    def calculate_iou(self, boxA, boxB):
-        # Determine the coordinates of the intersection rectangle
-        xA = max(boxA['x'], boxB['x'])
-        yA = max(boxA['y'], boxB['y'])
-        xB = min(boxA['x'] + boxA['width'], boxB['x'] + boxB['width'])
-        yB = min(boxA['y'] + boxA['height'], boxB['y'] + boxB['height'])
-
-        # Compute the area of intersection rectangle
-        interArea = max(0, xB - xA) * max(0, yB - yA)
-        if interArea == 0: return 0
-
-        # Compute the area of both rectangles
-        boxAArea = boxA['width'] * boxA['height']
-        boxBArea = boxB['width'] * boxB['height']
-
-        # Compute IoU
-        iou = interArea / float(boxAArea + boxBArea - interArea)
-        return iou
-
-    def apply_nms(self, boxes, iou_threshold=0.1): # aggressive threshold
-        if not boxes: return []
-        
-        # Sort boxes by score (highest first)
-        boxes = sorted(boxes, key=lambda x: x['score'], reverse=True)
-        keep = []
-        
-        while boxes:
-            current = boxes.pop(0)
-            keep.append(current)
-            
-            remaining = []
-            for box in boxes:
-                iou = self.calculate_iou(current, box)
-                # If they overlap AT ALL (0.1), kill the weaker one
-                if iou < iou_threshold:
-                    remaining.append(box)
-            boxes = remaining
-            
-        return keep
-
-    def scan(self, ref_bytes, blueprint_bytes, threshold=0.85): # <--- HIGH THRESHOLD
-        ref_img = self.model._load_image(ref_bytes)
-        blueprint_img = self.model._load_image(blueprint_bytes)
-        
-        win_w, win_h = ref_img.size
-        
-        # Pre-calculate Reference Embedding
-        ref_tensor = self.model.preprocess(ref_bytes)
-        ref_embedding = self.model.get_embedding(ref_tensor)
-
-        matches = []
-        
-        # Dynamic step size based on window width
-        step = int(win_w * 0.5)
-        
-        print(f"Scanning blueprint ({blueprint_img.size}) with window ({win_w}x{win_h})...")
-        
-        for (x, y, patch) in self.sliding_window(blueprint_img, step, (win_w, win_h)):
-            patch_tensor = self.model.transform(patch).unsqueeze(0).to(self.model.device)
-            patch_embedding = self.model.get_embedding(patch_tensor)
-            score = self.model.compute_similarity(ref_embedding, patch_embedding)
-            
-            # Only keep VERY strong matches
-            if score > threshold:
-                matches.append({
-                    "x": x, "y": y, 
-                    "width": win_w, "height": win_h, 
-                    "score": score
-                })
-        
-        print(f"Raw candidates: {len(matches)}")
-        
-        # Apply NMS with a very aggressive overlap check (0.1)
-        # This means if two boxes touch even slightly, we only keep the best one.
-        clean_matches = self.apply_nms(matches, iou_threshold=0.1)
-        
-        print(f"Final matches: {len(clean_matches)}")
-        return clean_matches
\ No newline at end of file
+import heapq
+import itertools
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+try:
+    from server.cancellation import check as check_cancelled
+    from server.metrics import count, span
+    from server.page_reader import PageBand, PageReader, load_page
+except ImportError:
+    from cancellation import check as check_cancelled
+    from metrics import count, span
+    from page_reader import PageBand, PageReader, load_page
+
+# A 224px network input is 7x7 cells of the ResNet18 trunk (stride 32)
+FEATURE_STRIDE = 32
+WINDOW_CELLS = 224 // FEATURE_STRIDE
+
+# Above this many candidates NMS only compares boxes in neighbouring grid cells
+GRID_NMS_MIN_BOXES = 5000
+
+# Bound on the cosine score difference between embed_windows (tensor
+# preprocessing) and the per-patch PIL crop + transform it replaced. Only
+# PIL's uint8 rounding differs; measured <= 2e-5 on line drawings and noise
+PREPROCESS_TOLERANCE = 1e-3
+
+# Cascade engine: the cheap stages compare windows at low resolution, with
+# the reference shrunk to about this many pixels on its longer side
+CASCADE_TEMPLATE_SIZE = 16
+# Without a reference template, windows whose ink std is below this count as
+# blank paper (ink is 0 for white, 1 for black)
+CASCADE_BLANK_STD = 0.02
+
+
+def _cascade_factor(window_size):
+    """Integer downscale factor of the cascade's low-resolution stages for this window size."""
+    return max(1, int(round(max(window_size) / CASCADE_TEMPLATE_SIZE)))
+
+
+def _cascade_reach(window_size):
+    """Rows above its first window row at which a band's refined cascade windows can start."""
+    f = _cascade_factor(window_size)
+    return (int(int(window_size[1] * 0.7) / (2 * f)) + 1) * f
+
+
+def _ink(image, f):
+    """Grey image box-reduced by f -> float32 tensor, 0 for white paper and 1 for black ink.
+
+    Every low-res pixel averages one f x f block, so crops starting on a
+    multiple of f reduce to exactly the same pixels as the whole page.
+    """
+    grey = image.convert("L")
+    if f > 1:
+        grey = grey.reduce(f)
+    return 1 - torch.from_numpy(np.array(grey, dtype=np.float32)) / 255
+
+
+def reference_template(image):
+    """Low-resolution ink map of a reference image for the cascade engine.
+
+    Kept next to the reference embedding: a few hundred bytes, and enough for
+    the ink and cross-correlation stages without the original image.
+    """
+    return _ink(image, _cascade_factor(image.size)).numpy()
+
+
+# The 8 orientations a symbol can have on a sheet, as (counterclockwise
+# rotation in degrees, mirrored). A mirrored symbol is flipped left to right,
+# then rotated. Upright comes first
+ORIENTATIONS = ((0, False), (90, False), (180, False), (270, False),
+                (0, True), (90, True), (180, True), (270, True))
+_ROTATIONS = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+
+
+def orient(image, rotation=0, mirrored=False):
+    """image turned into one of the ORIENTATIONS (90 and 270 swap its width and height)."""
+    if mirrored:
+        image = image.transpose(Image.FLIP_LEFT_RIGHT)
+    if rotation:
+        image = image.transpose(_ROTATIONS[rotation])
+    return image
+
+
+def _window_stats(ink, th, tw):
+    """Mean and std of every th x tw window of a 2-D tensor, from integral images."""
+    def box_sums(t):
+        s = F.pad(t.double().cumsum(0).cumsum(1), (1, 0, 1, 0))
+        return s[th:, tw:] - s[:-th, tw:] - s[th:, :-tw] + s[:-th, :-tw]
+    n = th * tw
+    mean = box_sums(ink) / n
+    var = (box_sums(ink * ink) / n - mean * mean).clamp_(min=0)
+    return mean.float(), var.sqrt().float()
+
+
+def _add_stats(stats, counts):
+    if stats is not None:
+        for name, value in counts.items():
+            stats[name] = stats.get(name, 0) + value
+
+
+def _boxes(x, y, window_size, scores):
+    """[n,5] rows (x, y, w, h, score) for windows of one size."""
+    return np.column_stack([
+        np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64),
+        np.full((len(scores), 2), window_size, dtype=np.float64), scores
+    ])
+
+
+def group_references(references):
+    """Groups (embedding, (w, h), template) references by window size.
+
+    Returns a list of (window_size, indices, embeddings [K,D], templates) with
+    indices into references; templates is a [K,th,tw] stack, or None when a
+    reference in the group has none.
+    """
+    groups = {}
+    for k, (_, window_size, _) in enumerate(references):
+        groups.setdefault(tuple(window_size), []).append(k)
+    out = []
+    for window_size, indices in groups.items():
+        embeddings = torch.stack([references[k][0] for k in indices])
+        templates = [references[k][2] for k in indices]
+        templates = None if any(t is None for t in templates) else np.stack(templates)
+        out.append((window_size, indices, embeddings, templates))
+    return out
+
+
+def boxes_to_array(boxes):
+    """List of box dicts -> compact [N,5] float64 array of (x, y, width, height, score)."""
+    return np.array([[b['x'], b['y'], b['width'], b['height'], b['score']] for b in boxes],
+                    dtype=np.float64).reshape(-1, 5)
+
+
+def array_to_boxes(arr):
+    """[N,5] array -> list of box dicts (the format the servicer returns)."""
+    return [{"x": int(x), "y": int(y), "width": int(w), "height": int(h), "score": float(s)}
+            for x, y, w, h, s in arr.tolist()]
+
+
+def oriented_boxes(arr):
+    """[N,6] array (x, y, w, h, score, ORIENTATIONS index) -> box dicts with rotation and mirrored."""
+    boxes = array_to_boxes(arr[:, :5])
+    for box, k in zip(boxes, arr[:, 5].astype(np.int64).tolist() if len(arr) else []):
+        box["rotation"], box["mirrored"] = ORIENTATIONS[k]
+    return boxes
+
+
+def oriented_nms(candidates, iou_threshold=0.1):
+    """One NMS pass over the candidates of every orientation (one [N,5] array per
+    ORIENTATIONS entry); a symbol several variants match is kept once, with the
+    best of them. Returns oriented_boxes."""
+    arr = np.concatenate([np.column_stack([c, np.full(len(c), k, dtype=np.float64)])
+                          for k, c in enumerate(candidates)])
+    with span("nms"):
+        return oriented_boxes(arr[nms_array(arr, iou_threshold)])
+
+
+def _iou_one_to_many(arr, i, others):
+    x1 = np.maximum(arr[i, 0], arr[others, 0])
+    y1 = np.maximum(arr[i, 1], arr[others, 1])
+    x2 = np.minimum(arr[i, 0] + arr[i, 2], arr[others, 0] + arr[others, 2])
+    y2 = np.minimum(arr[i, 1] + arr[i, 3], arr[others, 1] + arr[others, 3])
+    inter = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    union = arr[i, 2] * arr[i, 3] + arr[others, 2] * arr[others, 3] - inter
+    # Same convention as calculate_iou: no intersection means IoU 0
+    iou = np.zeros(len(others))
+    hit = inter > 0
+    iou[hit] = inter[hit] / union[hit]
+    return iou
+
+
+def nms_array(arr, iou_threshold=0.1, use_grid=None):
+    """Greedy NMS on an [N,5] (x, y, w, h, score) array.
+
+    Returns the kept row indices, best score first. The result is identical to
+    BlueprintScanner.apply_nms: stable score ordering, and a box survives only
+    while its IoU with every kept box is below iou_threshold.
+
+    use_grid buckets boxes into cells the size of the largest box, so each kept
+    box is only compared with boxes from the 3x3 neighbouring cells. None picks
+    it automatically for large inputs.
+    """
+    n = len(arr)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(-arr[:, 4], kind="stable")
+    if use_grid is None:
+        use_grid = n >= GRID_NMS_MIN_BOXES
+    # Non-overlapping boxes only suppress each other when the threshold is <= 0
+    if not use_grid or iou_threshold <= 0:
+        keep = []
+        while order.size:
+            i = order[0]
+            keep.append(i)
+            rest = order[1:]
+            order = rest[_iou_one_to_many(arr, i, rest) < iou_threshold]
+        return np.array(keep, dtype=np.int64)
+
+    cell = max(arr[:, 2].max(), arr[:, 3].max(), 1.0)
+    cx = np.floor(arr[:, 0] / cell).astype(np.int64)
+    cy = np.floor(arr[:, 1] / cell).astype(np.int64)
+    buckets = {}
+    for idx, key in enumerate(zip(cx.tolist(), cy.tolist())):
+        buckets.setdefault(key, []).append(idx)
+    buckets = {k: np.array(v, dtype=np.int64) for k, v in buckets.items()}
+
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for i in order.tolist():
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        near = [buckets[(cx[i] + dx, cy[i] + dy)]
+                for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                if (cx[i] + dx, cy[i] + dy) in buckets]
+        near = np.concatenate(near)
+        near = near[(rank[near] > rank[i]) & ~suppressed[near]]
+        if near.size:
+            suppressed[near[_iou_one_to_many(arr, i, near) >= iou_threshold]] = True
+    return np.array(keep, dtype=np.int64)
+
+
+class IncrementalNMS:
+    """Greedy NMS resolved band by band while a scan is still running.
+
+    Candidates are added as bands finish. flush(frontier_y) finalizes every
+    group of candidates that can no longer interact with a future box, given
+    that all later candidates start at y >= frontier_y. Boxes reaching past
+    the frontier, and anything linked to them through IoU >= iou_threshold
+    overlaps, stay pending. The union of all flushes equals one apply_nms
+    pass over every candidate.
+    """
+
+    def __init__(self, iou_threshold=0.1):
+        self.iou_threshold = iou_threshold
+        self.pending = np.zeros((0, 5))
+
+    def add(self, arr):
+        if len(arr):
+            self.pending = np.concatenate([self.pending, arr])
+
+    def flush(self, frontier_y=None):
+        """Returns the newly final boxes as an [N,5] array (best first within the flush)."""
+        pending = self.pending
+        if frontier_y is None:
+            # End of scan: everything left is final
+            self.pending = np.zeros((0, 5))
+            return pending[nms_array(pending, self.iou_threshold)]
+        if self.iou_threshold <= 0:
+            # Every pair of boxes can interact, so nothing is final before the end
+            return np.zeros((0, 5))
+
+        # Grow the open set from boxes that reach past the frontier
+        is_open = pending[:, 1] + pending[:, 3] > frontier_y
+        queue = list(np.flatnonzero(is_open))
+        while queue:
+            i = queue.pop()
+            closed = np.flatnonzero(~is_open)
+            if not closed.size:
+                break
+            linked = closed[_iou_one_to_many(pending, i, closed) >= self.iou_threshold]
+            is_open[linked] = True
+            queue.extend(linked.tolist())
+
+        done = pending[~is_open]
+        self.pending = pending[is_open]
+        return done[nms_array(done, self.iou_threshold)]
+
+
+class TopMatches:
+    """The best k boxes of a scan, kept online with greedy NMS in O(k) memory.
+
+    Kept boxes live in a min-heap on score. A candidate overlapping a kept
+    box (IoU >= iou_threshold) that scores at least as high is dropped; one
+    that beats every kept box it overlaps replaces them; beyond k boxes the
+    weakest goes. Once the heap is full, floor is the weakest kept score:
+    anything at or below it cannot get in, so scans raise their threshold to
+    it as they go. Gives the k best boxes of apply_nms over all candidates,
+    except that a box suppressed by one that is itself replaced later is not
+    brought back.
+    """
+
+    def __init__(self, k, iou_threshold=0.1):
+        self.k = max(1, int(k))
+        self.iou_threshold = iou_threshold
+        self._heap = []  # (score, seq, box row)
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def floor(self):
+        return self._heap[0][0] if len(self._heap) >= self.k else -np.inf
+
+    def add(self, arr):
+        """Offers an [N,5] array of candidates (extra columns are carried along)."""
+        for box in arr[np.argsort(-arr[:, 4], kind="stable")]:
+            if box[4] <= self.floor:
+                break  # sorted: the rest can't get in either
+            if self._heap:
+                both = np.vstack([box] + [row for _, _, row in self._heap])
+                overlap = _iou_one_to_many(both, 0, np.arange(1, len(both))) >= self.iou_threshold
+                if overlap.any():
+                    if both[1:][overlap, 4].max() >= box[4]:
+                        continue
+                    self._heap = [entry for entry, hit in zip(self._heap, overlap) if not hit]
+                    heapq.heapify(self._heap)
+            heapq.heappush(self._heap, (box[4], next(self._seq), box))
+            if len(self._heap) > self.k:
+                heapq.heappop(self._heap)
+
+    def array(self):
+        """The kept boxes as an [N,5] array (or as wide as the rows added), best first."""
+        rows = [row for _, _, row in sorted(self._heap, key=lambda e: (-e[0], e[1]))]
+        return np.array(rows, dtype=np.float64) if rows else np.zeros((0, 5))
+
+
+class BlueprintScanner:
+    ENGINES = ("crop", "dense", "cascade")
+
+    def __init__(self, model, batch_size=32, dense_tile_cells=32, stream_band_rows=4, embedder=None,
+                 cascade_ink_ratio=0.25, cascade_min_ncc=0.3, cascade_oriented_ncc=0.4, page_index=None,
+                 tiled=False):
+        self.model = model
+        # Where window batches are embedded: the model itself, or a shared
+        # batching scheduler so concurrent requests coalesce
+        self.embedder = embedder or model
+        # How many windows go through the network in one forward pass
+        self.batch_size = max(1, int(batch_size))
+        # Dense engine: window positions per tile side (bounds feature-map memory)
+        self.dense_tile_cells = max(1, int(dense_tile_cells))
+        # Streaming scans: crop-engine window rows per band (dense bands are tile rows)
+        self.stream_band_rows = max(1, int(stream_band_rows))
+        # Cascade engine: a window is dropped before the network when the ink
+        # around it is below this fraction of the reference's, or when its best
+        # low-res cross-correlation with the reference is below cascade_min_ncc
+        self.cascade_ink_ratio = cascade_ink_ratio
+        self.cascade_min_ncc = cascade_min_ncc
+        # Same cutoff for any_orientation scans, applied to the best of the 8
+        # orientations: a maximum over 8 correlations is higher on clutter too
+        self.cascade_oriented_ncc = cascade_oriented_ncc
+        # Optional PageIndex: crop-engine window embeddings persisted per page,
+        # so scanning a page again at a known window size skips the network
+        self.page_index = page_index
+        # Tiled mode: pages are read band by band (PageReader) and scanned as
+        # they are read, so memory follows the band size instead of the page
+        self.tiled = tiled
+
+    def sliding_window(self, image, step_size, window_size, ys=None):
+        w, h = image.size
+        # Use a larger step size (70% of window) to reduce total checks
+        # This makes it faster and produces fewer duplicate boxes
+        step_x = int(window_size[0] * 0.7)
+        
+        rows = self.window_rows(image.size, window_size) if ys is None else ys
+        for y in rows:
+            for x in range(0, w - window_size[0], step_x):
+                patch = image.crop((x, y, x + window_size[0], y + window_size[1]))
+                # Pages may be kept in another mode (e.g. RGBX in shared memory);
+                # only the small crop is converted
+                yield (x, y, patch if patch.mode == "RGB" else patch.convert("RGB"))
+
+    def window_rows(self, image_size, window_size):
+        """Top edges of the sliding-window rows (same 70% step as sliding_window)."""
+        step_y = int(window_size[1] * 0.7)
+        return list(range(0, image_size[1] - window_size[1], step_y))
+
+    def embed_windows(self, image, window_size, step_size=None, ys=None):
+        """Yields (coords, embeddings) for the sliding windows, one mini-batch at a time.
+
+        Same windows as sliding_window, without a PIL crop + transform per
+        patch: each window row is cut out once as a strip and converted to a
+        normalised tensor, its windows are strided views of that strip
+        (unfold, no copy), and a whole batch is resized with one F.interpolate.
+        Scores stay within PREPROCESS_TOLERANCE of the per-patch PIL pipeline.
+        """
+        xs = list(range(0, image.size[0] - window_size[0], int(window_size[0] * 0.7)))
+        rows = self.window_rows(image.size, window_size) if ys is None else ys
+        if xs:
+            yield from self.embed_positions(image, window_size, [(y, xs) for y in rows])
+
+    def embed_positions(self, image, window_size, positions):
+        """embed_windows for arbitrary window positions, given as a list of (y, xs) rows."""
+        for coords, _, embeddings in self._embed_rows(window_size, ((image, y, xs, None) for y, xs in positions)):
+            yield coords, embeddings
+
+    def _embed_rows(self, window_size, rows):
+        """Embeds window rows (image, y, xs, tag), possibly of different images, in full batches.
+
+        Yields (coords, tags, embeddings), with the (x, y) and the row's tag of
+        every window in the batch.
+        """
+        step_x = int(window_size[0] * 0.7)
+        views, coords, tags, pending = [], [], [], 0
+        for image, y, xs, tag in rows:
+            with span("windows"):
+                strip = image.crop((0, y, image.size[0], y + window_size[1]))
+            with span("preprocess"):
+                strip = self.model.image_to_tensor(strip)
+            # [3,h,W] -> [n,3,h,w], one window per position: strided views for a
+            # row of the regular grid, a gather for arbitrary positions
+            if step_x and list(xs) == list(range(0, step_x * len(xs), step_x)):
+                windows = strip.unfold(2, window_size[0], step_x).permute(2, 0, 1, 3)[:len(xs)]
+            else:
+                windows = strip.unfold(2, window_size[0], 1).permute(2, 0, 1, 3)[list(xs)]
+            start = 0
+            while start < len(xs):
+                take = min(len(xs) - start, self.batch_size - pending)
+                views.append(windows[start:start + take])
+                coords.extend((x, y) for x in xs[start:start + take])
+                tags.extend([tag] * take)
+                pending += take
+                start += take
+                if pending == self.batch_size:
+                    yield coords, tags, self._embed_views(views)
+                    views, coords, tags, pending = [], [], [], 0
+
+        if views:
+            yield coords, tags, self._embed_views(views)
+
+    def _embed_views(self, views):
+        # Stop between batches once the client has given up on the request
+        check_cancelled()
+        # Gather the small windows first so the 224px batch is written only once
+        with span("preprocess"):
+            batch = self.model.windows_to_batch(torch.cat(views))
+        with span("embed"):
+            return self.embedder.get_embeddings(batch)
+
+    def _dense_grid(self, image_size, window_size):
+        """(cell_w, cell_h, nx, ny) of the dense window grid, or None if the page is too small."""
+        win_w, win_h = window_size
+        w, h = image_size
+        if w < win_w or h < win_h:
+            return None
+        cell_w, cell_h = win_w / WINDOW_CELLS, win_h / WINDOW_CELLS
+        return cell_w, cell_h, int((w - win_w) // cell_w) + 1, int((h - win_h) // cell_h) + 1
+
+    def dense_rows(self, image_size, window_size):
+        """First window row (in grid cells) of every dense tile row."""
+        grid = self._dense_grid(image_size, window_size)
+        return list(range(0, grid[3], self.dense_tile_cells)) if grid else []
+
+    def dense_scores(self, image, ref_embedding, window_size, rows=None):
+        """Yields (xs, ys, scores) tiles for the fully convolutional engine.
+
+        The page is resized so one window maps to 224x224 (exactly what the crop
+        engine does per patch) and the trunk runs once per tile. Window embeddings
+        are then 7x7 average pools of that shared feature map, so neighbouring
+        windows reuse the same convolutions. Windows are placed every 1/7 of the
+        window size. Tiles overlap by one window so every window fits in a tile.
+        rows restricts the scan to some tile rows (see dense_rows). With a [K,D]
+        matrix of references, scores are [K,n,m].
+        """
+        grid = self._dense_grid(image.size, window_size)
+        if grid is None:
+            return
+
+        cell_w, cell_h, nx, ny = grid
+        refs = F.normalize(ref_embedding.view(-1, ref_embedding.shape[-1]), dim=1)
+        tile = self.dense_tile_cells
+        extra = WINDOW_CELLS - 1
+
+        for i0 in (self.dense_rows(image.size, window_size) if rows is None else rows):
+            for j0 in range(0, nx, tile):
+                check_cancelled()
+                n, m = min(tile, ny - i0), min(tile, nx - j0)
+                box = (j0 * cell_w, i0 * cell_h, (j0 + m + extra) * cell_w, (i0 + n + extra) * cell_h)
+                size = ((m + extra) * FEATURE_STRIDE, (n + extra) * FEATURE_STRIDE)
+                with span("windows"):
+                    region = image.resize(size, Image.BILINEAR, box=box)
+                    if region.mode != "RGB":
+                        region = region.convert("RGB")
+
+                with span("preprocess"):
+                    batch = self.model.to_tensor(region).unsqueeze(0).to(self.model.device)
+                with span("embed"):
+                    fmap = self.model.get_feature_map(batch)
+                    pooled = F.avg_pool2d(fmap, kernel_size=WINDOW_CELLS, stride=1)[0]
+                # Every reference against every pooled window in one product
+                with span("score"):
+                    scores = torch.einsum("kd,dnm->knm", refs, F.normalize(pooled, dim=0))
+                count("windows", n * m)
+
+                xs = [int(round((j0 + j) * cell_w)) for j in range(m)]
+                ys = [int(round((i0 + i) * cell_h)) for i in range(n)]
+                yield xs, ys, (scores[0] if ref_embedding.dim() == 1 else scores).cpu()
+
+    def build_pyramid(self, image, scales):
+        """Yields (scale, level) pairs, one resized copy of the page per scale.
+
+        A scale is the symbol size on the page relative to the reference crop, so
+        level = page / scale and a reference-sized window on that level covers a
+        (scale x reference) region of the original page.
+        """
+        w, h = image.size
+        for scale in scales:
+            if scale <= 0:
+                raise ValueError(f"Pyramid scales must be positive, got {scale}")
+            if scale == 1.0:
+                yield scale, image
+                continue
+            size = (max(1, int(round(w / scale))), max(1, int(round(h / scale))))
+            with span("windows"):
+                level = image.resize(size, Image.BILINEAR)
+            yield scale, level
+
+    def calculate_iou(self, boxA, boxB):
+        # Determine the coordinates of the intersection rectangle
+        xA = max(boxA['x'], boxB['x'])
+        yA = max(boxA['y'], boxB['y'])
+        xB = min(boxA['x'] + boxA['width'], boxB['x'] + boxB['width'])
+        yB = min(boxA['y'] + boxA['height'], boxB['y'] + boxB['height'])
+
+        # Compute the area of intersection rectangle
+        interArea = max(0, xB - xA) * max(0, yB - yA)
+        if interArea == 0: return 0
+
+        # Compute the area of both rectangles
+        boxAArea = boxA['width'] * boxA['height']
+        boxBArea = boxB['width'] * boxB['height']
+
+        # Compute IoU
+        iou = interArea / float(boxAArea + boxBArea - interArea)
+        return iou
+
+    def apply_nms(self, boxes, iou_threshold=0.1, use_grid=None): # aggressive threshold
+        if len(boxes) == 0: return []
+
+        # Work on a compact [N,5] array; the vectorized kernel replaces the
+        # pop(0) / pairwise calculate_iou loop but keeps its exact semantics.
+        with span("nms"):
+            if isinstance(boxes, np.ndarray):
+                return array_to_boxes(boxes[nms_array(boxes, iou_threshold, use_grid)])
+            keep = nms_array(boxes_to_array(boxes), iou_threshold, use_grid)
+            return [boxes[i] for i in keep]
+
+    def _crop_candidates(self, image, ref_embedding, window_size, threshold, rows=None):
+        return self._threshold_windows(self.embed_windows(image, window_size, ys=rows),
+                                       ref_embedding, window_size, threshold)
+
+    def _threshold_windows(self, batches, ref_embedding, window_size, threshold):
+        """[N,5] array of the embedded windows scoring above threshold.
+
+        With a [K,D] matrix of references, returns one such array per reference.
+        """
+        refs = ref_embedding.view(-1, ref_embedding.shape[-1])
+        matches = [[] for _ in range(len(refs))]
+        for coords, embeddings in batches:
+            count("windows", len(coords))
+            with span("score"):
+                # Score the whole batch against every reference with one matrix multiply
+                scores = self.model.compute_similarities(refs, embeddings).cpu().numpy()
+                xy = np.array(coords, dtype=np.float64)
+
+                # Only keep VERY strong matches
+                for k in range(len(refs)):
+                    hit = np.flatnonzero(scores[:, k] > threshold)
+                    if hit.size:
+                        matches[k].append(_boxes(xy[hit, 0], xy[hit, 1], window_size, scores[hit, k]))
+        results = [np.concatenate(m) if m else np.zeros((0, 5)) for m in matches]
+        return results[0] if ref_embedding.dim() == 1 else results
+
+    def _indexed_windows(self, image, window_size, page_key, scale):
+        """(coords [N,2], embeddings [N,D] tensor) of the crop-engine windows, from the page index.
+
+        On a miss every window of the level is embedded once and stored.
+        """
+        entry = self.page_index.get(page_key, window_size, scale)
+        if entry is None:
+            coords, embeddings = [], []
+            for c, e in self.embed_windows(image, window_size):
+                coords.extend(c)
+                embeddings.append(e.float().cpu())
+            embeddings = torch.cat(embeddings).numpy() if embeddings else np.zeros((0, 0))
+            entry = self.page_index.put(page_key, window_size, scale, coords, embeddings)
+        return entry[:, :2], torch.from_numpy(entry[:, 2:]).to(self.model.device)
+
+    def _indexed_candidates(self, image, ref_embedding, window_size, threshold, page_key, scale):
+        coords, embeddings = self._indexed_windows(image, window_size, page_key, scale)
+        batches = [(coords, embeddings)] if len(coords) else []
+        return self._threshold_windows(batches, ref_embedding, window_size, threshold)
+
+    def index_page(self, blueprint_bytes, window_sizes, scales=None):
+        """Fills the page index for one page at every window size and scale; returns the entries built."""
+        page_key = self.page_index.page_key(blueprint_bytes)
+        scales = sorted(set(scales)) if scales else [1.0]
+        missing = [(s, ws) for s in scales for ws in window_sizes
+                   if not self.page_index.has(page_key, ws, s)]
+        if not missing:
+            return 0
+        with span("decode"):
+            blueprint_img = load_page(blueprint_bytes)
+        for scale, level in self.build_pyramid(blueprint_img, sorted({s for s, _ in missing})):
+            for s, window_size in missing:
+                if s == scale:
+                    self._indexed_windows(level, window_size, page_key, scale)
+        return len(missing)
+
+    def _page_key(self, engine, blueprint_bytes):
+        # Only the crop engine scores the fixed window grid the index stores
+        if self.page_index is None or engine != "crop":
+            return None
+        return self.page_index.page_key(blueprint_bytes)
+
+    def _cascade_candidates(self, image, ref_embedding, window_size, threshold, rows=None,
+                            template=None, stats=None, oriented=False):
+        """Crop-engine candidates of the windows _cascade_positions lets through."""
+        with span("windows"):
+            positions = self._cascade_positions(image, window_size, rows, template, stats, oriented)
+        return self._threshold_windows(self.embed_positions(image, window_size, positions),
+                                       ref_embedding, window_size, threshold)
+
+    def _cascade_positions(self, image, window_size, rows=None, template=None, stats=None, oriented=False):
+        """Crop-engine window positions [(y, xs)], with cheap stages pruning windows before the network.
+
+        The band is shrunk so the reference is ~CASCADE_TEMPLATE_SIZE px, then
+        for every window of the crop engine's grid, looking at all positions
+        within half a step of it:
+          1. ink: mean/std of the ink (from integral images) below
+             cascade_ink_ratio x the reference's -> blank paper, dropped
+          2. ncc: best normalised cross-correlation with the reference
+             template below cascade_min_ncc -> dropped
+          3. the survivors are embedded, plus one refined window at the ncc
+             peak (which is on a much finer grid than the 70% step)
+        Without a template only a blank-paper check (CASCADE_BLANK_STD) runs.
+        With several references ([K,D] embeddings, [K,th,tw] templates) a
+        window survives if it passes for any of them, and is refined at the
+        peak of the one correlating best; the survivors are embedded once and
+        scored against all. With oriented (the templates are one symbol in
+        several orientations) the best correlation must reach the stricter
+        cascade_oriented_ncc, and only the refined window is embedded, so the
+        network sees about as many windows as for one orientation. Per-stage
+        counts are added to the stats dict when one is given.
+        """
+        win_w, win_h = window_size
+        width, height = image.size
+        step_x, step_y = int(win_w * 0.7), int(win_h * 0.7)
+        all_rows = self.window_rows(image.size, window_size)
+        rows = all_rows if rows is None else list(rows)
+        xs = list(range(0, width - win_w, step_x))
+        # The 70% grid stops short of the right and bottom edges; add the edge
+        # positions so symbols there are within half a step of some window
+        if xs and width - win_w - xs[-1] > step_x // 2:
+            xs.append(width - win_w)
+        if rows and rows[-1] == all_rows[-1] and height - win_h - rows[-1] > step_y // 2:
+            rows.append(height - win_h)
+        counts = {"windows": len(rows) * len(xs), "ink_pruned": 0, "ncc_pruned": 0,
+                  "embedded": 0, "refined": 0}
+        if not counts["windows"]:
+            _add_stats(stats, counts)
+            return []
+
+        # Low-resolution ink map of the band (plus half a step above and below,
+        # aligned to f so every band sees the same pixels as a whole-page scan)
+        # and the window statistics at every position
+        f = _cascade_factor(window_size)
+        th, tw = template.shape[-2:] if template is not None else (-(-win_h // f), -(-win_w // f))
+        ry, rx = int(step_y / (2 * f)), int(step_x / (2 * f))
+        y0 = max(0, rows[0] - (ry + 1) * f) // f * f
+        y1 = min(height, rows[-1] + win_h + (ry + 1) * f)
+        ink = _ink(image.crop((0, y0, width, y1)), f)
+        mean, std = _window_stats(ink, th, tw)
+
+        # Each grid window looks at the positions within half a step of it.
+        # Maps are [C,H,W]; at_grid samples them at the grid -> [C,rows,xs]
+        def around(t, indices=False):
+            return F.max_pool2d(t[None], (2 * ry + 1, 2 * rx + 1), stride=1,
+                                padding=(ry, rx), return_indices=indices)
+        gy = torch.tensor([min(round((y - y0) / f), mean.shape[0] - 1) for y in rows])
+        gx = torch.tensor([min(round(x / f), mean.shape[1] - 1) for x in xs])
+        def at_grid(t):
+            return t[0][:, gy][:, :, gx]
+
+        if template is None:
+            keep = at_grid(around(std[None])) >= CASCADE_BLANK_STD
+            counts["ink_pruned"] = int((~keep.any(0)).sum())
+            peaks = None
+        else:
+            refs = torch.as_tensor(np.asarray(template), dtype=torch.float32).reshape(-1, th, tw)
+            ref_mean = refs.mean((1, 2)).view(-1, 1, 1)
+            ref_std = refs.std((1, 2), unbiased=False).view(-1, 1, 1)
+            inked = ((at_grid(around(mean[None])) >= self.cascade_ink_ratio * ref_mean) &
+                     (at_grid(around(std[None])) >= self.cascade_ink_ratio * ref_std))
+            counts["ink_pruned"] = int((~inked.any(0)).sum())
+
+            # Zero-mean correlation / (template norm x window norm), one conv for the band
+            refs = refs - ref_mean
+            corr = F.conv2d(ink[None, None], refs[:, None])[0]
+            norms = refs.flatten(1).norm(dim=1).view(-1, 1, 1)
+            ncc = corr / (norms * std * (th * tw) ** 0.5).clamp_(min=1e-6)
+            best, peaks = around(ncc, indices=True)
+            best, peaks = at_grid(best), at_grid(peaks)
+            # A blank reference has no pattern to correlate with
+            min_ncc = self.cascade_oriented_ncc if oriented else self.cascade_min_ncc
+            keep = inked & ((best >= min_ncc) | (ref_std == 0))
+            counts["ncc_pruned"] = int((inked.any(0) & ~keep.any(0)).sum())
+            # With several references, refine at the peak of the one that
+            # correlates best among those keeping the window
+            closest = torch.where(keep, best, torch.tensor(-np.inf)).argmax(0)
+
+        # Survivors, plus the refined window at each one's ncc peak (only the
+        # refined one for oriented scans)
+        positions = {}
+        for i, j in keep.any(0).nonzero().tolist():
+            if peaks is None or not oriented:
+                positions.setdefault(rows[i], set()).add(xs[j])
+            if peaks is not None:
+                py, px = divmod(int(peaks[closest[i, j], i, j]), ncc.shape[-1])
+                x = min(int(round(px * f)), width - win_w)
+                y = min(y0 + int(round(py * f)), height - win_h)
+                if x != xs[j] or y != rows[i]:
+                    counts["refined"] += 1
+                    positions.setdefault(y, set()).add(x)
+        positions = [(y, sorted(positions[y])) for y in sorted(positions)]
+        counts["embedded"] = sum(len(row) for _, row in positions)
+        _add_stats(stats, counts)
+        return positions
+
+    def _candidates(self, engine, template=None, stats=None, oriented=False):
+        """The per-band candidate function of an engine: f(image, ref, window_size, threshold, rows)."""
+        if engine == "dense":
+            return self._dense_candidates
+        if engine == "cascade":
+            return lambda *args, **kwargs: self._cascade_candidates(*args, template=template, stats=stats,
+                                                                    oriented=oriented, **kwargs)
+        return self._crop_candidates
+
+    def _dense_candidates(self, image, ref_embedding, window_size, threshold, rows=None):
+        num_refs = 1 if ref_embedding.dim() == 1 else len(ref_embedding)
+        matches = [[] for _ in range(num_refs)]
+
+        for xs, ys, scores in self.dense_scores(image, ref_embedding, window_size, rows):
+            with span("score"):
+                scores = scores.numpy().reshape(num_refs, len(ys), len(xs))
+                for k in range(num_refs):
+                    i, j = np.nonzero(scores[k] > threshold)
+                    if i.size:
+                        matches[k].append(_boxes(np.asarray(xs)[j], np.asarray(ys)[i], window_size,
+                                                 scores[k, i, j]))
+        results = [np.concatenate(m) if m else np.zeros((0, 5)) for m in matches]
+        return results[0] if ref_embedding.dim() == 1 else results
+
+    def _bands(self, engine, image_size, window_size):
+        """Splits one image into row bands: list of (rows, y) with y the band's first window top."""
+        if engine == "dense":
+            grid = self._dense_grid(image_size, window_size)
+            return [([i0], int(round(i0 * grid[1]))) for i0 in self.dense_rows(image_size, window_size)]
+        ys = self.window_rows(image_size, window_size)
+        step = self.stream_band_rows
+        return [(ys[k:k + step], ys[k]) for k in range(0, len(ys), step)]
+
+    def _band_extent(self, engine, image_size, window_size, rows):
+        """Page rows [top, bottom) a band of window rows reads, overlapping its neighbours by a window."""
+        win_w, win_h = window_size
+        if engine == "dense":
+            cell_w, cell_h, _, ny = self._dense_grid(image_size, window_size)
+            first, last = rows[0] * cell_h, (min(ny, rows[-1] + self.dense_tile_cells) + WINDOW_CELLS) * cell_h
+        else:
+            # The cascade looks up to half a step (plus its reduce factor) past the
+            # band, and its last band also the bottom-edge row
+            first, last = rows[0], rows[-1] + win_h
+        return max(0, int(first) - win_h), min(image_size[1], int(np.ceil(last)) + win_h)
+
+    def scan(self, ref_bytes, blueprint_bytes, threshold=0.85, engine="crop", scales=None,
+             stats=None, any_orientation=False): # <--- HIGH THRESHOLD
+        # Pre-calculate Reference Embedding (one decode gives size, embedding and template)
+        with span("decode"):
+            ref_image = self.model._load_image(ref_bytes)
+        if any_orientation:
+            with span("reference"):
+                references = self.oriented_references(ref_image)
+            return self.scan_oriented(references, blueprint_bytes, threshold=threshold, engine=engine,
+                                      scales=scales, stats=stats)
+        with span("reference"):
+            ref_embedding, window_size = self.model.embed_image(ref_image)
+        return self.scan_with_reference(ref_embedding, window_size, blueprint_bytes,
+                                        threshold=threshold, engine=engine, scales=scales,
+                                        template=reference_template(ref_image), stats=stats)
+
+    def oriented_references(self, image):
+        """(embedding, (w, h), template) of a reference image in every ORIENTATIONS entry.
+
+        The eight variants go through the network together, as one batch.
+        """
+        variants = [orient(image, rotation, mirrored) for rotation, mirrored in ORIENTATIONS]
+        embeddings = self.model.embed_images(variants, self.embedder, batch_size=len(variants))
+        return [(embedding, variant.size, reference_template(variant))
+                for embedding, variant in zip(embeddings, variants)]
+
+    def scan_with_reference(self, ref_embedding, window_size, blueprint_bytes, threshold=0.85,
+                            engine="crop", scales=None, template=None, stats=None):
+        """Scans a page for an already-embedded reference of size window_size (w, h).
+
+        template (reference_template of the reference) feeds the cascade
+        engine's cheap stages; stats, if a dict, collects its per-stage counts.
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown scan engine '{engine}', expected one of {self.ENGINES}")
+
+        page_key = self._page_key(engine, blueprint_bytes)
+        if self.tiled and page_key is None:
+            # Band by band; the incremental NMS leaves the same boxes as one pass
+            matches = []
+            for _, _, found in self.iter_scan(ref_embedding, window_size, blueprint_bytes,
+                                              threshold=threshold, engine=engine, scales=scales,
+                                              template=template, stats=stats):
+                matches.extend(found)
+            print(f"Final matches: {len(matches)}")
+            return matches
+        with span("decode"):
+            blueprint_img = load_page(blueprint_bytes)
+        win_w, win_h = window_size
+
+        scales = sorted(set(scales)) if scales else [1.0]
+        candidates = self._candidates(engine, template, stats)
+
+        print(f"Scanning blueprint ({blueprint_img.size}) with window ({win_w}x{win_h}), "
+              f"engine={engine}, scales={scales}...")
+        
+        # The reference embedding is computed once and shared by every level
+        matches = []
+        for scale, level in self.build_pyramid(blueprint_img, scales):
+            if page_key:
+                level_matches = self._indexed_candidates(level, ref_embedding, (win_w, win_h),
+                                                         threshold, page_key, scale)
+            else:
+                level_matches = candidates(level, ref_embedding, (win_w, win_h), threshold)
+            if scale != 1.0:
+                # Map the level boxes back to page coordinates
+                level_matches[:, :4] = np.round(level_matches[:, :4] * scale)
+            matches.append(level_matches)
+        matches = np.concatenate(matches)
+        
+        print(f"Raw candidates: {len(matches)}")
+        count("candidates", len(matches))
+        
+        # Apply NMS with a very aggressive overlap check (0.1)
+        # This means if two boxes touch even slightly, we only keep the best one.
+        # All pyramid levels share this one pass, so a symbol found at two
+        # neighbouring scales is reported once.
+        clean_matches = self.apply_nms(matches, iou_threshold=0.1)
+        
+        print(f"Final matches: {len(clean_matches)}")
+        count("matches", len(clean_matches))
+        if engine == "cascade" and stats is not None:
+            print(f"Cascade: {stats}")
+        return clean_matches
+
+    def scan_multi(self, references, blueprint_bytes, threshold=0.85, engine="crop", scales=None,
+                   stats=None):
+        """Scans a page for several references at once; returns one match list per reference.
+
+        references is a list of (embedding, (w, h), template) tuples. The page
+        is decoded and its pyramid built once. References with the same window
+        size share the window embeddings, which are scored against all of them
+        with one matrix multiply; NMS then runs per reference, so overlapping
+        symbols of different types are all kept. Per reference the result is
+        what scan_with_reference returns (up to float rounding), except for the
+        cascade engine, where a window kept for any reference of a group is
+        scored against all of them.
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown scan engine '{engine}', expected one of {self.ENGINES}")
+
+        matches = self._multi_candidates(references, blueprint_bytes, threshold, engine, scales, stats,
+                                         f"{len(references)} references")
+        results = [self.apply_nms(m, iou_threshold=0.1) for m in matches]
+        print(f"Final matches per reference: {[len(r) for r in results]}")
+        count("matches", sum(len(r) for r in results))
+        if engine == "cascade" and stats is not None:
+            print(f"Cascade: {stats}")
+        return results
+
+    def _multi_candidates(self, references, blueprint_bytes, threshold, engine, scales, stats, what,
+                          oriented=False):
+        """Per reference, its [N,5] candidates on every pyramid level in page coordinates, before NMS.
+
+        The page is decoded and its pyramid built once; each window size group
+        is embedded once and scored against all its references (see scan_multi).
+        """
+        page_key = self._page_key(engine, blueprint_bytes)
+        with span("decode"):
+            blueprint_img = load_page(blueprint_bytes)
+        scales = sorted(set(scales)) if scales else [1.0]
+        groups = group_references(references)
+
+        print(f"Scanning blueprint ({blueprint_img.size}) for {what} "
+              f"({len(groups)} window sizes), engine={engine}, scales={scales}...")
+
+        matches = [[] for _ in references]
+        for scale, level in self.build_pyramid(blueprint_img, scales):
+            for window_size, indices, embeddings, templates in groups:
+                if page_key:
+                    found = self._indexed_candidates(level, embeddings, window_size, threshold,
+                                                     page_key, scale)
+                else:
+                    found = self._candidates(engine, templates, stats, oriented)(level, embeddings,
+                                                                                 window_size, threshold)
+                for k, level_matches in zip(indices, found):
+                    if scale != 1.0:
+                        level_matches[:, :4] = np.round(level_matches[:, :4] * scale)
+                    matches[k].append(level_matches)
+
+        matches = [np.concatenate(m) if m else np.zeros((0, 5)) for m in matches]
+        count("candidates", sum(len(m) for m in matches))
+        return matches
+
+    def scan_oriented(self, references, blueprint_bytes, threshold=0.85, engine="crop", scales=None,
+                      stats=None, max_results=0, exists=False):
+        """Scans a page for a symbol in any of the 8 ORIENTATIONS; box dicts also get rotation and mirrored.
+
+        references holds the symbol in every orientation, ORIENTATIONS order
+        (see oriented_references). Variants of the same window size are
+        scored together, as in scan_multi: each window is embedded once and
+        compared with all of them in one matrix product, so a square symbol
+        costs one pass over the page and any other two (upright and on its
+        side), not eight. One NMS pass over every variant's candidates reports
+        each symbol once, in its best scoring orientation. max_results and
+        exists work as in scan_ranked.
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown scan engine '{engine}', expected one of {self.ENGINES}")
+        if len(references) != len(ORIENTATIONS):
+            raise ValueError(f"Expected the reference in {len(ORIENTATIONS)} orientations, got {len(references)}")
+
+        page_key = self._page_key(engine, blueprint_bytes)
+        if (max_results > 0 or exists) and not page_key:
+            return self._scan_oriented_ranked(references, blueprint_bytes, threshold, engine, scales, stats,
+                                              1 if exists else max_results, exists)
+
+        matches = self._multi_candidates(references, blueprint_bytes, threshold, engine, scales, stats,
+                                         f"{len(references)} orientations", oriented=True)
+        results = oriented_nms(matches, iou_threshold=0.1)
+        if max_results > 0 or exists:
+            # Indexed pages: one matrix product for the whole page, then cut
+            results = results[:1 if exists else max_results]
+        print(f"Final matches: {len(results)}")
+        count("matches", len(results))
+        if engine == "cascade" and stats is not None:
+            print(f"Cascade: {stats}")
+        return results
+
+    def _scan_oriented_ranked(self, references, blueprint_bytes, threshold, engine, scales, stats, k, exists):
+        # One window size group after the other (upright first), sharing one TopMatches
+        with span("decode"):
+            blueprint_img = load_page(blueprint_bytes)
+        scales = sorted(set(scales)) if scales else [1.0]
+        levels = list(self.build_pyramid(blueprint_img, scales))
+        print(f"Ranked scan of blueprint ({blueprint_img.size}) in {len(references)} orientations, "
+              f"engine={engine}, scales={scales}, {'exists' if exists else f'max_results={k}'}...")
+
+        top = TopMatches(k, iou_threshold=0.1)
+        visited = found = 0
+        for window_size, indices, embeddings, templates in group_references(references):
+            batches = self._ranked_scores(levels, embeddings, window_size, engine, templates, stats,
+                                          oriented=True)
+            seen, hits = self._collect_ranked(top, batches, window_size, threshold, exists, labels=indices)
+            visited, found = visited + seen, found + hits
+            if exists and len(top):
+                break
+        count("candidates", found)
+        matches = oriented_boxes(top.array())
+        count("matches", len(matches))
+        print(f"Final matches: {len(matches)} after {visited} windows"
+              f"{' (stopped at the first match)' if exists and matches else ''}")
+        return matches
+
+    def _window_priority(self, image, window_size, xy, template=None):
+        """Ink-density prior of the windows with top-left corners xy [N,2]: higher first.
+
+        Windows whose mean ink is closest to the reference's come first (with
+        no template, the ones with the most varied ink); blank paper comes last.
+        Computed on the cascade's low-resolution ink map, so it costs about
+        one pass over the page.
+        """
+        f = _cascade_factor(window_size)
+        if template is not None:
+            refs = np.asarray(template, dtype=np.float32)
+            th, tw = refs.shape[-2:]
+        else:
+            th, tw = -(-window_size[1] // f), -(-window_size[0] // f)
+        with span("windows"):
+            mean, std = _window_stats(_ink(image, f), th, tw)
+        if not len(xy) or not mean.numel():
+            return np.zeros(len(xy))
+        gy = np.minimum(xy[:, 1] // f, mean.shape[0] - 1)
+        gx = np.minimum(xy[:, 0] // f, mean.shape[1] - 1)
+        m, s = mean.numpy()[gy, gx], std.numpy()[gy, gx]
+        if template is None:
+            prior = s
+        else:
+            ref_means = refs.reshape(-1, th * tw).mean(1)
+            prior = -np.abs(m[:, None] - ref_means[None]).min(1)
+        # Ink is in [0, 1], so this puts blank windows behind every inked one
+        return np.where(s < CASCADE_BLANK_STD, prior - 2, prior)
+
+    def _ranked_scores(self, levels, ref_embedding, window_size, engine, template=None, stats=None,
+                       oriented=False):
+        """Yields (scales, coords, scores) per batch for the windows of every pyramid level.
+
+        The crop and cascade engines visit their window rows best prior first
+        (_window_priority of the row's best window) across all levels; each
+        row is cut out and converted once, as in embed_positions. The dense
+        engine keeps its tile order. coords are level coordinates, scales the
+        level of each window. scores are [N], or [N,K] for a [K,D]
+        ref_embedding (with [K,th,tw] templates).
+        """
+        if engine == "dense":
+            for scale, level in levels:
+                for xs, ys, scores in self.dense_scores(level, ref_embedding, window_size):
+                    gx, gy = np.meshgrid(xs, ys)
+                    coords = np.column_stack([gx.ravel(), gy.ravel()])
+                    scores = scores.numpy()
+                    yield (np.full(len(coords), scale), coords,
+                           scores.ravel() if ref_embedding.dim() == 1 else scores.reshape(len(scores), -1).T)
+            return
+
+        rows = []  # (priority, level index, y, xs)
+        for index, (scale, level) in enumerate(levels):
+            if engine == "cascade":
+                with span("windows"):
+                    positions = self._cascade_positions(level, window_size, template=template, stats=stats,
+                                                        oriented=oriented)
+            else:
+                xs = list(range(0, level.size[0] - window_size[0], int(window_size[0] * 0.7)))
+                positions = [(y, xs) for y in self.window_rows(level.size, window_size)] if xs else []
+            xy = np.array([(x, y) for y, row in positions for x in row], dtype=np.int64).reshape(-1, 2)
+            priorities = self._window_priority(level, window_size, xy, template)
+            ends = np.cumsum([len(row) for _, row in positions], dtype=np.int64)
+            for (y, row), end in zip(positions, ends):
+                rows.append((priorities[end - len(row):end].max(), index, y, list(row)))
+        rows.sort(key=lambda r: -r[0])
+
+        # Windows from different levels have the same size in level pixels,
+        # so they share one forward pass
+        batches = self._embed_rows(window_size, ((levels[index][1], y, xs, levels[index][0])
+                                                 for _, index, y, xs in rows))
+        for coords, level_scales, embeddings in batches:
+            with span("score"):
+                scores = self.model.compute_similarities(ref_embedding, embeddings).cpu().numpy()
+            count("windows", len(coords))
+            yield np.array(level_scales), np.array(coords, dtype=np.int64).reshape(-1, 2), scores
+
+    def _collect_ranked(self, top, batches, window_size, threshold, exists, labels=None):
+        """Feeds _ranked_scores batches into top; returns (windows visited, windows above threshold).
+
+        With labels (one per reference of a [K,D] group) a window gets its best
+        reference's score, and its box that reference's label as a sixth
+        column. With exists it stops at the first hit.
+        """
+        visited = found = 0
+        for level_scales, coords, scores in batches:
+            visited += len(scores)
+            if labels is not None:
+                best = scores.argmax(1)
+                scores = scores[np.arange(len(scores)), best]
+            hit = np.flatnonzero(scores > max(threshold, top.floor))
+            if hit.size:
+                found += hit.size
+                boxes = _boxes(coords[hit, 0], coords[hit, 1], window_size, scores[hit])
+                # Map the level boxes back to page coordinates
+                boxes[:, :4] = np.round(boxes[:, :4] * level_scales[hit, None])
+                if labels is not None:
+                    boxes = np.column_stack([boxes, np.asarray(labels, dtype=np.float64)[best[hit]]])
+                with span("nms"):
+                    top.add(boxes)
+                if exists:
+                    break
+        return visited, found
+
+    def scan_ranked(self, ref_embedding, window_size, blueprint_bytes, threshold=0.85, engine="crop",
+                    scales=None, template=None, stats=None, max_results=0, exists=False):
+        """scan_with_reference for callers that want only the best few boxes, or a yes/no.
+
+        Windows are visited best prior first (see _ranked_scores) and every
+        batch's hits go into a TopMatches of max_results boxes, so candidates
+        take O(max_results) memory and the threshold rises to the weakest kept
+        score once it is full. With exists the scan stops at the first window
+        above threshold and returns that box alone.
+
+        Indexed pages are scanned whole (one matrix product) and cut; tiled
+        scanners keep their band order, stopping early at band granularity.
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown scan engine '{engine}', expected one of {self.ENGINES}")
+        if max_results <= 0 and not exists:
+            return self.scan_with_reference(ref_embedding, window_size, blueprint_bytes, threshold=threshold,
+                                            engine=engine, scales=scales, template=template, stats=stats)
+        top = TopMatches(1 if exists else max_results, iou_threshold=0.1)
+
+        page_key = self._page_key(engine, blueprint_bytes)
+        if page_key or self.tiled:
+            if page_key:
+                bands = [(None, None, self.scan_with_reference(ref_embedding, window_size, blueprint_bytes,
+                                                               threshold=threshold, engine=engine,
+                                                               scales=scales, stats=stats))]
+            else:
+                bands = self.iter_scan(ref_embedding, window_size, blueprint_bytes, threshold=threshold,
+                                       engine=engine, scales=scales, template=template, stats=stats)
+            for _, _, found in bands:
+                top.add(boxes_to_array(found))
+                if exists and len(top):
+                    break
+            return array_to_boxes(top.array())
+
+        with span("decode"):
+            blueprint_img = load_page(blueprint_bytes)
+        scales = sorted(set(scales)) if scales else [1.0]
+        levels = list(self.build_pyramid(blueprint_img, scales))
+        print(f"Ranked scan of blueprint ({blueprint_img.size}) with window ({window_size[0]}x{window_size[1]}), "
+              f"engine={engine}, scales={scales}, "
+              f"{'exists' if exists else f'max_results={max_results}'}...")
+
+        batches = self._ranked_scores(levels, ref_embedding, window_size, engine, template, stats)
+        visited, found = self._collect_ranked(top, batches, window_size, threshold, exists)
+        count("candidates", found)
+        matches = array_to_boxes(top.array())
+        count("matches", len(matches))
+        print(f"Final matches: {len(matches)} after {visited} windows"
+              f"{' (stopped at the first match)' if exists and matches else ''}")
+        return matches
+
+    def iter_scan(self, ref_embedding, window_size, blueprint_bytes, threshold=0.85,
+                  engine="crop", scales=None, template=None, stats=None):
+        """Streaming scan_with_reference: yields (bands_done, bands_total, new_matches).
+
+        The page (every pyramid level) is processed in row bands, in page order.
+        NMS is resolved at each band boundary, so new_matches only holds boxes
+        that later bands can no longer change. All yields together give the same
+        boxes as scan_with_reference (with several scales, windows from different
+        levels with exactly equal scores may break ties the other way).
+
+        In tiled mode the page is not decoded whole: every band reads only its
+        rows, plus a window of overlap on each side (PageReader), so memory is
+        bounded by the band size (stream_band_rows window rows, or one dense
+        tile row).
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown scan engine '{engine}', expected one of {self.ENGINES}")
+
+        scales = sorted(set(scales)) if scales else [1.0]
+        candidates = self._candidates(engine, template, stats)
+        if self.tiled:
+            with span("decode"):
+                page = PageReader(blueprint_bytes)
+            levels = [(scale, page.level_size(scale), None) for scale in scales]
+            page_size = page.size
+        else:
+            with span("decode"):
+                blueprint_img = load_page(blueprint_bytes)
+            levels = [(scale, level.size, level) for scale, level in self.build_pyramid(blueprint_img, scales)]
+            page_size = blueprint_img.size
+
+        # Interleave the bands of every level by their top edge on the page
+        tasks = []
+        for scale, size, level in levels:
+            for rows, y in self._bands(engine, size, window_size):
+                tasks.append((int(round(y * scale)), scale, size, level, rows))
+        tasks.sort(key=lambda t: t[0])
+
+        print(f"{'Tiled' if self.tiled else 'Streaming'} scan of blueprint ({page_size}) in "
+              f"{len(tasks)} bands, engine={engine}, scales={scales}...")
+
+        reach = int(np.ceil(_cascade_reach(window_size) * scales[-1])) if engine == "cascade" else 0
+        nms = IncrementalNMS(iou_threshold=0.1)
+        for k, (_, scale, size, level, rows) in enumerate(tasks):
+            if level is None:
+                top, bottom = self._band_extent(engine, size, window_size, rows)
+                with span("decode"):
+                    level = PageBand(page.read_level(top, bottom, scale), top, size)
+            band = candidates(level, ref_embedding, window_size, threshold, rows=rows)
+            if scale != 1.0:
+                band[:, :4] = np.round(band[:, :4] * scale)
+            count("candidates", len(band))
+
+            # Cascade bands also refine windows up to half a step above their first row
+            frontier = tasks[k + 1][0] - reach if k + 1 < len(tasks) else None
+            with span("nms"):
+                nms.add(band)
+                final = array_to_boxes(nms.flush(frontier))
+            count("matches", len(final))
+            yield k + 1, len(tasks), final
+
+        if not tasks:
+            yield 0, 0, []
@@ -1,112 +1,1017 @@
-import sys
-import os
-import grpc
-from concurrent import futures
-import time
-
-# -----------------------------------------------------------------------------
-# 1. PATH SETUP (Crucial for finding the generated files)
-# -----------------------------------------------------------------------------
-# Get the directory where this script is located
-current_dir = os.path.dirname(os.path.abspath(__file__))
-# Define the path to the 'generated' folder (one level up)
-generated_dir = os.path.join(current_dir, '../generated')
-# Add it to the system path
-sys.path.append(generated_dir)
-
-# -----------------------------------------------------------------------------
-# 2. IMPORTS
-# -----------------------------------------------------------------------------
-# Now we can import the generated protobuf code
-import symbol_detector_pb2
-import symbol_detector_pb2_grpc
-
-# Import our custom logic
-# We use try/except to handle running as a module vs running as a script
-try:
-    from server.model import SiameseNetwork
-    from server.scanner import BlueprintScanner
-except ImportError:
-    from model import SiameseNetwork
-    from scanner import BlueprintScanner
-
-# -----------------------------------------------------------------------------
-# 3. SERVER LOGIC
-# -----------------------------------------------------------------------------
-class SymbolDetectorServicer(symbol_detector_pb2_grpc.SymbolDetectorServicer):
-    def __init__(self):
-        print("Initializing Model and Scanner...")
-        self.model = SiameseNetwork()
-        self.scanner = BlueprintScanner(self.model)
-        print("Server Ready.")
-
-    def Predict(self, request, context):
-        """Standard One-Shot Comparison"""
-        try:
-            print(f"Received Predict Request (Ref: {len(request.reference_image)} bytes)")
-            
-            # Pass raw bytes to the model
-            result = self.model.predict(request.reference_image, request.query_image)
-            
-            msg = f"Score: {result['score']:.4f}"
-            
-            return symbol_detector_pb2.PredictResponse(
-                similarity_score=result["score"],
-                is_match=result["is_match"],
-                message=msg
-            )
-        except Exception as e:
-            print(f"Predict Error: {e}")
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return symbol_detector_pb2.PredictResponse()
-
-    def ScanBlueprint(self, request, context):
-        """New: Sliding Window Scan"""
-        try:
-            print(f"Received Scan Request (Blueprint: {len(request.blueprint_image)} bytes)")
-            
-            # Run the scanner
-            # Note: We use a slightly lower threshold (0.60) for scanning to catch more candidates
-            results = self.scanner.scan(request.reference_image, request.blueprint_image, threshold=0.85)
-            
-            # Convert python dictionaries to Proto BoundingBox objects
-            proto_matches = []
-            for r in results:
-                proto_matches.append(symbol_detector_pb2.BoundingBox(
-                    x=r['x'], 
-                    y=r['y'], 
-                    width=r['width'], 
-                    height=r['height'], 
-                    score=r['score']
-                ))
-            
-            return symbol_detector_pb2.ScanResponse(
-                matches=proto_matches,
-                message=f"Scan complete. Found {len(proto_matches)} matches."
-            )
-        except Exception as e:
-            print(f"Scan Error: {e}")
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return symbol_detector_pb2.ScanResponse()
-
-# -----------------------------------------------------------------------------
-# 4. STARTUP
-# -----------------------------------------------------------------------------
-def serve():
-    # Allow up to 10 simultaneous requests
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    
-    symbol_detector_pb2_grpc.add_SymbolDetectorServicer_to_server(
-        SymbolDetectorServicer(), server
-    )
-    
-    # Listen on port 50051
-    server.add_insecure_port('[::]:50051')
-    print("One Shot Detector Server started on port 50051...")
-    server.start()
-    server.wait_for_termination()
-
-if __name__ == '__main__':
-    serve()
\ No newline at end of file
+import sys
+import os
+import argparse
+import asyncio
+import functools
+import grpc
+import inspect
+import tempfile
+import threading
+from concurrent import futures
+import time
+from PIL import Image, UnidentifiedImageError
+
+# -----------------------------------------------------------------------------
+# 1. PATH SETUP (Crucial for finding the generated files)
+# -----------------------------------------------------------------------------
+# Get the directory where this script is located
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Define the path to the 'generated' folder (one level up)
+generated_dir = os.path.join(current_dir, '../generated')
+# Add it to the system path
+sys.path.append(generated_dir)
+
+# -----------------------------------------------------------------------------
+# 2. IMPORTS
+# -----------------------------------------------------------------------------
+# Now we can import the generated protobuf code
+import symbol_detector_pb2
+import symbol_detector_pb2_grpc
+
+# Import our custom logic
+# We use try/except to handle running as a module vs running as a script
+try:
+    from server.embedding_cache import EmbeddingCache
+    from server.reference_registry import ReferenceRegistry
+    from server.page_index import PageIndex, parse_window
+    from server.metrics import Metrics, begin_trace, current, span, stage_seconds
+    from server.cancellation import bind, for_rpc
+    from server.documents import Document, prefetch
+except ImportError:
+    from embedding_cache import EmbeddingCache
+    from reference_registry import ReferenceRegistry
+    from page_index import PageIndex, parse_window
+    from metrics import Metrics, begin_trace, current, span, stage_seconds
+    from cancellation import bind, for_rpc
+    from documents import Document, prefetch
+
+# The torch-backed modules take seconds to import, so they are imported by
+# _import_runtime() on the model loader thread, after the port is open
+SiameseNetwork = load_image = BlueprintScanner = reference_template = None
+BatchingScheduler = ScanWorkerPool = SymbolLibrary = None
+
+
+def _import_runtime():
+    global SiameseNetwork, load_image, BlueprintScanner, reference_template
+    global BatchingScheduler, ScanWorkerPool, SymbolLibrary
+    try:
+        from server.model import SiameseNetwork, load_image
+        from server.scanner import BlueprintScanner, reference_template
+        from server.inference_scheduler import BatchingScheduler
+        from server.worker_pool import ScanWorkerPool
+        from server.library import SymbolLibrary
+    except ImportError:
+        from model import SiameseNetwork, load_image
+        from scanner import BlueprintScanner, reference_template
+        from inference_scheduler import BatchingScheduler
+        from worker_pool import ScanWorkerPool
+        from library import SymbolLibrary
+
+
+def _report_cancelled(context, token):
+    # The scan loops raise ScanCancelled, which handlers report as INTERNAL
+    if token.reason is not None:
+        expired = token.reason == "deadline exceeded"
+        context.set_code(grpc.StatusCode.DEADLINE_EXCEEDED if expired else grpc.StatusCode.CANCELLED)
+        context.set_details(f"Scan stopped: {token.reason}")
+
+
+def _instrumented(handler):
+    """Runs an RPC handler inside a metrics request: latency per RPC, plus a
+    trace of its scan stages when metrics are on or the request asks for timings.
+
+    The RPC's cancel token is bound for the duration, so scans stop between
+    batches once the client cancels or the deadline passes."""
+    name = handler.__name__
+
+    if inspect.isgeneratorfunction(handler):
+        @functools.wraps(handler)
+        def streaming(self, request, context):
+            token = for_rpc(context)
+            with self.metrics.request(name, context, trace=getattr(request, "include_timings", False)):
+                with bind(token):
+                    yield from handler(self, request, context)
+                _report_cancelled(context, token)
+        return streaming
+
+    @functools.wraps(handler)
+    def unary(self, request, context):
+        token = for_rpc(context)
+        with self.metrics.request(name, context, trace=getattr(request, "include_timings", False)):
+            with bind(token):
+                response = handler(self, request, context)
+            _report_cancelled(context, token)
+            return response
+    return unary
+
+# -----------------------------------------------------------------------------
+# 3. SERVER LOGIC
+# -----------------------------------------------------------------------------
+class SymbolDetectorServicer(symbol_detector_pb2_grpc.SymbolDetectorServicer):
+    def __init__(self, batch_size=32, cache_entries=256, cache_mb=64, reference_ttl=3600,
+                 reference_image_mb=64, upload_spool_mb=32, max_batch=32, max_wait_ms=5, workers=0, worker_threads=1,
+                 backend="eager", calibration_images=None, accuracy_tolerance=0.02,
+                 weights_path=None, cascade_ink_ratio=0.25, cascade_min_ncc=0.3, cascade_oriented_ncc=0.4,
+                 page_index_dir=None, page_index_mb=2048, library_dir=None, library_windows=None,
+                 tiled=False, band_rows=4, metrics=False, load_in_background=False):
+        self.runtime_options = dict(batch_size=batch_size, max_batch=max_batch,
+                                    max_wait_ms=max_wait_ms, workers=workers,
+                                    worker_threads=worker_threads)
+        self.model_options = dict(backend=backend, calibration_images=calibration_images,
+                                  accuracy_tolerance=accuracy_tolerance, weights_path=weights_path)
+        self.scanner_options = dict(cascade_ink_ratio=cascade_ink_ratio,
+                                    cascade_min_ncc=cascade_min_ncc,
+                                    cascade_oriented_ncc=cascade_oriented_ncc,
+                                    tiled=tiled, stream_band_rows=band_rows)
+        # Readiness, reported by the Health RPC. Until ready is set the
+        # model-backed attributes below don't exist and RPCs return UNAVAILABLE
+        self.ready = threading.Event()
+        self.status = symbol_detector_pb2.STATUS_STARTING
+        self.status_message = "Loading model..."
+        self.load_seconds = 0.0
+        self.started_at = time.perf_counter()
+        self.model = self.scheduler = self.scanner = self.worker_pool = self.page_scanner = None
+        # Users pick the same symbol over and over: reuse its embedding
+        self.embedding_cache = EmbeddingCache(max_entries=cache_entries,
+                                              max_bytes=cache_mb * 1024 * 1024)
+        # Per-RPC latency and per-stage scan time (GetStats, --metrics-port)
+        self.metrics = Metrics(enabled=metrics)
+        self.metrics.add_collector("embedding_cache", self.embedding_cache.stats)
+        # Registered references (RegisterReference -> reference_id)
+        # (their images, kept for any_orientation scans, up to reference_image_mb)
+        self.references = ReferenceRegistry(default_ttl=reference_ttl,
+                                            max_image_bytes=reference_image_mb * 1024 * 1024)
+        # Chunked uploads stay in memory up to this size, then spill to a temp file
+        self.upload_spool_bytes = upload_spool_mb * 1024 * 1024
+        # Persisted window embeddings of scanned pages (opened once the model
+        # fingerprint is known)
+        self.page_index_options = dict(root=page_index_dir, max_bytes=page_index_mb * 1024 * 1024)
+        self.page_index = None
+        # Symbol library searched by SearchLibrary (see library.py)
+        self.library_options = dict(directory=library_dir,
+                                    window_sizes=library_windows or [(48, 48)])
+        self.library = None
+
+        if load_in_background:
+            threading.Thread(target=self._load_model, name="model-loader", daemon=True).start()
+        else:
+            self._load_model()
+            if not self.ready.is_set():
+                raise RuntimeError(self.status_message)
+
+    def _load_model(self):
+        """Imports torch, builds the model, scheduler and scanners, then warms them up."""
+        options = self.runtime_options
+        try:
+            _import_runtime()
+            print(f"Initializing Model ({self.model_options['backend']} backend) and Scanner...")
+            model = SiameseNetwork(**self.model_options)
+            page_index = None
+            if self.page_index_options["root"]:
+                page_index = PageIndex(namespace=model.fingerprint, **self.page_index_options)
+                print(f"Page index: {page_index.stats()}")
+            # All embedding work from all RPC threads goes through one scheduler,
+            # which coalesces it into shared forward passes
+            scheduler = BatchingScheduler(model, max_batch=options["max_batch"],
+                                          max_wait_ms=options["max_wait_ms"])
+            scanner = BlueprintScanner(model, batch_size=options["batch_size"], embedder=scheduler,
+                                       page_index=page_index, **self.scanner_options)
+            # Optional process pool: one scan's bands are spread over all cores
+            worker_pool = None
+            if options["workers"] > 0:
+                worker_pool = ScanWorkerPool(num_workers=options["workers"],
+                                             torch_threads=options["worker_threads"],
+                                             batch_size=options["batch_size"],
+                                             model_options=self.model_options,
+                                             scanner_options=self.scanner_options)
+
+            library = None
+            if self.library_options["directory"]:
+                library = SymbolLibrary(namespace=model.fingerprint, **self.library_options)
+
+            self.status_message = "Warming up..."
+            print(f"Warm-up: {model.warm_up(max(options['batch_size'], options['max_batch'])):.2f}s")
+            if worker_pool:
+                print(f"Started {worker_pool.warm_up()} scan workers")
+
+            self.model, self.scheduler, self.scanner = model, scheduler, scanner
+            self.metrics.add_collector("batching", scheduler.stats)
+            if page_index is not None:
+                self.metrics.add_collector("page_index", page_index.stats)
+            if library is not None:
+                self.metrics.add_collector("library", library.stats)
+            self.worker_pool = worker_pool
+            self.page_scanner = worker_pool or scanner
+            self.page_index = page_index
+            self.library = library
+            self.load_seconds = time.perf_counter() - self.started_at
+            self.status = symbol_detector_pb2.STATUS_SERVING
+            self.status_message = f"Ready (loaded in {self.load_seconds:.1f}s)"
+            self.ready.set()
+            print("Server Ready.")
+        except Exception as e:
+            self.status = symbol_detector_pb2.STATUS_FAILED
+            self.status_message = f"Model failed to load: {e}"
+            print(self.status_message)
+
+    def _check_ready(self, context):
+        """False (with UNAVAILABLE set on the context) until the model has loaded."""
+        if self.ready.is_set():
+            return True
+        context.set_code(grpc.StatusCode.UNAVAILABLE)
+        context.set_details(self.status_message)
+        return False
+
+    def _reference_embedding(self, image_bytes):
+        """(embedding, (w, h), template) for a reference image, served from the LRU cache when possible."""
+        return self.embedding_cache.get_or_compute(image_bytes, self._embed_reference)
+
+    def _embed_reference(self, image_bytes):
+        # One decode for the embedding and the cascade template
+        with span("decode"):
+            image = load_image(image_bytes)
+        embedding, size = self.model.embed_image(image, embedder=self.scheduler)
+        return embedding, size, reference_template(image)
+
+    def _oriented_reference(self, image_bytes):
+        """The reference in every scanner.ORIENTATIONS entry: a list of (embedding, (w, h), template).
+
+        Cached next to its upright embedding, under its own key.
+        """
+        key = f"{EmbeddingCache.key(image_bytes)}:oriented"
+        references = self.embedding_cache.get(key)
+        if references is None:
+            with span("decode"):
+                image = load_image(image_bytes)
+            references = tuple(self.scanner.oriented_references(image))
+            self.embedding_cache.put(key, references)
+        return list(references)
+
+    def _reference_embeddings(self, images):
+        """_reference_embedding for many images; the ones not in the cache are embedded in batches."""
+        keys = [EmbeddingCache.key(image) for image in images]
+        references = [self.embedding_cache.get(key) for key in keys]
+        missing = [i for i, reference in enumerate(references) if reference is None]
+        if missing:
+            with span("decode"):
+                decoded = [load_image(images[i]) for i in missing]
+            embeddings = self.model.embed_images(decoded, embedder=self.scheduler,
+                                                 batch_size=self.runtime_options["batch_size"])
+            for i, image, embedding in zip(missing, decoded, embeddings):
+                # A row of the batch would keep the whole batch alive in the cache
+                references[i] = (embedding.clone(), image.size, reference_template(image))
+                self.embedding_cache.put(keys[i], references[i])
+        return references
+
+    def _embed_image(self, image_bytes):
+        return self.model.embed_image(image_bytes, embedder=self.scheduler)
+
+    def _to_proto_boxes(self, results):
+        """Converts scanner match dicts into BoundingBox messages."""
+        proto_matches = []
+        for r in results:
+            proto_matches.append(symbol_detector_pb2.BoundingBox(
+                x=r['x'], 
+                y=r['y'], 
+                width=r['width'], 
+                height=r['height'], 
+                score=r['score'],
+                rotation=r.get('rotation', 0),
+                mirrored=r.get('mirrored', False)
+            ))
+        return proto_matches
+
+    def _check_scan(self, request, context):
+        """Validates the options of a ScanRequest (or MultiScanRequest) before any work is done.
+
+        Returns False, with INVALID_ARGUMENT set on the context, if one is out of range.
+        """
+        problem = None
+        threshold = getattr(request, "threshold", 0)
+        if not -1 <= threshold <= 1:
+            problem = f"threshold is a cosine score in [-1, 1], got {threshold}"
+        elif any(not 0 < scale < float("inf") for scale in request.scales):
+            problem = f"scales are sizes relative to the reference and must be > 0, got {list(request.scales)}"
+        elif getattr(request, "any_orientation", False) and self.scanner_options["tiled"]:
+            # Oriented scans decode the whole page, which --tiled is there to avoid
+            problem = "any_orientation is not supported by a --tiled server"
+        if problem is None:
+            return True
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details(problem)
+        return False
+
+    def _scan_options(self, request):
+        """Scanner keyword arguments taken from a ScanRequest (checked by _check_scan)."""
+        engines = {symbol_detector_pb2.ENGINE_DENSE: "dense", symbol_detector_pb2.ENGINE_CASCADE: "cascade"}
+        return {
+            "threshold": getattr(request, "threshold", 0) or 0.85,
+            "engine": engines.get(request.engine, "crop"),
+            "scales": list(request.scales) or None,
+        }
+
+    def _scan(self, request, reference, blueprint, stats):
+        """Runs a ScanRequest's scan of blueprint; ranked (in-process) for max_results / exists."""
+        options = self._scan_options(request)
+        if request.any_orientation:
+            # reference is the list of oriented variants (_resolve_reference)
+            if request.max_results > 0 or request.exists:
+                return self.scanner.scan_oriented(reference, blueprint, stats=stats,
+                                                  max_results=request.max_results, exists=request.exists,
+                                                  **options)
+            return self._scanner_for(options).scan_oriented(reference, blueprint, stats=stats, **options)
+        ref_embedding, window_size, template = reference
+        if request.max_results > 0 or request.exists:
+            # Early exit needs the windows in one ordered sequence, not spread over workers
+            return self.scanner.scan_ranked(ref_embedding, window_size, blueprint, template=template,
+                                            stats=stats, max_results=request.max_results,
+                                            exists=request.exists, **options)
+        return self._scanner_for(options).scan_with_reference(ref_embedding, window_size, blueprint,
+                                                              template=template, stats=stats, **options)
+
+    def _found_message(self, request, matches):
+        if request.exists:
+            return "Symbol found." if matches else "Symbol not found."
+        return f"Found {len(matches)} matches."
+
+    def _scanner_for(self, options):
+        """The in-process scanner for indexed (crop engine) and tiled scans, else page_scanner."""
+        # A page in the index is one matrix product away; not worth a trip to the workers
+        if self.page_index is not None and options["engine"] == "crop":
+            return self.scanner
+        # Workers get whole decoded levels in shared memory, which tiled mode avoids
+        if self.scanner.tiled:
+            return self.scanner
+        return self.page_scanner
+
+    def _cascade_summary(self, stats):
+        """(CascadeStats message, message suffix) for a scan's cascade counts."""
+        if not stats:
+            return None, ""
+        pruned = stats["ink_pruned"] + stats["ncc_pruned"]
+        return symbol_detector_pb2.CascadeStats(**stats), (
+            f" Cascade pruned {pruned}/{stats['windows']} windows "
+            f"(ink {stats['ink_pruned']}, ncc {stats['ncc_pruned']}), "
+            f"embedded {stats['embedded']} ({stats['refined']} refined)."
+        )
+
+    def _probe_upload(self, spool):
+        """(format, (w, h)) once the image header has been uploaded, else None."""
+        pos = spool.tell()
+        try:
+            spool.seek(0)
+            # Image.open only parses the header; pixels are decoded later
+            with Image.open(spool) as img:
+                return img.format, img.size
+        except (UnidentifiedImageError, EOFError):
+            return None
+        finally:
+            spool.seek(pos)
+
+    def _resolve_reference(self, request, context):
+        """(embedding, (w, h), template) from request.reference_id or request.reference_image.
+
+        For a ScanRequest with any_orientation, a list of those, one per
+        orientation (_oriented_reference). Returns None (with NOT_FOUND set on
+        the context) for an unknown or expired id, and with FAILED_PRECONDITION
+        for an oriented scan of an id whose image was not kept.
+        """
+        oriented = getattr(request, "any_orientation", False)
+        image = request.reference_image
+        if request.reference_id:
+            reference = self.references.get(request.reference_id)
+            if reference is None:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Unknown or expired reference_id '{request.reference_id}'")
+            if reference is None or not oriented:
+                return reference
+            # Orientations are embedded from the image the id was registered with
+            image = self.references.image(request.reference_id)
+            if image is None:
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(f"The image of reference_id '{request.reference_id}' was dropped "
+                                    f"(--reference-image-mb); register it again or send reference_image")
+                return None
+        with span("reference"):
+            if oriented:
+                return self._oriented_reference(image)
+            return self._reference_embedding(image)
+
+    def _timings(self, request):
+        """ScanTimings of the running request if it asked for them, else None."""
+        trace = current()
+        if trace is None or not request.include_timings:
+            return None
+        return symbol_detector_pb2.ScanTimings(
+            total_seconds=trace.elapsed(),
+            stages=[symbol_detector_pb2.StageTiming(stage=stage, seconds=seconds)
+                    for stage, seconds in stage_seconds(trace)],
+            windows=trace.counts.get("windows", 0),
+            candidates=trace.counts.get("candidates", 0),
+            matches=trace.counts.get("matches", 0)
+        )
+
+    @_instrumented
+    def Predict(self, request, context):
+        """Standard One-Shot Comparison"""
+        if not self._check_ready(context):
+            return symbol_detector_pb2.PredictResponse()
+        try:
+            print(f"Received Predict Request (Ref: {len(request.reference_image)} bytes)")
+            
+            # Pass raw bytes to the model (the reference embedding may come from the cache)
+            ref_embedding = self._reference_embedding(request.reference_image)[0]
+            query_embedding, _ = self._embed_image(request.query_image)
+            result = self.model.predict(request.reference_image, request.query_image,
+                                        ref_embedding=ref_embedding, query_embedding=query_embedding)
+            print(f"Embedding cache: {self.embedding_cache.stats()}")
+            print(f"Batching: {self.scheduler.stats()}")
+            
+            msg = f"Score: {result['score']:.4f}"
+            
+            return symbol_detector_pb2.PredictResponse(
+                similarity_score=result["score"],
+                is_match=result["is_match"],
+                message=msg
+            )
+        except Exception as e:
+            print(f"Predict Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return symbol_detector_pb2.PredictResponse()
+
+    @_instrumented
+    def PredictBatch(self, request, context):
+        """Every reference against every query, in batched forward passes"""
+        if not self._check_ready(context):
+            return symbol_detector_pb2.PredictBatchResponse()
+        num_references = len(request.reference_images) + len(request.reference_ids)
+        if not num_references or not request.query_images:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("PredictBatch needs at least one reference and one query")
+            return symbol_detector_pb2.PredictBatchResponse()
+        try:
+            print(f"Received PredictBatch Request ({num_references} references, "
+                  f"{len(request.query_images)} queries)")
+
+            with span("reference"):
+                references = self._reference_embeddings(list(request.reference_images))
+            for reference_id in request.reference_ids:
+                reference = self.references.get(reference_id)
+                if reference is None:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details(f"Unknown or expired reference_id '{reference_id}'")
+                    return symbol_detector_pb2.PredictBatchResponse()
+                references.append(reference)
+
+            result = self.model.predict_batch([r[0] for r in references], list(request.query_images),
+                                              embedder=self.scheduler,
+                                              batch_size=self.runtime_options["batch_size"],
+                                              top_k=request.top_k)
+            response = symbol_detector_pb2.PredictBatchResponse(num_references=num_references,
+                                                                num_queries=len(request.query_images))
+            if request.top_k > 0:
+                scores, indices = result
+                response.k = scores.shape[1]
+                response.top_scores.extend(scores.flatten().tolist())
+                response.top_indices.extend(indices.flatten().tolist())
+                response.message = f"Top {response.k} of {len(request.query_images)} queries per reference."
+            else:
+                response.scores.extend(result.flatten().tolist())
+                response.message = f"Scored {num_references}x{len(request.query_images)} pairs."
+            print(f"Batching: {self.scheduler.stats()}")
+            return response
+        except UnidentifiedImageError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"Not a readable image: {e}")
+            return symbol_detector_pb2.PredictBatchResponse()
+        except Exception as e:
+            print(f"PredictBatch Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return symbol_detector_pb2.PredictBatchResponse()
+
+    @_instrumented
+    def ScanBlueprint(self, request, context):
+        """New: Sliding Window Scan"""
+        if not self._check_ready(context):
+            return symbol_detector_pb2.ScanResponse()
+        try:
+            print(f"Received Scan Request (Blueprint: {len(request.blueprint_image)} bytes)")
+            if not self._check_scan(request, context):
+                return symbol_detector_pb2.ScanResponse()
+            
+            # Run the scanner
+            reference = self._resolve_reference(request, context)
+            if reference is None:
+                return symbol_detector_pb2.ScanResponse()
+            print(f"Embedding cache: {self.embedding_cache.stats()}")
+            stats = {}
+            results = self._scan(request, reference, request.blueprint_image, stats)
+            if self.page_index is not None:
+                print(f"Page index: {self.page_index.stats()}")
+            
+            # Convert python dictionaries to Proto BoundingBox objects
+            proto_matches = self._to_proto_boxes(results)
+            cascade, summary = self._cascade_summary(stats)
+            
+            return symbol_detector_pb2.ScanResponse(
+                matches=proto_matches,
+                message=f"Scan complete. {self._found_message(request, proto_matches)}{summary}",
+                cascade=cascade,
+                timings=self._timings(request)
+            )
+        except Exception as e:
+            print(f"Scan Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return symbol_detector_pb2.ScanResponse()
+
+    @_instrumented
+    def ScanBlueprintStream(self, request, context):
+        """Sliding Window Scan that streams matches band by band"""
+        if not self._check_ready(context):
+            return
+        try:
+            print(f"Received Streaming Scan Request (Blueprint: {len(request.blueprint_image)} bytes)")
+            if request.any_orientation:
+                # Bands follow one window size; the orientations on their side have another
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details("any_orientation is not supported by streaming scans, use ScanBlueprint")
+                return
+            if not self._check_scan(request, context):
+                return
+
+            reference = self._resolve_reference(request, context)
+            if reference is None:
+                return
+            ref_embedding, window_size, template = reference
+
+            # Page order: max_results / exists end the stream at the first matches
+            limit = 1 if request.exists else request.max_results
+            found, stats = 0, {}
+            for done, total, results in self.scanner.iter_scan(ref_embedding, window_size, request.blueprint_image,
+                                                               template=template, stats=stats,
+                                                               **self._scan_options(request)):
+                # Stop working on the page as soon as the client goes away
+                if not context.is_active():
+                    print("Streaming scan cancelled by client.")
+                    return
+                if limit:
+                    results = results[:limit - found]
+                found += len(results)
+                cascade, summary = self._cascade_summary(stats)
+                yield symbol_detector_pb2.ScanProgress(
+                    matches=self._to_proto_boxes(results),
+                    tiles_done=done,
+                    tiles_total=total,
+                    message=f"Band {done}/{total}. Found {found} matches so far.{summary}",
+                    cascade=cascade,
+                    timings=self._timings(request)
+                )
+                if limit and found >= limit:
+                    print(f"Streaming scan stopped after {found} matches.")
+                    return
+        except Exception as e:
+            print(f"Streaming Scan Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+
+    @_instrumented
+    def ScanBlueprintUpload(self, request_iterator, context):
+        """Sliding Window Scan of a blueprint uploaded in chunks"""
+        if not self._check_ready(context):
+            return symbol_detector_pb2.ScanResponse()
+        try:
+            header, reference, page = None, None, None
+            received = 0
+
+            # Small pages stay in memory, large ones spill to disk: memory per
+            # request is bounded and there is no message-size ceiling
+            with tempfile.SpooledTemporaryFile(max_size=self.upload_spool_bytes) as spool:
+                for chunk in request_iterator:
+                    if chunk.HasField("header"):
+                        header = chunk.header
+                        if header.include_timings:
+                            begin_trace()
+                        if not self._check_scan(header, context):
+                            return symbol_detector_pb2.ScanResponse()
+                        # Embed the reference while the page is still uploading
+                        reference = self._resolve_reference(header, context)
+                        if reference is None:
+                            return symbol_detector_pb2.ScanResponse()
+                        continue
+
+                    if header is None:
+                        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                        context.set_details("The first upload message must be the scan header")
+                        return symbol_detector_pb2.ScanResponse()
+
+                    spool.write(chunk.blueprint_chunk)
+                    received += len(chunk.blueprint_chunk)
+
+                    # Read the image header as soon as it is here, so a bad or
+                    # oversized page is rejected before the rest is uploaded
+                    if page is None:
+                        try:
+                            page = self._probe_upload(spool)
+                        except Image.DecompressionBombError as e:
+                            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                            context.set_details(str(e))
+                            return symbol_detector_pb2.ScanResponse()
+                        if page is not None:
+                            print(f"Receiving Upload ({page[0]} {page[1][0]}x{page[1][1]})...")
+                        elif received > 1024 * 1024:
+                            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                            context.set_details("Uploaded blueprint is not a readable image")
+                            return symbol_detector_pb2.ScanResponse()
+
+                if header is None or received == 0:
+                    context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                    context.set_details("Upload needs a scan header and at least one blueprint chunk")
+                    return symbol_detector_pb2.ScanResponse()
+
+                print(f"Received Upload Scan Request (Blueprint: {received} bytes)")
+                spool.seek(0)
+                stats = {}
+                results = self._scan(header, reference, spool, stats)
+
+            proto_matches = self._to_proto_boxes(results)
+            cascade, summary = self._cascade_summary(stats)
+            return symbol_detector_pb2.ScanResponse(
+                matches=proto_matches,
+                message=f"Scan complete. {self._found_message(header, proto_matches)}{summary}",
+                cascade=cascade,
+                timings=self._timings(header)
+            )
+        except Exception as e:
+            print(f"Upload Scan Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return symbol_detector_pb2.ScanResponse()
+
+    @_instrumented
+    def ScanDocument(self, request, context):
+        """Scans every page of a PDF or multi-page TIFF, streaming each page's matches"""
+        if not self._check_ready(context):
+            return
+        scan = request.scan
+        try:
+            print(f"Received Document Scan Request (Document: {len(scan.blueprint_image)} bytes)")
+            if not self._check_scan(scan, context):
+                return
+            try:
+                document = Document(scan.blueprint_image, dpi=request.dpi, numbers=list(request.pages))
+            except ImportError as e:
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(str(e))
+                return
+            except (ValueError, OSError) as e:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(f"Unreadable document: {e}")
+                return
+
+            # One reference embedding for every page
+            reference = self._resolve_reference(scan, context)
+            if reference is None:
+                return
+            print(f"Scanning {len(document)} of {document.page_count} pages"
+                  f"{f' at {document.dpi:g} dpi' if document.is_pdf else ''}...")
+
+            # Page n+1 is rasterized while page n is scanned
+            found, stats = 0, {}
+            for done, (number, page) in enumerate(prefetch(document.pages()), 1):
+                if not context.is_active():
+                    print("Document scan cancelled by client.")
+                    return
+                results = self._scan(scan, reference, page, stats)
+                found += len(results)
+                yield symbol_detector_pb2.DocumentPageResult(
+                    page=number,
+                    pages_done=done,
+                    pages_total=len(document),
+                    width=page.width,
+                    height=page.height,
+                    matches=self._to_proto_boxes(results),
+                    message=f"Page {number}: {self._found_message(scan, results)} "
+                            f"{found} matches so far.",
+                    timings=self._timings(scan)
+                )
+                if scan.exists and results:
+                    print(f"Document scan stopped at page {number}.")
+                    return
+        except Exception as e:
+            print(f"Document Scan Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+
+    @_instrumented
+    def RegisterReference(self, request, context):
+        """Embeds a reference once and returns an id to scan with"""
+        if not self._check_ready(context):
+            return symbol_detector_pb2.RegisterReferenceResponse()
+        try:
+            print(f"Received RegisterReference Request (Ref: {len(request.reference_image)} bytes)")
+
+            # The content hash doubles as the id, so re-registering a symbol is idempotent
+            reference_id = EmbeddingCache.key(request.reference_image)
+            ref_embedding, (w, h), template = self._reference_embedding(request.reference_image)
+            ttl = self.references.register(reference_id, ref_embedding, (w, h), ttl=request.ttl_seconds,
+                                           template=template, image=request.reference_image)
+
+            return symbol_detector_pb2.RegisterReferenceResponse(
+                reference_id=reference_id,
+                width=w,
+                height=h,
+                ttl_seconds=int(ttl)
+            )
+        except Exception as e:
+            print(f"RegisterReference Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return symbol_detector_pb2.RegisterReferenceResponse()
+
+    @_instrumented
+    def ScanBlueprintMulti(self, request, context):
+        """Scans one page for many reference symbols in a single pass"""
+        if not self._check_ready(context):
+            return symbol_detector_pb2.MultiScanResponse()
+        try:
+            print(f"Received Multi Scan Request ({len(request.references)} references, "
+                  f"Blueprint: {len(request.blueprint_image)} bytes)")
+            if not request.references:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details("ScanBlueprintMulti needs at least one reference")
+                return symbol_detector_pb2.MultiScanResponse()
+            if not self._check_scan(request, context):
+                return symbol_detector_pb2.MultiScanResponse()
+
+            references = []
+            for ref in request.references:
+                reference = self._resolve_reference(ref, context)
+                if reference is None:
+                    return symbol_detector_pb2.MultiScanResponse()
+                references.append(reference)
+            print(f"Embedding cache: {self.embedding_cache.stats()}")
+
+            stats, options = {}, self._scan_options(request)
+            results = self._scanner_for(options).scan_multi(references, request.blueprint_image,
+                                                            stats=stats, **options)
+
+            symbols = []
+            for ref, matches in zip(request.references, results):
+                symbols.append(symbol_detector_pb2.SymbolMatches(
+                    label=ref.label,
+                    reference_id=ref.reference_id or EmbeddingCache.key(ref.reference_image),
+                    matches=self._to_proto_boxes(matches)
+                ))
+            cascade, summary = self._cascade_summary(stats)
+            total = sum(len(matches) for matches in results)
+
+            return symbol_detector_pb2.MultiScanResponse(
+                symbols=symbols,
+                message=f"Scan complete. Found {total} matches of {len(symbols)} symbols.{summary}",
+                cascade=cascade
+            )
+        except Exception as e:
+            print(f"Multi Scan Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return symbol_detector_pb2.MultiScanResponse()
+
+    @_instrumented
+    def SearchLibrary(self, request, context):
+        """Top-k places a symbol appears across the whole symbol library"""
+        if not self._check_ready(context):
+            return symbol_detector_pb2.LibrarySearchResponse()
+        if self.library is None:
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details("No symbol library configured (start the server with --library DIR)")
+            return symbol_detector_pb2.LibrarySearchResponse()
+        try:
+            reference = self._resolve_reference(request, context)
+            if reference is None:
+                return symbol_detector_pb2.LibrarySearchResponse()
+            start = time.perf_counter()
+            hits = self.library.search(reference[0].cpu().numpy(), top_k=request.top_k or 10,
+                                       nprobe=request.nprobe or None,
+                                       threshold=request.min_score or None)
+            elapsed = time.perf_counter() - start
+            stats = self.library.stats()
+            print(f"Library search: {len(hits)} hits in {elapsed * 1000:.1f} ms ({stats})")
+
+            return symbol_detector_pb2.LibrarySearchResponse(
+                hits=[symbol_detector_pb2.LibraryHit(page=hit["page"], page_id=hit["page_id"],
+                                                     box=self._to_proto_boxes([hit])[0])
+                      for hit in hits],
+                message=f"Found {len(hits)} hits in {stats['pages']} pages ({elapsed * 1000:.0f} ms).",
+                pages=stats["pages"],
+                windows=stats["vectors"]
+            )
+        except Exception as e:
+            print(f"Library Search Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return symbol_detector_pb2.LibrarySearchResponse()
+
+    @_instrumented
+    def AddLibraryPage(self, request, context):
+        """Embeds a new sheet into the symbol library"""
+        if not self._check_ready(context):
+            return symbol_detector_pb2.LibraryPageResponse()
+        if self.library is None:
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details("No symbol library configured (start the server with --library DIR)")
+            return symbol_detector_pb2.LibraryPageResponse()
+        try:
+            print(f"Received AddLibraryPage Request ({request.name}, {len(request.blueprint_image)} bytes)")
+            windows = self.library.add_page(self.scanner, request.name, request.blueprint_image)
+            self.library.save()
+            pages = self.library.stats()["pages"]
+            return symbol_detector_pb2.LibraryPageResponse(
+                windows=windows,
+                pages=pages,
+                message=f"Added {windows} windows." if windows else "Page already in the library."
+            )
+        except UnidentifiedImageError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"Blueprint is not a readable image: {e}")
+            return symbol_detector_pb2.LibraryPageResponse()
+        except Exception as e:
+            print(f"AddLibraryPage Error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return symbol_detector_pb2.LibraryPageResponse()
+
+    @_instrumented
+    def Health(self, request, context):
+        """Readiness probe: STARTING while the model loads and warms up, then SERVING"""
+        return symbol_detector_pb2.HealthResponse(
+            status=self.status,
+            message=self.status_message,
+            backend=self.model_options["backend"],
+            load_seconds=self.load_seconds
+        )
+
+    def GetStats(self, request, context):
+        """Request counts, latencies and scan stage totals since startup"""
+        snapshot = self.metrics.snapshot()
+        counters = {name: float(n) for name, n in snapshot["counts"].items()}
+        counters.update({name: float(v) for name, v in snapshot["gauges"].items()})
+        return symbol_detector_pb2.StatsResponse(
+            enabled=self.metrics.enabled,
+            rpcs=[symbol_detector_pb2.RpcStats(rpc=rpc, requests=s["requests"], errors=s["errors"],
+                                               seconds_total=s["seconds_total"], p50_seconds=s["p50"],
+                                               p95_seconds=s["p95"], p99_seconds=s["p99"])
+                  for rpc, s in sorted(snapshot["rpcs"].items())],
+            stages=[symbol_detector_pb2.StageTiming(stage=stage, seconds=seconds)
+                    for stage, seconds in snapshot["stages"].items()],
+            counters=counters,
+            text=self.metrics.render()
+        )
+
+# -----------------------------------------------------------------------------
+# 4. STARTUP
+# -----------------------------------------------------------------------------
+def serve(port=50051, batch_size=32, cache_entries=256, cache_mb=64, reference_ttl=3600,
+          reference_image_mb=64, upload_spool_mb=32, max_batch=32, max_wait_ms=5, workers=0, worker_threads=1,
+          backend="eager", calibration_images=None, accuracy_tolerance=0.02, weights_path=None,
+          cascade_ink_ratio=0.25, cascade_min_ncc=0.3, cascade_oriented_ncc=0.4, page_index_dir=None,
+          page_index_mb=2048,
+          library_dir=None, library_windows=None, tiled=False, band_rows=4, metrics=False,
+          metrics_port=None, metrics_host="127.0.0.1", aio=False, predict_concurrency=4,
+          predict_queue=64, scan_concurrency=2, scan_queue=8):
+    servicer = SymbolDetectorServicer(batch_size=batch_size, cache_entries=cache_entries,
+                                      cache_mb=cache_mb, reference_ttl=reference_ttl,
+                                      reference_image_mb=reference_image_mb,
+                                      upload_spool_mb=upload_spool_mb, max_batch=max_batch,
+                                      max_wait_ms=max_wait_ms, workers=workers,
+                                      worker_threads=worker_threads, backend=backend,
+                                      calibration_images=calibration_images,
+                                      accuracy_tolerance=accuracy_tolerance, weights_path=weights_path,
+                                      cascade_ink_ratio=cascade_ink_ratio, cascade_min_ncc=cascade_min_ncc,
+                                      cascade_oriented_ncc=cascade_oriented_ncc,
+                                      page_index_dir=page_index_dir, page_index_mb=page_index_mb,
+                                      library_dir=library_dir, library_windows=library_windows,
+                                      tiled=tiled, band_rows=band_rows,
+                                      metrics=metrics or metrics_port is not None,
+                                      # Open the port now; Health reports when the model is ready
+                                      load_in_background=True)
+    if metrics_port is not None:
+        servicer.metrics.serve_http(metrics_port, host=metrics_host)
+        print(f"Metrics at http://{metrics_host}:{metrics_port}/metrics")
+
+    if aio:
+        # Separate lanes: Predict never queues behind scans, and a full lane
+        # rejects with RESOURCE_EXHAUSTED instead of queueing without bound
+        try:
+            from server.aio_server import Lane, serve_aio
+        except ImportError:
+            from aio_server import Lane, serve_aio
+        lanes = {"predict": Lane("predict", predict_concurrency, predict_queue, priority=0),
+                 "scan": Lane("scan", scan_concurrency, scan_queue, priority=1)}
+        for name, lane in lanes.items():
+            servicer.metrics.add_collector(f"lane_{name}", lane.stats)
+        asyncio.run(serve_aio(servicer, port, lanes))
+        return
+
+    # Allow up to 10 simultaneous requests
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    symbol_detector_pb2_grpc.add_SymbolDetectorServicer_to_server(servicer, server)
+
+    # Listen on port 50051
+    server.add_insecure_port(f'[::]:{port}')
+    print(f"One Shot Detector Server started on port {port}...")
+    server.start()
+    server.wait_for_termination()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="One Shot Detector gRPC server")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Windows embedded per forward pass during a scan")
+    parser.add_argument("--cache-entries", type=int, default=256,
+                        help="Max reference embeddings kept in the LRU cache (0 disables it)")
+    parser.add_argument("--cache-mb", type=int, default=64,
+                        help="Max total size of cached embeddings in MB")
+    parser.add_argument("--reference-ttl", type=int, default=3600,
+                        help="Default idle TTL (seconds) of registered references")
+    parser.add_argument("--reference-image-mb", type=int, default=64,
+                        help="Max total size in MB of registered reference images, kept for "
+                             "any_orientation scans by reference_id (least recently used dropped first)")
+    parser.add_argument("--upload-spool-mb", type=int, default=32,
+                        help="Chunked uploads larger than this are spooled to disk")
+    parser.add_argument("--max-batch", type=int, default=32,
+                        help="Max images the scheduler coalesces into one forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=5,
+                        help="How long the scheduler waits for more requests to fill a batch")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Scan in this many worker processes (0 = in-process)")
+    parser.add_argument("--worker-threads", type=int, default=1,
+                        help="Torch threads per worker process (keep workers x threads <= cores)")
+    parser.add_argument("--backend", default="eager",
+                        help="Inference backend: eager, torchscript, int8 or onnx (see backends.py)")
+    parser.add_argument("--calibration", nargs="*", default=None, metavar="IMAGE",
+                        help="Blueprint images for int8 calibration and the backend accuracy check")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.02,
+                        help="Refuse to start if the backend moves cosine scores more than this")
+    parser.add_argument("--weights", default=None, metavar="PATH",
+                        help="Local truncated weights written by `python model.py PATH` (no download)")
+    parser.add_argument("--cascade-ink-ratio", type=float, default=0.25,
+                        help="Cascade engine: drop windows with less ink than this x the reference's")
+    parser.add_argument("--cascade-min-ncc", type=float, default=0.3,
+                        help="Cascade engine: drop windows correlating less than this with the reference")
+    parser.add_argument("--cascade-oriented-ncc", type=float, default=0.4,
+                        help="Cascade engine, any_orientation scans: drop windows correlating less than "
+                             "this with the best orientation of the reference")
+    parser.add_argument("--page-index", default=None, metavar="DIR",
+                        help="Persist crop-engine window embeddings of scanned pages here "
+                             "(warm it with `python page_index.py DIR BLUEPRINTS...`)")
+    parser.add_argument("--page-index-mb", type=int, default=2048,
+                        help="Max disk size of the page index; least recently used pages go first")
+    parser.add_argument("--library", default=None, metavar="DIR",
+                        help="Symbol library for SearchLibrary / AddLibraryPage (build it with "
+                             "`python library.py DIR add BLUEPRINTS...`)")
+    parser.add_argument("--library-window", action="append", type=parse_window, default=None,
+                        metavar="WxH", help="Candidate window sizes of a new library (repeatable)")
+    parser.add_argument("--tiled", action="store_true",
+                        help="Read pages band by band (memory follows --band-rows, not the page size)")
+    parser.add_argument("--band-rows", type=int, default=4,
+                        help="Window rows per band of tiled and streaming scans")
+    parser.add_argument("--max-page-megapixels", type=float, default=None,
+                        help="Raise PIL's decompression-bomb limit for very large pages")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Record per-RPC latency and per-stage scan time (GetStats)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Also serve the metrics as Prometheus text on this port (implies --metrics)")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="Address the metrics endpoint listens on")
+    parser.add_argument("--aio", action="store_true",
+                        help="Serve with grpc.aio: separate Predict and scan lanes, bounded queues, "
+                             "scans stop when the client cancels or its deadline passes")
+    parser.add_argument("--predict-concurrency", type=int, default=4,
+                        help="--aio: Predict / RegisterReference / SearchLibrary calls running at once")
+    parser.add_argument("--predict-queue", type=int, default=64,
+                        help="--aio: Predict-lane calls that may wait; more get RESOURCE_EXHAUSTED")
+    parser.add_argument("--scan-concurrency", type=int, default=2,
+                        help="--aio: scans running at once")
+    parser.add_argument("--scan-queue", type=int, default=8,
+                        help="--aio: scans that may wait; more get RESOURCE_EXHAUSTED")
+    args = parser.parse_args()
+    if args.max_page_megapixels:
+        Image.MAX_IMAGE_PIXELS = int(args.max_page_megapixels * 1e6)
+    serve(port=args.port, batch_size=args.batch_size,
+          cache_entries=args.cache_entries, cache_mb=args.cache_mb,
+          reference_ttl=args.reference_ttl, reference_image_mb=args.reference_image_mb,
+          upload_spool_mb=args.upload_spool_mb,
+          max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+          workers=args.workers, worker_threads=args.worker_threads, backend=args.backend,
+          calibration_images=args.calibration, accuracy_tolerance=args.accuracy_tolerance,
+          weights_path=args.weights, cascade_ink_ratio=args.cascade_ink_ratio,
+          cascade_min_ncc=args.cascade_min_ncc, cascade_oriented_ncc=args.cascade_oriented_ncc,
+          page_index_dir=args.page_index,
+          page_index_mb=args.page_index_mb, library_dir=args.library,
+          library_windows=args.library_window, tiled=args.tiled, band_rows=args.band_rows,
+          metrics=args.metrics, metrics_port=args.metrics_port, metrics_host=args.metrics_host,
+          aio=args.aio, predict_concurrency=args.predict_concurrency, predict_queue=args.predict_queue,
+          scan_concurrency=args.scan_concurrency, scan_queue=args.scan_queue)
\ No newline at end of file
@@ -14,23 +14,81 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x15symbol_detector.proto\x12\x0fsymbol_detector\">\n\x0ePredictRequest\x12\x17\n\x0freference_image\x18\x01 \x01(\x0c\x12\x13\n\x0bquery_image\x18\x02 \x01(\x0c\"N\n\x0fPredictResponse\x12\x18\n\x10similarity_score\x18\x01 \x01(\x02\x12\x10\n\x08is_match\x18\x02 \x01(\x08\x12\x0f\n\x07message\x18\x03 \x01(\t\"?\n\x0bScanRequest\x12\x17\n\x0freference_image\x18\x01 \x01(\x0c\x12\x17\n\x0f\x62lueprint_image\x18\x02 \x01(\x0c\"Q\n\x0b\x42oundingBox\x12\t\n\x01x\x18\x01 \x01(\x05\x12\t\n\x01y\x18\x02 \x01(\x05\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\x12\r\n\x05score\x18\x05 \x01(\x02\"N\n\x0cScanResponse\x12-\n\x07matches\x18\x01 \x03(\x0b\x32\x1c.symbol_detector.BoundingBox\x12\x0f\n\x07message\x18\x02 \x01(\t2\xac\x01\n\x0eSymbolDetector\x12L\n\x07Predict\x12\x1f.symbol_detector.PredictRequest\x1a .symbol_detector.PredictResponse\x12L\n\rScanBlueprint\x12\x1c.symbol_detector.ScanRequest\x1a\x1d.symbol_detector.ScanResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x15symbol_detector.proto\x12\x0fsymbol_detector\">\n\x0ePredictRequest\x12\x17\n\x0freference_image\x18\x01 \x01(\x0c\x12\x13\n\x0bquery_image\x18\x02 \x01(\x0c\"N\n\x0fPredictResponse\x12\x18\n\x10similarity_score\x18\x01 \x01(\x02\x12\x10\n\x08is_match\x18\x02 \x01(\x08\x12\x0f\n\x07message\x18\x03 \x01(\t\"k\n\x13PredictBatchRequest\x12\x18\n\x10reference_images\x18\x01 \x03(\x0c\x12\x15\n\rreference_ids\x18\x02 \x03(\t\x12\x14\n\x0cquery_images\x18\x03 \x03(\x0c\x12\r\n\x05top_k\x18\x04 \x01(\x05\"\x98\x01\n\x14PredictBatchResponse\x12\x16\n\x0enum_references\x18\x01 \x01(\x05\x12\x13\n\x0bnum_queries\x18\x02 \x01(\x05\x12\x0e\n\x06scores\x18\x03 \x03(\x02\x12\t\n\x01k\x18\x04 \x01(\x05\x12\x13\n\x0btop_indices\x18\x05 \x03(\x05\x12\x12\n\ntop_scores\x18\x06 \x03(\x02\x12\x0f\n\x07message\x18\x07 \x01(\t\"\xfc\x01\n\x0bScanRequest\x12\x17\n\x0freference_image\x18\x01 \x01(\x0c\x12\x17\n\x0f\x62lueprint_image\x18\x02 \x01(\x0c\x12+\n\x06\x65ngine\x18\x03 \x01(\x0e\x32\x1b.symbol_detector.ScanEngine\x12\x0e\n\x06scales\x18\x04 \x03(\x02\x12\x14\n\x0creference_id\x18\x05 \x01(\t\x12\x17\n\x0finclude_timings\x18\x06 \x01(\x08\x12\x11\n\tthreshold\x18\x07 \x01(\x02\x12\x13\n\x0bmax_results\x18\x08 \x01(\r\x12\x0e\n\x06\x65xists\x18\t \x01(\x08\x12\x17\n\x0f\x61ny_orientation\x18\n \x01(\x08\"u\n\x0b\x42oundingBox\x12\t\n\x01x\x18\x01 \x01(\x05\x12\t\n\x01y\x18\x02 \x01(\x05\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\x12\r\n\x05score\x18\x05 \x01(\x02\x12\x10\n\x08rotation\x18\x06 \x01(\x05\x12\x10\n\x08mirrored\x18\x07 \x01(\x08\"j\n\x0c\x43\x61scadeStats\x12\x0f\n\x07windows\x18\x01 \x01(\x05\x12\x12\n\nink_pruned\x18\x02 \x01(\x05\x12\x12\n\nncc_pruned\x18\x03 \x01(\x05\x12\x10\n\x08\x65mbedded\x18\x04 \x01(\x05\x12\x0f\n\x07refined\x18\x05 \x01(\x05\"-\n\x0bStageTiming\x12\r\n\x05stage\x18\x01 \x01(\t\x12\x0f\n\x07seconds\x18\x02 \x01(\x01\"\x88\x01\n\x0bScanTimings\x12\x15\n\rtotal_seconds\x18\x01 \x01(\x01\x12,\n\x06stages\x18\x02 \x03(\x0b\x32\x1c.symbol_detector.StageTiming\x12\x0f\n\x07windows\x18\x03 \x01(\x03\x12\x12\n\ncandidates\x18\x04 \x01(\x03\x12\x0f\n\x07matches\x18\x05 \x01(\x03\"\xad\x01\n\x0cScanResponse\x12-\n\x07matches\x18\x01 \x03(\x0b\x32\x1c.symbol_detector.BoundingBox\x12\x0f\n\x07message\x18\x02 \x01(\t\x12.\n\x07\x63\x61scade\x18\x03 \x01(\x0b\x32\x1d.symbol_detector.CascadeStats\x12-\n\x07timings\x18\x04 \x01(\x0b\x32\x1c.symbol_detector.ScanTimings\"\xd6\x01\n\x0cScanProgress\x12-\n\x07matches\x18\x01 \x03(\x0b\x32\x1c.symbol_detector.BoundingBox\x12\x12\n\ntiles_done\x18\x02 \x01(\x05\x12\x13\n\x0btiles_total\x18\x03 \x01(\x05\x12\x0f\n\x07message\x18\x04 \x01(\t\x12.\n\x07\x63\x61scade\x18\x05 \x01(\x0b\x32\x1d.symbol_detector.CascadeStats\x12-\n\x07timings\x18\x06 \x01(\x0b\x32\x1c.symbol_detector.ScanTimings\"g\n\x0fScanUploadChunk\x12.\n\x06header\x18\x01 \x01(\x0b\x32\x1c.symbol_detector.ScanRequestH\x00\x12\x19\n\x0f\x62lueprint_chunk\x18\x02 \x01(\x0cH\x00\x42\t\n\x07payload\"H\n\x18RegisterReferenceRequest\x12\x17\n\x0freference_image\x18\x01 \x01(\x0c\x12\x13\n\x0bttl_seconds\x18\x02 \x01(\x05\"e\n\x19RegisterReferenceResponse\x12\x14\n\x0creference_id\x18\x01 \x01(\t\x12\r\n\x05width\x18\x02 \x01(\x05\x12\x0e\n\x06height\x18\x03 \x01(\x05\x12\x13\n\x0bttl_seconds\x18\x04 \x01(\x05\"O\n\x0fSymbolReference\x12\x17\n\x0freference_image\x18\x01 \x01(\x0c\x12\x14\n\x0creference_id\x18\x02 \x01(\t\x12\r\n\x05label\x18\x03 \x01(\t\"\x9e\x01\n\x10MultiScanRequest\x12\x34\n\nreferences\x18\x01 \x03(\x0b\x32 .symbol_detector.SymbolReference\x12\x17\n\x0f\x62lueprint_image\x18\x02 \x01(\x0c\x12+\n\x06\x65ngine\x18\x03 \x01(\x0e\x32\x1b.symbol_detector.ScanEngine\x12\x0e\n\x06scales\x18\x04 \x03(\x02\"c\n\rSymbolMatches\x12\r\n\x05label\x18\x01 \x01(\t\x12\x14\n\x0creference_id\x18\x02 \x01(\t\x12-\n\x07matches\x18\x03 \x03(\x0b\x32\x1c.symbol_detector.BoundingBox\"\x85\x01\n\x11MultiScanResponse\x12/\n\x07symbols\x18\x01 \x03(\x0b\x32\x1e.symbol_detector.SymbolMatches\x12\x0f\n\x07message\x18\x02 \x01(\t\x12.\n\x07\x63\x61scade\x18\x03 \x01(\x0b\x32\x1d.symbol_detector.CascadeStats\"w\n\x14LibrarySearchRequest\x12\x17\n\x0freference_image\x18\x01 \x01(\x0c\x12\x14\n\x0creference_id\x18\x02 \x01(\t\x12\r\n\x05top_k\x18\x03 \x01(\x05\x12\x0e\n\x06nprobe\x18\x04 \x01(\x05\x12\x11\n\tmin_score\x18\x05 \x01(\x02\"V\n\nLibraryHit\x12\x0c\n\x04page\x18\x01 \x01(\t\x12\x0f\n\x07page_id\x18\x02 \x01(\x05\x12)\n\x03\x62ox\x18\x03 \x01(\x0b\x32\x1c.symbol_detector.BoundingBox\"s\n\x15LibrarySearchResponse\x12)\n\x04hits\x18\x01 \x03(\x0b\x32\x1b.symbol_detector.LibraryHit\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\r\n\x05pages\x18\x03 \x01(\x05\x12\x0f\n\x07windows\x18\x04 \x01(\x03\";\n\x12LibraryPageRequest\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x17\n\x0f\x62lueprint_image\x18\x02 \x01(\x0c\"F\n\x13LibraryPageResponse\x12\x0f\n\x07windows\x18\x01 \x01(\x05\x12\r\n\x05pages\x18\x02 \x01(\x05\x12\x0f\n\x07message\x18\x03 \x01(\t\"\x0f\n\rHealthRequest\"x\n\x0eHealthResponse\x12.\n\x06status\x18\x01 \x01(\x0e\x32\x1e.symbol_detector.ServingStatus\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x0f\n\x07\x62\x61\x63kend\x18\x03 \x01(\t\x12\x14\n\x0cload_seconds\x18\x04 \x01(\x01\"\x0e\n\x0cStatsRequest\"\x8f\x01\n\x08RpcStats\x12\x0b\n\x03rpc\x18\x01 \x01(\t\x12\x10\n\x08requests\x18\x02 \x01(\x03\x12\x0e\n\x06\x65rrors\x18\x03 \x01(\x03\x12\x15\n\rseconds_total\x18\x04 \x01(\x01\x12\x13\n\x0bp50_seconds\x18\x05 \x01(\x01\x12\x13\n\x0bp95_seconds\x18\x06 \x01(\x01\x12\x13\n\x0bp99_seconds\x18\x07 \x01(\x01\"\xf6\x01\n\rStatsResponse\x12\x0f\n\x07\x65nabled\x18\x01 \x01(\x08\x12\'\n\x04rpcs\x18\x02 \x03(\x0b\x32\x19.symbol_detector.RpcStats\x12,\n\x06stages\x18\x03 \x03(\x0b\x32\x1c.symbol_detector.StageTiming\x12>\n\x08\x63ounters\x18\x04 \x03(\x0b\x32,.symbol_detector.StatsResponse.CountersEntry\x12\x0c\n\x04text\x18\x05 \x01(\t\x1a/\n\rCountersEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x01:\x02\x38\x01\"]\n\x13\x44ocumentScanRequest\x12*\n\x04scan\x18\x01 \x01(\x0b\x32\x1c.symbol_detector.ScanRequest\x12\x0b\n\x03\x64pi\x18\x02 \x01(\x02\x12\r\n\x05pages\x18\x03 \x03(\r\"\xd9\x01\n\x12\x44ocumentPageResult\x12\x0c\n\x04page\x18\x01 \x01(\r\x12\x12\n\npages_done\x18\x02 \x01(\r\x12\x13\n\x0bpages_total\x18\x03 \x01(\r\x12\r\n\x05width\x18\x04 \x01(\x05\x12\x0e\n\x06height\x18\x05 \x01(\x05\x12-\n\x07matches\x18\x06 \x03(\x0b\x32\x1c.symbol_detector.BoundingBox\x12\x0f\n\x07message\x18\x07 \x01(\t\x12-\n\x07timings\x18\x08 \x01(\x0b\x32\x1c.symbol_detector.ScanTimings*C\n\nScanEngine\x12\x0f\n\x0b\x45NGINE_CROP\x10\x00\x12\x10\n\x0c\x45NGINE_DENSE\x10\x01\x12\x12\n\x0e\x45NGINE_CASCADE\x10\x02*K\n\rServingStatus\x12\x13\n\x0fSTATUS_STARTING\x10\x00\x12\x12\n\x0eSTATUS_SERVING\x10\x01\x12\x11\n\rSTATUS_FAILED\x10\x02\x32\xb2\x08\n\x0eSymbolDetector\x12L\n\x07Predict\x12\x1f.symbol_detector.PredictRequest\x1a .symbol_detector.PredictResponse\x12L\n\rScanBlueprint\x12\x1c.symbol_detector.ScanRequest\x1a\x1d.symbol_detector.ScanResponse\x12j\n\x11RegisterReference\x12).symbol_detector.RegisterReferenceRequest\x1a*.symbol_detector.RegisterReferenceResponse\x12T\n\x13ScanBlueprintStream\x12\x1c.symbol_detector.ScanRequest\x1a\x1d.symbol_detector.ScanProgress0\x01\x12X\n\x13ScanBlueprintUpload\x12 .symbol_detector.ScanUploadChunk\x1a\x1d.symbol_detector.ScanResponse(\x01\x12I\n\x06Health\x12\x1e.symbol_detector.HealthRequest\x1a\x1f.symbol_detector.HealthResponse\x12[\n\x12ScanBlueprintMulti\x12!.symbol_detector.MultiScanRequest\x1a\".symbol_detector.MultiScanResponse\x12^\n\rSearchLibrary\x12%.symbol_detector.LibrarySearchRequest\x1a&.symbol_detector.LibrarySearchResponse\x12[\n\x0e\x41\x64\x64LibraryPage\x12#.symbol_detector.LibraryPageRequest\x1a$.symbol_detector.LibraryPageResponse\x12I\n\x08GetStats\x12\x1d.symbol_detector.StatsRequest\x1a\x1e.symbol_detector.StatsResponse\x12[\n\x0cPredictBatch\x12$.symbol_detector.PredictBatchRequest\x1a%.symbol_detector.PredictBatchResponse\x12[\n\x0cScanDocument\x12$.symbol_detector.DocumentScanRequest\x1a#.symbol_detector.DocumentPageResult0\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'symbol_detector_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
   DESCRIPTOR._options = None
+  _globals['_STATSRESPONSE_COUNTERSENTRY']._options = None
+  _globals['_STATSRESPONSE_COUNTERSENTRY']._serialized_options = b'8\001'
+  _globals['_SCANENGINE']._serialized_start=3596
+  _globals['_SCANENGINE']._serialized_end=3663
+  _globals['_SERVINGSTATUS']._serialized_start=3665
+  _globals['_SERVINGSTATUS']._serialized_end=3740
   _globals['_PREDICTREQUEST']._serialized_start=42
   _globals['_PREDICTREQUEST']._serialized_end=104
   _globals['_PREDICTRESPONSE']._serialized_start=106
   _globals['_PREDICTRESPONSE']._serialized_end=184
-  _globals['_SCANREQUEST']._serialized_start=186
-  _globals['_SCANREQUEST']._serialized_end=249
-  _globals['_BOUNDINGBOX']._serialized_start=251
-  _globals['_BOUNDINGBOX']._serialized_end=332
-  _globals['_SCANRESPONSE']._serialized_start=334
-  _globals['_SCANRESPONSE']._serialized_end=412
-  _globals['_SYMBOLDETECTOR']._serialized_start=415
-  _globals['_SYMBOLDETECTOR']._serialized_end=587
+  _globals['_PREDICTBATCHREQUEST']._serialized_start=186
+  _globals['_PREDICTBATCHREQUEST']._serialized_end=293
+  _globals['_PREDICTBATCHRESPONSE']._serialized_start=296
+  _globals['_PREDICTBATCHRESPONSE']._serialized_end=448
+  _globals['_SCANREQUEST']._serialized_start=451
+  _globals['_SCANREQUEST']._serialized_end=703
+  _globals['_BOUNDINGBOX']._serialized_start=705
+  _globals['_BOUNDINGBOX']._serialized_end=822
+  _globals['_CASCADESTATS']._serialized_start=824
+  _globals['_CASCADESTATS']._serialized_end=930
+  _globals['_STAGETIMING']._serialized_start=932
+  _globals['_STAGETIMING']._serialized_end=977
+  _globals['_SCANTIMINGS']._serialized_start=980
+  _globals['_SCANTIMINGS']._serialized_end=1116
+  _globals['_SCANRESPONSE']._serialized_start=1119
+  _globals['_SCANRESPONSE']._serialized_end=1292
+  _globals['_SCANPROGRESS']._serialized_start=1295
+  _globals['_SCANPROGRESS']._serialized_end=1509
+  _globals['_SCANUPLOADCHUNK']._serialized_start=1511
+  _globals['_SCANUPLOADCHUNK']._serialized_end=1614
+  _globals['_REGISTERREFERENCEREQUEST']._serialized_start=1616
+  _globals['_REGISTERREFERENCEREQUEST']._serialized_end=1688
+  _globals['_REGISTERREFERENCERESPONSE']._serialized_start=1690
+  _globals['_REGISTERREFERENCERESPONSE']._serialized_end=1791
+  _globals['_SYMBOLREFERENCE']._serialized_start=1793
+  _globals['_SYMBOLREFERENCE']._serialized_end=1872
+  _globals['_MULTISCANREQUEST']._serialized_start=1875
+  _globals['_MULTISCANREQUEST']._serialized_end=2033
+  _globals['_SYMBOLMATCHES']._serialized_start=2035
+  _globals['_SYMBOLMATCHES']._serialized_end=2134
+  _globals['_MULTISCANRESPONSE']._serialized_start=2137
+  _globals['_MULTISCANRESPONSE']._serialized_end=2270
+  _globals['_LIBRARYSEARCHREQUEST']._serialized_start=2272
+  _globals['_LIBRARYSEARCHREQUEST']._serialized_end=2391
+  _globals['_LIBRARYHIT']._serialized_start=2393
+  _globals['_LIBRARYHIT']._serialized_end=2479
+  _globals['_LIBRARYSEARCHRESPONSE']._serialized_start=2481
+  _globals['_LIBRARYSEARCHRESPONSE']._serialized_end=2596
+  _globals['_LIBRARYPAGEREQUEST']._serialized_start=2598
+  _globals['_LIBRARYPAGEREQUEST']._serialized_end=2657
+  _globals['_LIBRARYPAGERESPONSE']._serialized_start=2659
+  _globals['_LIBRARYPAGERESPONSE']._serialized_end=2729
+  _globals['_HEALTHREQUEST']._serialized_start=2731
+  _globals['_HEALTHREQUEST']._serialized_end=2746
+  _globals['_HEALTHRESPONSE']._serialized_start=2748
+  _globals['_HEALTHRESPONSE']._serialized_end=2868
+  _globals['_STATSREQUEST']._serialized_start=2870
+  _globals['_STATSREQUEST']._serialized_end=2884
+  _globals['_RPCSTATS']._serialized_start=2887
+  _globals['_RPCSTATS']._serialized_end=3030
+  _globals['_STATSRESPONSE']._serialized_start=3033
+  _globals['_STATSRESPONSE']._serialized_end=3279
+  _globals['_STATSRESPONSE_COUNTERSENTRY']._serialized_start=3232
+  _globals['_STATSRESPONSE_COUNTERSENTRY']._serialized_end=3279
+  _globals['_DOCUMENTSCANREQUEST']._serialized_start=3281
+  _globals['_DOCUMENTSCANREQUEST']._serialized_end=3374
+  _globals['_DOCUMENTPAGERESULT']._serialized_start=3377
+  _globals['_DOCUMENTPAGERESULT']._serialized_end=3594
+  _globals['_SYMBOLDETECTOR']._serialized_start=3743
+  _globals['_SYMBOLDETECTOR']._serialized_end=4817
 # @@protoc_insertion_point(module_scope)
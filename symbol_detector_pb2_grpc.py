@@ -24,6 +24,56 @@ class SymbolDetectorStub(object):
                 request_serializer=symbol__detector__pb2.ScanRequest.SerializeToString,
                 response_deserializer=symbol__detector__pb2.ScanResponse.FromString,
                 )
+        self.RegisterReference = channel.unary_unary(
+                '/symbol_detector.SymbolDetector/RegisterReference',
+                request_serializer=symbol__detector__pb2.RegisterReferenceRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.RegisterReferenceResponse.FromString,
+                )
+        self.ScanBlueprintStream = channel.unary_stream(
+                '/symbol_detector.SymbolDetector/ScanBlueprintStream',
+                request_serializer=symbol__detector__pb2.ScanRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.ScanProgress.FromString,
+                )
+        self.ScanBlueprintUpload = channel.stream_unary(
+                '/symbol_detector.SymbolDetector/ScanBlueprintUpload',
+                request_serializer=symbol__detector__pb2.ScanUploadChunk.SerializeToString,
+                response_deserializer=symbol__detector__pb2.ScanResponse.FromString,
+                )
+        self.Health = channel.unary_unary(
+                '/symbol_detector.SymbolDetector/Health',
+                request_serializer=symbol__detector__pb2.HealthRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.HealthResponse.FromString,
+                )
+        self.ScanBlueprintMulti = channel.unary_unary(
+                '/symbol_detector.SymbolDetector/ScanBlueprintMulti',
+                request_serializer=symbol__detector__pb2.MultiScanRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.MultiScanResponse.FromString,
+                )
+        self.SearchLibrary = channel.unary_unary(
+                '/symbol_detector.SymbolDetector/SearchLibrary',
+                request_serializer=symbol__detector__pb2.LibrarySearchRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.LibrarySearchResponse.FromString,
+                )
+        self.AddLibraryPage = channel.unary_unary(
+                '/symbol_detector.SymbolDetector/AddLibraryPage',
+                request_serializer=symbol__detector__pb2.LibraryPageRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.LibraryPageResponse.FromString,
+                )
+        self.GetStats = channel.unary_unary(
+                '/symbol_detector.SymbolDetector/GetStats',
+                request_serializer=symbol__detector__pb2.StatsRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.StatsResponse.FromString,
+                )
+        self.PredictBatch = channel.unary_unary(
+                '/symbol_detector.SymbolDetector/PredictBatch',
+                request_serializer=symbol__detector__pb2.PredictBatchRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.PredictBatchResponse.FromString,
+                )
+        self.ScanDocument = channel.unary_stream(
+                '/symbol_detector.SymbolDetector/ScanDocument',
+                request_serializer=symbol__detector__pb2.DocumentScanRequest.SerializeToString,
+                response_deserializer=symbol__detector__pb2.DocumentPageResult.FromString,
+                )
 
 
 class SymbolDetectorServicer(object):
@@ -44,6 +94,89 @@ class SymbolDetectorServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def RegisterReference(self, request, context):
+        """RPC 3: Register a reference symbol once, then scan many pages with its id
+        (ScanRequest.reference_id) instead of resending the image every time.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ScanBlueprintStream(self, request, context):
+        """RPC 4: Same scan as ScanBlueprint, but matches stream back as row bands
+        finish instead of arriving all at once at the end.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ScanBlueprintUpload(self, request_iterator, context):
+        """RPC 5: ScanBlueprint for pages of any size. The blueprint is uploaded in
+        chunks, so no single message has to hold the whole file.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Health(self, request, context):
+        """RPC 6: Readiness. The port opens before the model has loaded; other RPCs
+        return UNAVAILABLE until this reports STATUS_SERVING.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ScanBlueprintMulti(self, request, context):
+        """RPC 7: Find many symbol types on one page in a single pass. References
+        with the same size share the page's window embeddings; matches are
+        returned (and NMS'd) per symbol.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SearchLibrary(self, request, context):
+        """RPC 8: Where across a whole drawing set does this symbol appear? Returns
+        the top-k windows of the server's symbol library (server --library).
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AddLibraryPage(self, request, context):
+        """RPC 9: Adds a page to the symbol library as it arrives (pages already in
+        it are skipped).
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetStats(self, request, context):
+        """RPC 10: Request counts, latencies and per-stage scan time since startup
+        (server --metrics); also served as Prometheus text by --metrics-port.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def PredictBatch(self, request, context):
+        """RPC 11: Predict for many pairs at once: every reference against every
+        query, embedded in batched forward passes. Returns the score matrix, or
+        the top-k queries per reference.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ScanDocument(self, request, context):
+        """RPC 12: Scans every page of a drawing set (PDF or multi-page TIFF) for
+        one reference. Pages are rasterized one ahead of the scan and each
+        page's matches stream back as soon as it is done.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_SymbolDetectorServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -57,6 +190,56 @@ def add_SymbolDetectorServicer_to_server(servicer, server):
                     request_deserializer=symbol__detector__pb2.ScanRequest.FromString,
                     response_serializer=symbol__detector__pb2.ScanResponse.SerializeToString,
             ),
+            'RegisterReference': grpc.unary_unary_rpc_method_handler(
+                    servicer.RegisterReference,
+                    request_deserializer=symbol__detector__pb2.RegisterReferenceRequest.FromString,
+                    response_serializer=symbol__detector__pb2.RegisterReferenceResponse.SerializeToString,
+            ),
+            'ScanBlueprintStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.ScanBlueprintStream,
+                    request_deserializer=symbol__detector__pb2.ScanRequest.FromString,
+                    response_serializer=symbol__detector__pb2.ScanProgress.SerializeToString,
+            ),
+            'ScanBlueprintUpload': grpc.stream_unary_rpc_method_handler(
+                    servicer.ScanBlueprintUpload,
+                    request_deserializer=symbol__detector__pb2.ScanUploadChunk.FromString,
+                    response_serializer=symbol__detector__pb2.ScanResponse.SerializeToString,
+            ),
+            'Health': grpc.unary_unary_rpc_method_handler(
+                    servicer.Health,
+                    request_deserializer=symbol__detector__pb2.HealthRequest.FromString,
+                    response_serializer=symbol__detector__pb2.HealthResponse.SerializeToString,
+            ),
+            'ScanBlueprintMulti': grpc.unary_unary_rpc_method_handler(
+                    servicer.ScanBlueprintMulti,
+                    request_deserializer=symbol__detector__pb2.MultiScanRequest.FromString,
+                    response_serializer=symbol__detector__pb2.MultiScanResponse.SerializeToString,
+            ),
+            'SearchLibrary': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchLibrary,
+                    request_deserializer=symbol__detector__pb2.LibrarySearchRequest.FromString,
+                    response_serializer=symbol__detector__pb2.LibrarySearchResponse.SerializeToString,
+            ),
+            'AddLibraryPage': grpc.unary_unary_rpc_method_handler(
+                    servicer.AddLibraryPage,
+                    request_deserializer=symbol__detector__pb2.LibraryPageRequest.FromString,
+                    response_serializer=symbol__detector__pb2.LibraryPageResponse.SerializeToString,
+            ),
+            'GetStats': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetStats,
+                    request_deserializer=symbol__detector__pb2.StatsRequest.FromString,
+                    response_serializer=symbol__detector__pb2.StatsResponse.SerializeToString,
+            ),
+            'PredictBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.PredictBatch,
+                    request_deserializer=symbol__detector__pb2.PredictBatchRequest.FromString,
+                    response_serializer=symbol__detector__pb2.PredictBatchResponse.SerializeToString,
+            ),
+            'ScanDocument': grpc.unary_stream_rpc_method_handler(
+                    servicer.ScanDocument,
+                    request_deserializer=symbol__detector__pb2.DocumentScanRequest.FromString,
+                    response_serializer=symbol__detector__pb2.DocumentPageResult.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'symbol_detector.SymbolDetector', rpc_method_handlers)
@@ -100,3 +283,173 @@ class SymbolDetector(object):
             symbol__detector__pb2.ScanResponse.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def RegisterReference(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/symbol_detector.SymbolDetector/RegisterReference',
+            symbol__detector__pb2.RegisterReferenceRequest.SerializeToString,
+            symbol__detector__pb2.RegisterReferenceResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ScanBlueprintStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/symbol_detector.SymbolDetector/ScanBlueprintStream',
+            symbol__detector__pb2.ScanRequest.SerializeToString,
+            symbol__detector__pb2.ScanProgress.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ScanBlueprintUpload(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/symbol_detector.SymbolDetector/ScanBlueprintUpload',
+            symbol__detector__pb2.ScanUploadChunk.SerializeToString,
+            symbol__detector__pb2.ScanResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Health(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/symbol_detector.SymbolDetector/Health',
+            symbol__detector__pb2.HealthRequest.SerializeToString,
+            symbol__detector__pb2.HealthResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ScanBlueprintMulti(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/symbol_detector.SymbolDetector/ScanBlueprintMulti',
+            symbol__detector__pb2.MultiScanRequest.SerializeToString,
+            symbol__detector__pb2.MultiScanResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SearchLibrary(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/symbol_detector.SymbolDetector/SearchLibrary',
+            symbol__detector__pb2.LibrarySearchRequest.SerializeToString,
+            symbol__detector__pb2.LibrarySearchResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def AddLibraryPage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/symbol_detector.SymbolDetector/AddLibraryPage',
+            symbol__detector__pb2.LibraryPageRequest.SerializeToString,
+            symbol__detector__pb2.LibraryPageResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetStats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/symbol_detector.SymbolDetector/GetStats',
+            symbol__detector__pb2.StatsRequest.SerializeToString,
+            symbol__detector__pb2.StatsResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def PredictBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/symbol_detector.SymbolDetector/PredictBatch',
+            symbol__detector__pb2.PredictBatchRequest.SerializeToString,
+            symbol__detector__pb2.PredictBatchResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ScanDocument(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/symbol_detector.SymbolDetector/ScanDocument',
+            symbol__detector__pb2.DocumentScanRequest.SerializeToString,
+            symbol__detector__pb2.DocumentPageResult.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -0,0 +1,191 @@
+import io
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image, ImageDraw
+
+from scanner import (FEATURE_STRIDE, PREPROCESS_TOLERANCE, BlueprintScanner, IncrementalNMS, boxes_to_array,
+                     nms_array, reference_template)
+
+
+class PixelModel:
+    """Stand-in for SiameseNetwork: a window's embedding is its 8x8 average-pooled ink."""
+
+    def image_to_tensor(self, image):
+        return torch.from_numpy(np.array(image.convert("RGB"), dtype=np.float32)).permute(2, 0, 1) / 255
+
+    def windows_to_batch(self, windows):
+        return windows
+
+    def get_embeddings(self, batch):
+        return 1 - F.adaptive_avg_pool2d(batch.mean(1, keepdim=True), 8).flatten(1)
+
+    def compute_similarities(self, emb, embs):
+        ref = F.normalize(emb, dim=-1)
+        return F.normalize(embs, dim=1) @ (ref if ref.dim() == 1 else ref.T)
+
+
+class CellModel(PixelModel):
+    """Stand-in with a feature map: a random projection of every 32x32 cell, then ReLU.
+
+    Like the ResNet trunk, a window's embedding is the average of its 224x224
+    input's feature map, so the dense and crop engines can be compared.
+    """
+
+    device = "cpu"
+
+    def __init__(self):
+        generator = torch.Generator().manual_seed(0)
+        self.weight = torch.randn(16, 3, FEATURE_STRIDE, FEATURE_STRIDE, generator=generator) / FEATURE_STRIDE
+
+    def image_to_tensor(self, image):
+        return (super().image_to_tensor(image) - 0.5) / 0.25
+
+    def to_tensor(self, image):
+        return self.image_to_tensor(image)
+
+    def windows_to_batch(self, windows):
+        return F.interpolate(windows, size=(224, 224), mode="bilinear", align_corners=False, antialias=True)
+
+    def get_feature_map(self, batch):
+        return F.relu(F.conv2d(batch, self.weight, stride=FEATURE_STRIDE))
+
+    def get_embeddings(self, batch):
+        return self.get_feature_map(batch).mean((2, 3))
+
+
+def _boxes(matches):
+    return sorted((m["x"], m["y"], round(m["score"], 6)) for m in matches)
+
+
+def _loop_nms(boxes, iou_threshold):
+    # The pop(0) / pairwise calculate_iou loop apply_nms replaced
+    iou = BlueprintScanner(PixelModel()).calculate_iou
+    boxes = sorted(boxes, key=lambda b: b["score"], reverse=True)
+    keep = []
+    while boxes:
+        current = boxes.pop(0)
+        keep.append(current)
+        boxes = [b for b in boxes if iou(current, b) < iou_threshold]
+    return keep
+
+
+def _random_boxes(rng, n, page=400):
+    # Two window sizes, integer positions, scores on a coarse grid so many tie
+    sizes = rng.choice([24, 40], size=n)
+    return [{"x": int(x), "y": int(y), "width": int(s), "height": int(s), "score": float(v)}
+            for x, y, s, v in zip(rng.integers(0, page, n), rng.integers(0, page, n), sizes,
+                                  rng.integers(80, 100, n) / 100)]
+
+
+def test_nms_matches_loop():
+    scanner = BlueprintScanner(PixelModel())
+    rng = np.random.default_rng(0)
+    assert scanner.apply_nms([]) == []
+    assert nms_array(np.zeros((0, 5))).size == 0
+    for n in (1, 2, 50, 400):
+        boxes = _random_boxes(rng, n)
+        for iou_threshold in (0.0, 0.1, 0.5):
+            expected = _loop_nms(boxes, iou_threshold)
+            for use_grid in (False, True):
+                kept = scanner.apply_nms(boxes, iou_threshold, use_grid=use_grid)
+                assert [id(b) for b in kept] == [id(b) for b in expected]
+                kept = scanner.apply_nms(boxes_to_array(boxes), iou_threshold, use_grid=use_grid)
+                assert kept == expected
+
+
+def test_incremental_nms_matches_one_pass():
+    rng = np.random.default_rng(1)
+    for iou_threshold in (0.0, 0.1, 0.5):
+        arr = boxes_to_array(_random_boxes(rng, 300))
+        arr = arr[np.argsort(arr[:, 1], kind="stable")]
+        incremental = IncrementalNMS(iou_threshold)
+        final = []
+        # Bands of candidates in scan order: every later box starts at or below the frontier
+        for top in range(0, 400, 30):
+            incremental.add(arr[(arr[:, 1] >= top) & (arr[:, 1] < top + 30)])
+            final.append(incremental.flush(top + 30))
+        final.append(incremental.flush())
+        final = np.concatenate(final)
+        expected = arr[nms_array(arr, iou_threshold)]
+        assert sorted(map(tuple, final.tolist())) == sorted(map(tuple, expected.tolist()))
+
+
+def test_streamed_cascade_matches_unary_with_close_peaks():
+    # Two copies of a symbol 0.7 window heights apart: the band below both
+    # refines a window above its own first row, which must still be
+    # suppressed against the box an earlier band already produced
+    rng = np.random.default_rng(0)
+    symbol = np.full((40, 40), 255, np.uint8)
+    symbol[4:26, 6:34] = np.where(rng.random((22, 28)) < 0.4, 0, 255)
+    page = np.full((200, 60), 255, np.uint8)
+    for y in (44, 72):
+        page[y:y + 40, 10:50] = np.minimum(page[y:y + 40, 10:50], symbol)
+    encoded = io.BytesIO()
+    Image.fromarray(page).save(encoded, format="PNG")
+
+    reference = Image.fromarray(symbol)
+    for tiled in (False, True):
+        scanner = BlueprintScanner(PixelModel(), stream_band_rows=1, tiled=tiled)
+        embedding = scanner.model.get_embeddings(scanner.model.image_to_tensor(reference)[None])[0]
+        kwargs = dict(threshold=0.5, engine="cascade", template=reference_template(reference))
+        unary = BlueprintScanner(PixelModel()).scan_with_reference(
+            embedding, (40, 40), encoded.getvalue(), **kwargs)
+        streamed = [m for _, _, found in scanner.iter_scan(embedding, (40, 40), encoded.getvalue(), **kwargs)
+                    for m in found]
+        assert _boxes(streamed) == _boxes(unary)
+        assert len(unary) == 1
+
+
+def test_ranked_scan_matches_full_scan():
+    # Copies with less and less of their ink, so every box has its own score
+    rng = np.random.default_rng(0)
+    symbol = np.full((40, 40), 255, np.uint8)
+    symbol[4:36, 6:34] = np.where(rng.random((32, 28)) < 0.4, 0, 255)
+    page = np.full((200, 300), 255, np.uint8)
+    for k, (x, y) in enumerate([(20, 20), (140, 40), (220, 120), (60, 140), (180, 0)]):
+        copy = symbol.copy()
+        copy[rng.random(copy.shape) < 0.08 * k] = 255
+        page[y:y + 40, x:x + 40] = copy
+    encoded = io.BytesIO()
+    Image.fromarray(page).save(encoded, format="PNG")
+    blank = io.BytesIO()
+    Image.new("L", (300, 200), 255).save(blank, format="PNG")
+
+    reference = Image.fromarray(symbol)
+    scanner = BlueprintScanner(PixelModel())
+    embedding = scanner.model.get_embeddings(scanner.model.image_to_tensor(reference)[None])[0]
+    for engine in ("crop", "cascade"):
+        kwargs = dict(threshold=0.5, engine=engine, template=reference_template(reference))
+        full = scanner.scan_with_reference(embedding, (40, 40), encoded.getvalue(), **kwargs)
+        assert len(full) == 5
+        for k in (1, 2, 3, 10):
+            ranked = scanner.scan_ranked(embedding, (40, 40), encoded.getvalue(), max_results=k, **kwargs)
+            assert ranked == full[:k]
+        found = scanner.scan_ranked(embedding, (40, 40), encoded.getvalue(), exists=True, **kwargs)
+        assert len(found) == 1 and found[0] in full
+        assert scanner.scan_ranked(embedding, (40, 40), blank.getvalue(), exists=True, **kwargs) == []
+
+
+def test_dense_scores_match_crop_scores():
+    # 224px windows: the page is not resized, so both engines see the same
+    # pixels and any difference comes from pooling the shared feature map
+    page = Image.new("L", (640, 480), 255)
+    draw = ImageDraw.Draw(page)
+    draw.rectangle([60, 90, 260, 180], outline=0, width=6)
+    draw.ellipse([420, 40, 560, 190], fill=0)
+    draw.line([0, 420, 640, 330], fill=0, width=10)
+    draw.rectangle([480, 300, 620, 460], fill=96)
+
+    scanner = BlueprintScanner(CellModel(), dense_tile_cells=4)
+    reference = scanner.model.image_to_tensor(page.crop((64, 96, 288, 320)))
+    embedding = scanner.model.get_embeddings(scanner.model.windows_to_batch(reference[None]))[0]
+    tiles = 0
+    for xs, ys, scores in scanner.dense_scores(page, embedding, (224, 224)):
+        tiles += 1
+        for y, row in zip(ys, scores):
+            crop = torch.cat([e for _, e in scanner.embed_positions(page, (224, 224), [(y, xs)])])
+            expected = scanner.model.compute_similarities(embedding, crop)
+            assert torch.allclose(row, expected, rtol=0, atol=PREPROCESS_TOLERANCE)
+    assert tiles > 1
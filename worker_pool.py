@@ -0,0 +1,238 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+    from server.cancellation import check as check_cancelled
+    from server.model import SiameseNetwork
+    from server.page_reader import load_page
+    from server.scanner import (ORIENTATIONS, BlueprintScanner, _add_stats, array_to_boxes, group_references,
+                                oriented_nms)
+except ImportError:
+    from cancellation import check as check_cancelled
+    from model import SiameseNetwork
+    from page_reader import load_page
+    from scanner import (ORIENTATIONS, BlueprintScanner, _add_stats, array_to_boxes, group_references,
+                         oriented_nms)
+
+# Per-process state, set up once by _init_worker
+_scanner = None
+
+
+def _init_worker(torch_threads, batch_size, dense_tile_cells, model_options, scanner_options):
+    global _scanner
+    # Keep workers x threads <= cores, otherwise they just fight each other
+    torch.set_num_threads(max(1, int(torch_threads)))
+    _scanner = BlueprintScanner(SiameseNetwork(**model_options), batch_size=batch_size,
+                                dense_tile_cells=dense_tile_cells, **scanner_options)
+    # Workers live as long as the pool, so pay lazy init here rather than on a scan
+    _scanner.model.warm_up(batch_size)
+
+
+def _ready():
+    return os.getpid()
+
+
+def _shared_mode(image):
+    # Grey / 1-bit pages stay one byte per pixel; colour goes as RGBX, which PIL maps as is
+    return "L" if image.mode == "L" else "RGBX"
+
+
+def _scan_band(shm_name, size, mode, rows, ref_embedding, window_size, threshold, engine, template=None,
+               oriented=False):
+    """Runs one row band of one page level.
+
+    Returns its [N,5] candidates (level coordinates; one array per reference
+    for a [K,D] ref_embedding) and the band's cascade stage counts (empty for
+    the other engines).
+    """
+    # Spawned workers share the parent's resource tracker, so attaching here
+    # doesn't take ownership; the parent unlinks the block after the scan
+    shm = shared_memory.SharedMemory(name=shm_name)
+    image = None
+    try:
+        # Zero-copy view of the shared page; crops are converted to RGB one by one
+        image = Image.frombuffer(mode, size, shm.buf, "raw", mode, 0, 1)
+        ref = torch.from_numpy(ref_embedding).to(_scanner.model.device)
+        stats = {}
+        candidates = _scanner._candidates(engine, template, stats, oriented)
+        band = candidates(image, ref, window_size, threshold, rows=rows)
+        return band, stats
+    finally:
+        # The view must be gone before close(), which raises BufferError otherwise
+        image = None
+        try:
+            shm.close()
+        except BufferError:
+            # Still held by the traceback of an error raised above: let that
+            # error through; the mapping is closed once it is collected
+            pass
+
+
+class ScanWorkerPool:
+    """Runs scans across several processes, each with its own SiameseNetwork.
+
+    PIL cropping, transforms and the scan loop are GIL-bound, so one process
+    can't keep a many-core box busy. The page (every pyramid level) is decoded
+    once in the parent and copied into shared memory (L for grey drawings,
+    RGBX for colour), which PIL can map without another copy. Row bands are spread over the workers, and their
+    candidates are merged in page order before one NMS pass, so the result
+    matches BlueprintScanner.scan_with_reference.
+    """
+
+    def __init__(self, num_workers=None, torch_threads=1, batch_size=32, dense_tile_cells=32,
+                 model_options=None, scanner_options=None):
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        # The parent only plans bands and runs NMS
+        self.planner = BlueprintScanner(None, batch_size=batch_size, dense_tile_cells=dense_tile_cells)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            # model_options (backend, calibration images, ...) must match the parent's model
+            initargs=(torch_threads, batch_size, dense_tile_cells, dict(model_options or {}),
+                      dict(scanner_options or {})),
+        )
+
+    def _share(self, image):
+        """Copies a page level into a new shared-memory block (see _shared_mode)."""
+        pixels = np.asarray(image.convert(_shared_mode(image)))
+        shm = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+        np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)[:] = pixels
+        return shm
+
+    def scan_with_reference(self, ref_embedding, window_size, blueprint_bytes, threshold=0.85,
+                            engine="crop", scales=None, template=None, stats=None):
+        """Same contract as BlueprintScanner.scan_with_reference."""
+        if engine not in BlueprintScanner.ENGINES:
+            raise ValueError(f"Unknown scan engine '{engine}', expected one of {BlueprintScanner.ENGINES}")
+
+        blueprint_img = load_page(blueprint_bytes)
+        scales = sorted(set(scales)) if scales else [1.0]
+        ref = ref_embedding.detach().cpu().numpy()
+
+        blocks, jobs = [], []
+        try:
+            for scale, level in self.planner.build_pyramid(blueprint_img, scales):
+                shm = self._share(level)
+                blocks.append(shm)
+                for rows, _ in self.planner._bands(engine, level.size, window_size):
+                    future = self.executor.submit(_scan_band, shm.name, level.size, _shared_mode(level),
+                                                  rows, ref, window_size, threshold, engine, template)
+                    jobs.append((scale, future))
+
+            print(f"Scanning blueprint ({blueprint_img.size}) on {self.num_workers} workers "
+                  f"({len(jobs)} bands), engine={engine}, scales={scales}...")
+
+            # Merge in submission (= page) order so NMS sees the same sequence
+            matches = []
+            for scale, future in jobs:
+                check_cancelled()
+                band, band_stats = future.result()
+                _add_stats(stats, band_stats)
+                if scale != 1.0:
+                    band[:, :4] = np.round(band[:, :4] * scale)
+                matches.append(band)
+        finally:
+            # Bands not started yet are dropped (e.g. the request was cancelled)
+            for job in jobs:
+                job[-1].cancel()
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+        matches = np.concatenate(matches) if matches else np.zeros((0, 5))
+        print(f"Raw candidates: {len(matches)}")
+        clean_matches = self.planner.apply_nms(matches, iou_threshold=0.1)
+        print(f"Final matches: {len(clean_matches)}")
+        if engine == "cascade" and stats is not None:
+            print(f"Cascade: {stats}")
+        return clean_matches
+
+    def scan_multi(self, references, blueprint_bytes, threshold=0.85, engine="crop", scales=None,
+                   stats=None):
+        """Same contract as BlueprintScanner.scan_multi; each band job scores a whole group."""
+        matches = self._multi_candidates(references, blueprint_bytes, threshold, engine, scales, stats,
+                                         f"{len(references)} references")
+        results = [self.planner.apply_nms(m, iou_threshold=0.1) for m in matches]
+        print(f"Final matches per reference: {[len(r) for r in results]}")
+        if engine == "cascade" and stats is not None:
+            print(f"Cascade: {stats}")
+        return results
+
+    def scan_oriented(self, references, blueprint_bytes, threshold=0.85, engine="crop", scales=None,
+                      stats=None):
+        """Same contract as BlueprintScanner.scan_oriented without max_results / exists."""
+        if len(references) != len(ORIENTATIONS):
+            raise ValueError(f"Expected the reference in {len(ORIENTATIONS)} orientations, got {len(references)}")
+        matches = self._multi_candidates(references, blueprint_bytes, threshold, engine, scales, stats,
+                                         f"{len(references)} orientations", oriented=True)
+        results = oriented_nms(matches, iou_threshold=0.1)
+        print(f"Final matches: {len(results)}")
+        if engine == "cascade" and stats is not None:
+            print(f"Cascade: {stats}")
+        return results
+
+    def _multi_candidates(self, references, blueprint_bytes, threshold, engine, scales, stats, what,
+                          oriented=False):
+        """Per reference, its [N,5] candidates in page coordinates, before NMS."""
+        if engine not in BlueprintScanner.ENGINES:
+            raise ValueError(f"Unknown scan engine '{engine}', expected one of {BlueprintScanner.ENGINES}")
+
+        blueprint_img = load_page(blueprint_bytes)
+        scales = sorted(set(scales)) if scales else [1.0]
+        groups = group_references(references)
+
+        blocks, jobs = [], []
+        try:
+            for scale, level in self.planner.build_pyramid(blueprint_img, scales):
+                shm = self._share(level)
+                blocks.append(shm)
+                for window_size, indices, embeddings, templates in groups:
+                    refs = embeddings.detach().cpu().numpy()
+                    for rows, _ in self.planner._bands(engine, level.size, window_size):
+                        future = self.executor.submit(_scan_band, shm.name, level.size, _shared_mode(level),
+                                                      rows, refs, window_size, threshold, engine, templates,
+                                                      oriented)
+                        jobs.append((scale, indices, future))
+
+            print(f"Scanning blueprint ({blueprint_img.size}) for {what} "
+                  f"on {self.num_workers} workers ({len(jobs)} band jobs), engine={engine}, scales={scales}...")
+
+            # Per reference, candidates arrive in the same order as in-process
+            matches = [[] for _ in references]
+            for scale, indices, future in jobs:
+                check_cancelled()
+                bands, band_stats = future.result()
+                _add_stats(stats, band_stats)
+                for k, band in zip(indices, bands):
+                    if scale != 1.0:
+                        band[:, :4] = np.round(band[:, :4] * scale)
+                    matches[k].append(band)
+        finally:
+            # Bands not started yet are dropped (e.g. the request was cancelled)
+            for job in jobs:
+                job[-1].cancel()
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+        return [np.concatenate(m) if m else np.zeros((0, 5)) for m in matches]
+
+    def warm_up(self):
+        """Starts every worker process (model load + warm-up) before the first scan.
+
+        The executor only spawns processes as jobs arrive, and each one runs
+        _init_worker before its first job, so num_workers trivial jobs
+        submitted at once bring the whole pool up.
+        """
+        jobs = [self.executor.submit(_ready) for _ in range(self.num_workers)]
+        return len({job.result() for job in jobs})
+
+    def close(self):
+        self.executor.shutdown(wait=True)